@@ -7,6 +7,7 @@ from django.contrib.auth.decorators import user_passes_test
 from django.shortcuts import render
 
 from standup.status.models import Status, Team, StandupUser
+from standup.status.renderer import LOCAL_RENDER_CACHE, RENDER_CACHE_STATS
 
 
 def require_superuser(fun):
@@ -51,6 +52,14 @@ def statistics_view(request):
         ('Status in last week', Status.objects.filter(created__gte=week).count()),
     ])
 
+    render_cache_stats = RENDER_CACHE_STATS.as_dict()
+    groups['Status render cache (this process)'] = collections.OrderedDict([
+        ('Items in local cache', len(LOCAL_RENDER_CACHE)),
+        ('Local cache hits', render_cache_stats.get('local_hits', 0)),
+        ('Shared cache hits', render_cache_stats.get('shared_hits', 0)),
+        ('Misses', render_cache_stats.get('misses', 0)),
+    ])
+
     context = {
         'title': 'Site statistics',
         'statsitems': groups
@@ -138,6 +138,26 @@ CACHES = {
     'default': config('CACHE_URL', parser=django_cache_url.parse, default='locmem:default')
 }
 
+# Cache for rendered status HTML: an in-process LRU of RENDER_CACHE_SIZE items in
+# front of the default cache
+RENDER_CACHE_ENABLED = config('RENDER_CACHE_ENABLED', default='true', parser=bool)
+RENDER_CACHE_SIZE = config('RENDER_CACHE_SIZE', default='1000', parser=int)
+RENDER_CACHE_TIMEOUT = config('RENDER_CACHE_TIMEOUT', default='86400', parser=int)
+
+# Paging by page number needs a count of statuses. Counts of up to
+# STATUS_COUNT_EXACT_LIMIT are done exactly; bigger ones are estimated or cached
+# for STATUS_COUNT_TIMEOUT seconds or until statuses change.
+STATUS_COUNT_EXACT_LIMIT = config('STATUS_COUNT_EXACT_LIMIT', default='1000', parser=int)
+STATUS_COUNT_TIMEOUT = config('STATUS_COUNT_TIMEOUT', default='300', parser=int)
+
+# The teams, projects and site messages in the nav are cached for this long or
+# until one of them changes
+NAV_CACHE_TIMEOUT = config('NAV_CACHE_TIMEOUT', default='3600', parser=int)
+
+# Feed documents are stored in the default cache for this long and rebuilt when
+# a status is added to or removed from them
+FEED_CACHE_TIMEOUT = config('FEED_CACHE_TIMEOUT', default='86400', parser=int)
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.8/topics/i18n/
 
@@ -262,3 +282,18 @@ django_heroku.settings(locals(), test_runner=False, allowed_hosts=False)
 DEFAULT_SF_STORAGE = ('django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG else
                       'whitenoise.storage.CompressedManifestStaticFilesStorage')
 STATICFILES_STORAGE = config('STATICFILES_STORAGE', default=DEFAULT_SF_STORAGE)
+
+# How SearchView searches statuses: "postgres" uses full-text search and can rank
+# results; "icontains" works with any database; "trigram" matches like icontains
+# but uses Postgres' trigram index; "index" uses the search index in
+# SEARCH_INDEX_DIR, which ./manage.py build_search_index builds. See
+# standup/status/search.py.
+# DATABASES is set by django-heroku above.
+SEARCH_BACKEND = config(
+    'SEARCH_BACKEND',
+    default='postgres' if 'postgresql' in DATABASES['default']['ENGINE'] else 'icontains'  # noqa: F821
+)
+SEARCH_INDEX_DIR = config('SEARCH_INDEX_DIR', default=path('search_index'))
+# Size in bytes past which the search index's journal of changes since it was
+# built is merged into it. See standup/status/index.py.
+SEARCH_INDEX_JOURNAL_LIMIT = config('SEARCH_INDEX_JOURNAL_LIMIT', default='8388608', parser=int)
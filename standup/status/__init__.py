@@ -0,0 +1 @@
+default_app_config = 'standup.status.apps.StatusConfig'
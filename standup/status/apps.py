@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class StatusConfig(AppConfig):
+    name = 'standup.status'
+
+    def ready(self):
+        # Register custom lookups
+        import standup.status.lookups  # noqa
+
+        # Connect signal handlers
+        import standup.status.signals  # noqa
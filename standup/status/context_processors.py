@@ -1,17 +1,42 @@
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
 
 from .models import Project, Team, SiteMessage
-from .utils import get_weeks, get_today, get_yesterday
+from .utils import get_cache_version, get_weeks, get_today, get_yesterday
+
+
+NAV_VERSION_KEY = 'nav-version'
+
+
+def get_nav():
+    """Returns a dict of the teams, projects and site messages every page shows
+
+    These are cached until a team, project or site message changes; see
+    ``standup.status.signals``.
+
+    """
+    key = 'nav:%s' % get_cache_version(NAV_VERSION_KEY)
+    nav = cache.get(key)
+    if nav is None:
+        nav = {
+            'teams': list(Team.objects.all()),
+            'projects': list(Project.objects.all()),
+            'messages': list(SiteMessage.objects.filter(enabled=True)),
+        }
+        cache.set(key, nav, settings.NAV_CACHE_TIMEOUT)
+    return nav
 
 
 def status(request):
+    # These are lazy so pages that don't show the nav don't pay for it.
     return {
         'request': request,
         'settings': settings,
-        'teams': Team.objects.all(),
-        'projects': Project.objects.all(),
-        'weeks': get_weeks(),
+        'teams': SimpleLazyObject(lambda: get_nav()['teams']),
+        'projects': SimpleLazyObject(lambda: get_nav()['projects']),
+        'weeks': SimpleLazyObject(get_weeks),
         'today': get_today(),
         'yesterday': get_yesterday(),
-        'messages': SiteMessage.objects.filter(enabled=True),
+        'messages': SimpleLazyObject(lambda: get_nav()['messages']),
     }
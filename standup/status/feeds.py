@@ -0,0 +1,433 @@
+"""Atom feeds of statuses
+
+Feeds are answered with 304 Not Modified when the client has the current one.
+Otherwise they're served from a stored copy of the feed document if it's
+current and built (and stored) if not.
+
+Whether a feed is current is worked out from its scope (all statuses, a
+user's, a project's, a team's, a tag's or a user's mentions) alone, so writes
+elsewhere don't change it. See ``get_validators()``.
+
+Stored documents are keyed by path and rebuilt once the transaction that
+changed their scope commits (see ``FeedChanges``), so readers polling a feed
+rarely have to wait for it to be built.
+
+"""
+import hashlib
+import logging
+from calendar import timegm
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import NoReverseMatch, resolve, reverse
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import http_date, quote_etag
+
+from standup.status.models import (
+    Project,
+    StandupUser,
+    Status,
+    StatusMention,
+    StatusReference,
+    StatusTag,
+    Team,
+    get_statuses_changed,
+    render_statuses,
+)
+from standup.status.renderer import RENDERER_VERSION, find_tags
+from standup.status.utils import chunked
+
+
+logger = logging.getLogger(__name__)
+
+SCOPE_CHANGED_KEY = 'feed-scope-changed:%s'
+
+
+def scope_changed_key(scope):
+    """Returns the cache key for when the statuses in a scope last changed"""
+    return SCOPE_CHANGED_KEY % hashlib.sha1(('%s:%s' % scope).encode('utf-8')).hexdigest()
+
+
+def get_scope_changed(scope):
+    """Returns when statuses were last edited, removed or moved in or out of a scope
+
+    If that's fallen out of the cache, this starts over from now.
+
+    :arg scope: tuple of (kind, key) like ``('user', 1)``; see ``status_scopes()``
+
+    """
+    key = scope_changed_key(scope)
+    changed = cache.get(key)
+    if changed is None:
+        cache.add(key, timezone.now(), None)
+        changed = cache.get(key)
+    return changed
+
+
+def reference_scope(kind, number, project_id):
+    """Returns the scope of the statuses referring to a bug, pull request or issue"""
+    if kind == 'bug':
+        return (kind, number)
+    return (kind, (project_id, number))
+
+
+def status_scopes(status, scan=True):
+    """Returns the set of scopes of the feeds a status is in
+
+    Scopes are tuples of (kind, key) like ``('user', 1)``. Team scopes aren't
+    included since they'd take a query; ``FeedChanges`` works them out from the
+    user scopes.
+
+    :arg status: the status
+    :arg scan: whether to scan the content for tag and reference scopes; saved
+        statuses can leave that to ``FeedChanges``, which reads them from
+        StatusTag and StatusReference
+
+    """
+    scopes = {('all', None), ('user', status.user_id)}
+    if status.project_id is not None:
+        scopes.add(('project', status.project_id))
+    scopes.update(('mentions', slug) for slug in StatusMention.valid_slugs(status.html_mentions.split()))
+    if scan:
+        scopes.update(('tag', name) for name in StatusTag.valid_names(find_tags(status.content)))
+        scopes.update(
+            reference_scope(kind, number, project_id)
+            for (kind, number), project_id in StatusReference.get_rows(status.content, status.project_id).items()
+        )
+    return scopes
+
+
+class FeedChanges:
+    """The scopes changed in a transaction
+
+    One of these is registered with ``transaction.on_commit()`` per
+    transaction and collects the scopes of everything written in it. When it
+    commits, each scope is bumped and its stored feed documents rebuilt once
+    however many statuses were written.
+
+    """
+    # Most ids to look up in one query
+    chunk_size = 500
+
+    def __init__(self):
+        self.scopes = set()
+        self.status_ids = set()
+
+    def get_scopes(self):
+        """Returns the scopes along with the team, tag and reference scopes they imply"""
+        scopes = set(self.scopes)
+        user_ids = sorted(key for kind, key in scopes if kind == 'user')
+        for chunk in chunked(user_ids, self.chunk_size):
+            team_ids = Team.users.through.objects.filter(
+                standupuser_id__in=chunk
+            ).values_list('team_id', flat=True)
+            scopes.update(('team', team_id) for team_id in team_ids)
+        for chunk in chunked(sorted(self.status_ids), self.chunk_size):
+            names = StatusTag.objects.filter(status_id__in=chunk).values_list('name', flat=True)
+            scopes.update(('tag', name) for name in names)
+            references = StatusReference.objects.filter(status_id__in=chunk).values_list(
+                'kind', 'number', 'project_id'
+            )
+            scopes.update(reference_scope(*reference) for reference in references)
+        return scopes
+
+    def __call__(self):
+        scopes = self.get_scopes()
+        changed = timezone.now()
+        cache.set_many({scope_changed_key(scope): changed for scope in scopes}, None)
+        rebuild_feeds(scope_paths(scopes))
+
+
+def record_feed_changes(scopes=(), status_ids=(), using=None):
+    """Records that statuses in some scopes changed
+
+    Their feeds' validators change once the transaction commits.
+
+    :arg scopes: iterable of scopes; see ``status_scopes()``
+    :arg status_ids: ids of saved statuses whose tag and reference scopes
+        changed
+
+    """
+    connection = transaction.get_connection(using)
+    changes = getattr(connection, 'standup_feed_changes', None)
+    # A rolled back transaction takes its on_commit callbacks with it, so
+    # start over if ours isn't waiting on this one.
+    registered = changes is not None and any(func is changes for _, func in connection.run_on_commit)
+    if not registered:
+        changes = connection.standup_feed_changes = FeedChanges()
+    changes.scopes.update(scopes)
+    changes.status_ids.update(status_ids)
+    if not registered:
+        transaction.on_commit(changes, using)
+
+
+def get_validators(statuses, scope):
+    """Returns (etag, last_modified) for a feed of statuses
+
+    These are cheap to get and only change when a status is added to, edited
+    in or removed from the feed or anything changes what statuses look like:
+
+    * the newest (created, id) in the feed
+    * when statuses in the feed's scope last changed
+    * when how statuses render last changed site-wide (a project's repo_url or
+      a user's slug changing, which is rare)
+    * the renderer version
+
+    :arg statuses: queryset of the statuses in the feed, newest first
+    :arg scope: the feed's scope; see ``status_scopes()``
+
+    """
+    latest = statuses.values_list('created', 'id').first()
+    changed = max(get_scope_changed(scope), get_statuses_changed())
+    last_modified = max(latest[0], changed) if latest else changed
+    data = '%s:%s:%s' % (latest, changed.isoformat(), RENDERER_VERSION)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest(), last_modified
+
+
+def conditional_response(request, statuses, scope, get_response):
+    """Returns 304 Not Modified if the client has the current feed
+
+    :arg request: the request
+    :arg statuses: queryset of the statuses in the feed, newest first
+    :arg scope: the feed's scope; see ``status_scopes()``
+    :arg get_response: callable that takes the feed's etag and returns the
+        feed response
+
+    """
+    etag, last_modified = get_validators(statuses, scope)
+    etag = quote_etag(etag)
+    last_modified = timegm(last_modified.utctimetuple())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response(etag)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def feed_cache_key(path):
+    """Returns the cache key for the stored feed document at a path"""
+    return 'feed-doc:%s' % hashlib.sha1(path.encode('utf-8')).hexdigest()
+
+
+class StatusesFeed(Feed):
+    feed_type = Atom1Feed
+    feed_limit = 50
+    obj_model = None
+
+    def __call__(self, request, *args, **kwargs):
+        try:
+            obj = self.get_object(request, *args, **kwargs)
+        except ObjectDoesNotExist:
+            raise Http404('Feed object does not exist.')
+
+        def get_response(etag):
+            return self.stored_response(request, etag, *args, **kwargs)
+
+        return conditional_response(request, self.statuses(obj), self.scope(obj), get_response)
+
+    def stored_response(self, request, etag, *args, **kwargs):
+        """Returns the stored feed document if it's current or builds and stores it
+
+        Feed documents have absolute urls in them, so a stored one is only
+        used for requests to the same host and scheme it was built for.
+
+        """
+        key = feed_cache_key(request.path)
+        host = request.get_host()
+        doc = cache.get(key)
+        if doc is not None and (doc['etag'], doc['host'], doc['scheme']) == (etag, host, request.scheme):
+            return HttpResponse(doc['content'], content_type=doc['content_type'])
+
+        response = super().__call__(request, *args, **kwargs)
+        cache.set(key, {
+            'etag': etag,
+            'host': host,
+            'scheme': request.scheme,
+            'content': response.content,
+            'content_type': response['Content-Type'],
+        }, settings.FEED_CACHE_TIMEOUT)
+        return response
+
+    def get_object(self, request, slug=None):
+        if self.obj_model is None:
+            return None
+
+        return self.obj_model.objects.get(slug=slug)
+
+    def statuses(self, obj):
+        """Returns the queryset of statuses for the feed, newest first"""
+        return obj.statuses.all()
+
+    def scope(self, obj):
+        """Returns the scope of the feed; see ``status_scopes()``"""
+        return ('all', None)
+
+    def items(self, obj):
+        return render_statuses(self.statuses(obj).select_related('project', 'user')[:self.feed_limit])
+
+    def link(self, obj):
+        if obj is None:
+            return '/'
+
+        return obj.get_absolute_url()
+
+    def item_title(self, item):
+        return 'From {} at {}'.format(item.user.slug,
+                                      item.created.strftime('%I:%M%p %Z'))
+
+    def item_pubdate(self, item):
+        return item.created
+
+    def item_description(self, item):
+        content = str(item.htmlify())
+        if item.project:
+            content = '<h3>%s</h3>%s' % (item.project.name, content)
+
+        return content
+
+
+class MainFeed(StatusesFeed):
+    title = 'All status updates'
+
+    def statuses(self, obj):
+        return Status.objects.all()
+
+
+class UserFeed(StatusesFeed):
+    obj_model = StandupUser
+
+    def title(self, obj):
+        return 'Updates by {}'.format(obj.slug)
+
+    def scope(self, obj):
+        return ('user', obj.pk)
+
+
+class UserMentionsFeed(StatusesFeed):
+    obj_model = StandupUser
+
+    def title(self, obj):
+        return 'Mentions of {}'.format(obj.slug)
+
+    def link(self, obj):
+        return reverse('status.user_mentions', kwargs={'slug': obj.slug})
+
+    def statuses(self, obj):
+        return obj.mentioned_statuses()
+
+    def scope(self, obj):
+        return ('mentions', obj.slug)
+
+
+class ProjectFeed(StatusesFeed):
+    obj_model = Project
+
+    def title(self, obj):
+        return 'Updates for {}'.format(obj.name)
+
+    def scope(self, obj):
+        return ('project', obj.pk)
+
+
+class TeamFeed(StatusesFeed):
+    obj_model = Team
+
+    def title(self, obj):
+        return 'Updates from {}'.format(obj.name)
+
+    def statuses(self, obj):
+        return obj.statuses()
+
+    def scope(self, obj):
+        return ('team', obj.pk)
+
+
+class TagFeed(StatusesFeed):
+    def get_object(self, request, name):
+        return name.lower()
+
+    def title(self, obj):
+        return 'Updates tagged #{}'.format(obj)
+
+    def link(self, obj):
+        return reverse('status.tag', kwargs={'name': obj})
+
+    def statuses(self, obj):
+        return Status.objects.filter(tags__name=obj).order_by('-tags__created', '-tags__status__id')
+
+    def scope(self, obj):
+        return ('tag', obj)
+
+
+def scope_paths(scopes):
+    """Returns the sorted paths of the feeds for some scopes"""
+    ids = {'user': [], 'project': [], 'team': []}
+    feeds = []
+    for kind, key in scopes:
+        if kind == 'all':
+            feeds.append(('status.index_feed', {}))
+        elif kind == 'tag':
+            feeds.append(('status.tag_feed', {'name': key}))
+        elif kind == 'mentions':
+            feeds.append(('status.user_mentions_feed', {'slug': key}))
+        elif kind in ids:
+            ids[kind].append(key)
+        # References only have JSON feeds, which aren't stored
+    for kind, model in (('user', StandupUser), ('project', Project), ('team', Team)):
+        for chunk in chunked(sorted(ids[kind]), FeedChanges.chunk_size):
+            slugs = model.objects.filter(pk__in=chunk).values_list('slug', flat=True)
+            feeds.extend(('status.%s_feed' % kind, {'slug': slug}) for slug in slugs)
+
+    paths = set()
+    for name, kwargs in feeds:
+        try:
+            paths.add(reverse(name, kwargs=kwargs))
+        except NoReverseMatch:
+            # Users without a slug and the like don't have a feed
+            continue
+    return sorted(paths)
+
+
+def rebuild_feeds(paths):
+    """Rebuilds the stored feed documents at the given paths
+
+    Documents are only rebuilt if they've been stored; they're rebuilt for the
+    host and scheme they were stored for. Documents for feeds that no longer
+    exist are deleted. This runs after the commit, so errors are logged and
+    the document left for readers to rebuild rather than raised.
+
+    """
+    for path in paths:
+        key = feed_cache_key(path)
+        doc = cache.get(key)
+        if doc is None:
+            continue
+
+        host, _, port = doc['host'].partition(':')
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'HTTP_HOST': doc['host'],
+            'SERVER_NAME': host,
+            'SERVER_PORT': port or ('443' if doc['scheme'] == 'https' else '80'),
+            'HTTP_X_FORWARDED_PROTO': doc['scheme'],
+            'wsgi.url_scheme': doc['scheme'],
+            'wsgi.input': BytesIO(),
+        })
+        try:
+            match = resolve(path)
+            match.func(request, *match.args, **match.kwargs)
+        except Http404:
+            cache.delete(key)
+        except Exception:
+            logger.exception('Could not rebuild feed %s', path)
+            cache.delete(key)
@@ -0,0 +1,487 @@
+"""In-process inverted index of status content
+
+This is the ``index`` search backend. It answers searches from an inverted
+index (word -> ids of the statuses with that word) so SearchView only has to
+touch the status table for the statuses on the page it shows.
+
+Words are runs of letters, digits and underscores, lowercased. Pairs of
+adjacent words are indexed too and phrases match statuses that have all of
+their pairs. That's exact for two-word phrases and close enough for longer
+ones. Unlike the ``icontains`` backend, words only match whole words.
+
+The index lives in ``SEARCH_INDEX_DIR`` and is two files:
+
+``index``
+    Built by ``./manage.py build_search_index`` and memory-mapped by readers.
+    It's a header, the posting lists, the terms and then a table of (offset,
+    length) of each term and its posting list, sorted by term. Lookups binary
+    search the table in the mapped file, so nothing is loaded up front.
+    Posting lists are arrays of 32-bit unsigned ints: the first status id
+    followed by the gaps between ids.
+
+``journal``
+    One JSON line per status saved or deleted since the index was built.
+    Every process appends to it and replays new lines before searching, so
+    all processes see every change without rebuilding the index. Once it's
+    bigger than ``SEARCH_INDEX_JOURNAL_LIMIT`` bytes, the process that wrote
+    the last line merges it into a new index file in the background (see
+    ``SearchIndex.merge()``).
+
+"""
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import accumulate
+
+from django.conf import settings
+
+from standup.status.search import generate_query, to_tokens
+
+
+MAGIC = b'STANDUPIDX2\n'
+# Offset of the term table and the number of terms in it
+HEADER = struct.Struct('<QQ')
+# Offset and length of a term and then of its posting list
+ENTRY = struct.Struct('<QIQI')
+
+WORD_RE = re.compile(r'\w+')
+
+
+def to_words(text):
+    """Returns the lowercased words in the text"""
+    return WORD_RE.findall(text.lower())
+
+
+def to_terms(text):
+    """Returns the set of terms to index the text under: words and word pairs"""
+    words = to_words(text)
+    terms = set(words)
+    terms.update('%s %s' % pair for pair in zip(words, words[1:]))
+    return terms
+
+
+def encode_postings(ids):
+    """Returns sorted ids as an array of the first id and the gaps after it"""
+    gaps = array('I', (b - a for a, b in zip([0] + ids, ids)))
+    if sys.byteorder == 'big':
+        gaps.byteswap()
+    return gaps
+
+
+def decode_postings(data):
+    """Returns the list of ids for bytes written by ``encode_postings()``"""
+    gaps = array('I')
+    gaps.frombytes(data)
+    if sys.byteorder == 'big':
+        gaps.byteswap()
+    return list(accumulate(gaps))
+
+
+def intersect(a, b):
+    """Returns the ids in both sorted lists
+
+    This walks the shorter list and binary searches the longer one from where
+    the last search left off, so it's quick when one list is much shorter.
+
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    result = []
+    lo = 0
+    hi = len(b)
+    for id_ in a:
+        lo = bisect_left(b, id_, lo, hi)
+        if lo == hi:
+            break
+        if b[lo] == id_:
+            result.append(id_)
+    return result
+
+
+def union(a, b):
+    """Returns the ids in either sorted list"""
+    return sorted(set(a).union(b))
+
+
+class Postings:
+    """Sorted list of status ids; ``&`` and ``|`` intersect and union them"""
+    __slots__ = ('ids',)
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __and__(self, other):
+        return Postings(intersect(self.ids, other.ids))
+
+    def __or__(self, other):
+        return Postings(union(self.ids, other.ids))
+
+
+class IndexCompiler:
+    """Compiles matches into Postings from a SearchIndex"""
+    def __init__(self, index):
+        self.index = index
+
+    def match(self, text):
+        # Tokens like "foo-bar" are more than one word; they match as a phrase.
+        return self.match_phrase(text)
+
+    def match_phrase(self, text):
+        words = to_words(text)
+        if len(words) == 1:
+            return Postings(self.index.postings(words[0]))
+        pairs = ['%s %s' % pair for pair in zip(words, words[1:])]
+        if not pairs:
+            return Postings([])
+        postings = Postings(self.index.postings(pairs[0]))
+        for pair in pairs[1:]:
+            postings = postings & Postings(self.index.postings(pair))
+        return postings
+
+
+def write_index(path, postings):
+    """Writes an index file
+
+    :arg path: path of the file
+    :arg postings: dict of term -> sorted list of status ids
+
+    """
+    # Sorting strs sorts them by code point, which is also how their UTF-8
+    # bytes sort, so the table can be searched by bytes.
+    terms = sorted(postings)
+    locations = []
+    with open(path, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(HEADER.pack(0, 0))
+        for term in terms:
+            data = encode_postings(postings[term]).tobytes()
+            locations.append((fp.tell(), len(data)))
+            fp.write(data)
+
+        term_locations = []
+        for term in terms:
+            data = term.encode('utf-8')
+            term_locations.append((fp.tell(), len(data)))
+            fp.write(data)
+
+        table = fp.tell()
+        for term_location, location in zip(term_locations, locations):
+            fp.write(ENTRY.pack(*(term_location + location)))
+        fp.seek(len(MAGIC))
+        fp.write(HEADER.pack(table, len(terms)))
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+@contextmanager
+def flocked(path, blocking=True):
+    """Holds an exclusive lock on a file
+
+    :arg path: path of the lock file
+    :arg blocking: whether to wait for the lock; if not, this yields False when
+        another process holds it
+
+    """
+    with open(path, 'ab') as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+class SearchIndex:
+    """The search index in a directory
+
+    Searching maps the index file and replays the journal the first time and
+    picks up new journal lines (or a rebuilt index) after that.
+
+    :arg path: the directory
+    :arg journal_limit: size in bytes past which ``journal()`` merges the
+        journal into the index file; None never does
+
+    """
+    def __init__(self, path, journal_limit=None):
+        self.path = path
+        self.journal_limit = journal_limit
+        self.index_path = os.path.join(path, 'index')
+        self.journal_path = os.path.join(path, 'journal')
+        self.lock_path = os.path.join(path, 'lock')
+        self.rewrite_lock_path = os.path.join(path, 'rewrite.lock')
+        self._lock = threading.RLock()
+        self._merge_thread = None
+        self._index_stat = None
+        self._reset()
+
+    def _reset(self):
+        self._mmap = None
+        self._table = 0
+        self._count = 0
+        self._journal_ino = None
+        self._journal_offset = 0
+        # Statuses saved or deleted since the index was built: their entries in
+        # the index file are ignored in favor of what's in _delta.
+        self._changed = set()
+        self._delta = defaultdict(set)
+        self._delta_terms = {}
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    @contextmanager
+    def locked(self):
+        """Holds the lock for appending to or replacing the journal
+
+        This is a lock on a separate file since the journal is replaced.
+
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with flocked(self.lock_path):
+            yield
+
+    @contextmanager
+    def rewriting(self, blocking=True):
+        """Holds the lock for rewriting the index file
+
+        Only one process builds or merges at a time. With ``blocking=False``
+        this yields False if another process is already at it.
+
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with flocked(self.rewrite_lock_path, blocking) as acquired:
+            yield acquired
+
+    def journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def build(self, statuses):
+        """Builds the index from scratch
+
+        :arg statuses: iterable of (id, content) in ascending id order
+
+        Changes journaled while this is building are kept in the journal.
+
+        """
+        with self.rewriting():
+            with self.locked():
+                start = self.journal_size()
+
+            postings = defaultdict(list)
+            count = 0
+            for id_, content in statuses:
+                for term in to_terms(content):
+                    postings[term].append(id_)
+                count += 1
+
+            self._replace(postings, start)
+        return count, len(postings)
+
+    def merge(self):
+        """Merges the journal into the index file
+
+        This writes a new index file from the current one and the journal
+        rather than from the status table. Changes journaled while this is
+        merging are kept in the journal.
+
+        :returns: False if there's no index file or another process is
+            already building or merging one, otherwise True
+
+        """
+        with self.rewriting(blocking=False) as acquired:
+            if not acquired:
+                return False
+            current = SearchIndex(self.path)
+            current.refresh()
+            if current._mmap is None:
+                return False
+
+            postings = {}
+            for term, offset, length in current._index_entries():
+                ids = current._merged(term, decode_postings(current._mmap[offset:offset + length]))
+                if ids:
+                    postings[term] = ids
+            for term, ids in current._delta.items():
+                if ids and term not in postings:
+                    postings[term] = sorted(ids)
+            self._replace(postings, current._journal_offset)
+            current._mmap.close()
+        return True
+
+    def _replace(self, postings, start):
+        """Swaps in a new index file and the journal from ``start`` on
+
+        The caller has to hold the ``rewriting()`` lock.
+
+        """
+        tmp_index = self.index_path + '.tmp'
+        write_index(tmp_index, postings)
+
+        tmp_journal = self.journal_path + '.tmp'
+        with self.locked():
+            with open(tmp_journal, 'wb') as dst:
+                if self.journal_size():
+                    with open(self.journal_path, 'rb') as src:
+                        src.seek(start)
+                        dst.write(src.read())
+            os.replace(tmp_index, self.index_path)
+            os.replace(tmp_journal, self.journal_path)
+
+    def journal(self, status_id, content=None):
+        """Records that a status was saved (with its content) or deleted
+
+        Past ``journal_limit`` bytes, this starts merging the journal into the
+        index file in a background thread, which takes about as long as
+        building the index.
+
+        """
+        line = json.dumps({'id': status_id, 'content': content}) + '\n'
+        with self.locked(), open(self.journal_path, 'ab') as fp:
+            fp.write(line.encode('utf-8'))
+            size = fp.tell()
+        if self.journal_limit is not None and size > self.journal_limit:
+            if self._merge_thread is None or not self._merge_thread.is_alive():
+                self._merge_thread = threading.Thread(target=self.merge, daemon=True)
+                self._merge_thread.start()
+
+    def refresh(self):
+        """Loads a rebuilt index and replays new journal lines"""
+        with self._lock:
+            try:
+                st = os.stat(self.index_path)
+            except FileNotFoundError:
+                st = None
+            index_stat = (st.st_ino, st.st_mtime_ns) if st else None
+            if index_stat != self._index_stat:
+                self._load(index_stat)
+            self._replay()
+
+    def _load(self, index_stat):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._reset()
+        self._index_stat = index_stat
+        if index_stat is None:
+            return
+
+        with open(self.index_path, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a search index' % self.index_path)
+        self._table, self._count = HEADER.unpack_from(self._mmap, len(MAGIC))
+
+    def _lookup(self, term):
+        """Returns the (offset, length) of a term's posting list or None"""
+        key = term.encode('utf-8')
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            term_offset, term_length, offset, length = ENTRY.unpack_from(
+                self._mmap, self._table + mid * ENTRY.size
+            )
+            found = self._mmap[term_offset:term_offset + term_length]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def _index_entries(self):
+        """Yields (term, offset, length) of each posting list in the index file"""
+        for entry in ENTRY.iter_unpack(self._mmap[self._table:self._table + self._count * ENTRY.size]):
+            term_offset, term_length, offset, length = entry
+            yield self._mmap[term_offset:term_offset + term_length].decode('utf-8'), offset, length
+
+    def _merged(self, term, ids):
+        """Returns the ids from the index file with the journaled changes"""
+        if self._changed:
+            ids = [id_ for id_ in ids if id_ not in self._changed]
+        if self._delta.get(term):
+            ids = union(ids, self._delta[term])
+        return ids
+
+    def _replay(self):
+        try:
+            with open(self.journal_path, 'rb') as fp:
+                journal_ino = os.fstat(fp.fileno()).st_ino
+                if journal_ino != self._journal_ino:
+                    # A rebuild swapped the journal for the part of it that's
+                    # newer than the index. Replaying it all is harmless since
+                    # the last line for a status wins.
+                    self._journal_ino = journal_ino
+                    self._journal_offset = 0
+                fp.seek(self._journal_offset)
+                data = fp.read()
+        except FileNotFoundError:
+            return
+
+        # Only replay complete lines; a partial one is still being written.
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            entry = json.loads(line.decode('utf-8'))
+            self._apply(entry['id'], entry['content'])
+        self._journal_offset += end
+
+    def _apply(self, status_id, content):
+        self._changed.add(status_id)
+        for term in self._delta_terms.pop(status_id, ()):
+            self._delta[term].discard(status_id)
+        if content is not None:
+            terms = to_terms(content)
+            for term in terms:
+                self._delta[term].add(status_id)
+            self._delta_terms[status_id] = terms
+
+    def postings(self, term):
+        """Returns the sorted ids of the statuses with the term"""
+        ids = []
+        location = self._lookup(term)
+        if location is not None:
+            offset, length = location
+            ids = decode_postings(self._mmap[offset:offset + length])
+        return self._merged(term, ids)
+
+    def search(self, text):
+        """Returns the ids of the statuses matching the search text, newest first"""
+        if not to_tokens(text):
+            return []
+        with self._lock:
+            self.refresh()
+            ids = generate_query(self, text, IndexCompiler).ids
+        ids.reverse()
+        return ids
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(path=None):
+    """Returns the SearchIndex for a directory (``SEARCH_INDEX_DIR`` by default)
+
+    There's one per directory per process so it's only loaded once.
+
+    """
+    path = path or settings.SEARCH_INDEX_DIR
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = SearchIndex(path, settings.SEARCH_INDEX_JOURNAL_LIMIT)
+        return _indexes[path]
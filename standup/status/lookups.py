@@ -0,0 +1,28 @@
+"""Custom lookups
+
+``trgm_icontains`` is ``icontains`` that Postgres can answer with a pg_trgm
+index. Django's ``icontains`` is ``UPPER(col) LIKE UPPER(pattern)`` on
+Postgres, which a trigram index on the column can't help with, so this is
+``col ILIKE pattern`` there instead. It matches the same things. Other
+databases get plain ``icontains``.
+
+The trigram indexes are added in migration 0030.
+
+"""
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class TrigramIContains(IContains):
+    lookup_name = 'trgm_icontains'
+
+    def as_sql(self, compiler, connection):
+        return IContains(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        lhs_sql, params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        params.extend(rhs_params)
+        return '%s ILIKE %s' % (lhs_sql, rhs_sql), params
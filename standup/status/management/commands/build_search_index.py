@@ -0,0 +1,26 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from standup.status.index import get_search_index
+from standup.status.models import Status
+
+
+class Command(BaseCommand):
+    help = 'Build the search index used by the "index" search backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            help='directory to build the index in; defaults to SEARCH_INDEX_DIR'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.SEARCH_INDEX_DIR
+        start = time.time()
+        statuses = Status.objects.order_by('pk').values_list('pk', 'content').iterator()
+        count, terms = get_search_index(path).build(statuses)
+        self.stdout.write('Indexed %d statuses (%d terms) in %s in %.1fs' % (
+            count, terms, path, time.time() - start
+        ))
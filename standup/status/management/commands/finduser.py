@@ -63,9 +63,9 @@ class Command(BaseCommand):
         # id_to_data where the user id is the same
         standup_users = (
             StandupUser.objects.filter(
-                Q(name__icontains=text) |
-                Q(slug__icontains=text) |
-                Q(irc_nick__icontains=text)
+                Q(name__trgm_icontains=text) |
+                Q(slug__trgm_icontains=text) |
+                Q(irc_nick__trgm_icontains=text)
             )
             .order_by('id')
         )
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from standup.status.models import Status, StatusReference
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the bug, pull request and issue reference index (StatusReference rows) from status content'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=1000,
+            help='number of statuses to read and index at a time'
+        )
+
+    def handle(self, *args, **options):
+        statuses = Status.objects.order_by('pk').values_list('pk', 'content', 'project_id', 'created')
+        last_pk = 0
+        count = 0
+        reference_count = 0
+        start_time = time.time()
+        while True:
+            with transaction.atomic():
+                # Saving a status rewrites its references in the same
+                # transaction, so locking the chunk's statuses keeps saves from
+                # racing the delete and insert below and the content from
+                # going stale.
+                chunk = list(statuses.select_for_update().filter(pk__gt=last_pk)[:options['chunk_size']])
+                if not chunk:
+                    break
+
+                references = [
+                    StatusReference(
+                        status_id=pk, kind=kind, number=number, project_id=reference_project_id, created=created
+                    )
+                    for pk, content, project_id, created in chunk
+                    for (kind, number), reference_project_id in sorted(
+                        StatusReference.get_rows(content, project_id).items()
+                    )
+                ]
+                StatusReference.objects.filter(status_id__gt=last_pk, status_id__lte=chunk[-1][0]).delete()
+                StatusReference.objects.bulk_create(references)
+
+            last_pk = chunk[-1][0]
+            count += len(chunk)
+            reference_count += len(references)
+
+        self.stdout.write('Indexed %d references in %d statuses in %.1fs' % (
+            reference_count, count, time.time() - start_time
+        ))
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from standup.status.models import Status, StatusTag
+from standup.status.renderer import find_tags
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the #hashtag index (StatusTag rows) from status content'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=1000,
+            help='number of statuses to read and index at a time'
+        )
+
+    def handle(self, *args, **options):
+        statuses = Status.objects.order_by('pk').values_list('pk', 'content', 'created')
+        last_pk = 0
+        count = 0
+        tag_count = 0
+        start_time = time.time()
+        while True:
+            with transaction.atomic():
+                # Saving a status rewrites its tags in the same transaction, so
+                # locking the chunk's statuses keeps saves from racing the
+                # delete and insert below and the content from going stale.
+                chunk = list(statuses.select_for_update().filter(pk__gt=last_pk)[:options['chunk_size']])
+                if not chunk:
+                    break
+
+                tags = [
+                    StatusTag(status_id=pk, name=name, created=created)
+                    for pk, content, created in chunk
+                    for name in sorted(StatusTag.valid_names(find_tags(content)))
+                ]
+                StatusTag.objects.filter(status_id__gt=last_pk, status_id__lte=chunk[-1][0]).delete()
+                StatusTag.objects.bulk_create(tags)
+
+            last_pk = chunk[-1][0]
+            count += len(chunk)
+            tag_count += len(tags)
+
+        self.stdout.write('Indexed %d tags in %d statuses in %.1fs' % (
+            tag_count, count, time.time() - start_time
+        ))
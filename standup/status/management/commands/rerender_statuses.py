@@ -0,0 +1,211 @@
+import os
+import time
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.db import connection, transaction
+from django.db.models import Case, CharField, TextField, Value, When
+
+from standup.status.models import StandupUser, Status, StatusMention
+from standup.status.renderer import RENDERER_VERSION, render
+from standup.status.utils import get_day, isday
+
+
+# Slug -> url of every user, for linking @mentions. Each worker process gets
+# this once from init_worker() rather than with every status.
+mention_urls = {}
+
+
+def get_all_mention_urls():
+    """Returns dict of slug -> url for every user with a slug"""
+    urls = {}
+    for slug in StandupUser.objects.exclude(slug=None).exclude(slug='').values_list('slug', flat=True):
+        try:
+            urls[slug] = reverse('status.user', kwargs={'slug': slug})
+        except NoReverseMatch:
+            pass
+    return urls
+
+
+def init_worker(urls):
+    """Sets up the process that renders statuses"""
+    mention_urls.clear()
+    mention_urls.update(urls)
+
+
+def render_status(item):
+    """Renders a single status; runs in a worker process
+
+    :arg item: tuple of (pk, content, repo_url)
+
+    :returns: tuple of (pk, html, space-separated mentioned slugs)
+
+    """
+    pk, content, repo_url = item
+    html, mentions = render(content, repo_url, mention_urls.get)
+    return pk, str(html), ' '.join(sorted(mentions))
+
+
+class Command(BaseCommand):
+    help = 'Re-render the stored HTML for statuses'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='only re-render statuses created on or after this day (YYYY-MM-DD)'
+        )
+        parser.add_argument(
+            '--stale', action='store_true',
+            help='only re-render statuses that were marked stale or rendered by an older renderer'
+        )
+        parser.add_argument(
+            '--chunk-size', dest='chunk_size', type=int, default=1000,
+            help='number of statuses to read, render and write at a time'
+        )
+        parser.add_argument(
+            '--jobs', type=int, default=os.cpu_count(),
+            help='number of processes to render with; 1 renders in this process'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=(
+                'file to record progress in; if it exists, this picks up where the '
+                'last run left off'
+            )
+        )
+
+    def handle(self, *args, **options):
+        statuses = Status.objects.select_related('project').order_by('pk')
+        if options['since']:
+            if not isday(options['since']):
+                raise CommandError('--since must be YYYY-MM-DD')
+            statuses = statuses.filter(created__gte=get_day(options['since']))
+        if options['stale']:
+            statuses = statuses.exclude(html_version=RENDERER_VERSION)
+
+        checkpoint = options['checkpoint']
+        last_pk = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as fp:
+                last_pk = int(fp.read().strip() or 0)
+            self.stdout.write('Resuming after status %d.' % last_pk)
+
+        urls = get_all_mention_urls()
+        pool = None
+        if options['jobs'] > 1:
+            pool = Pool(options['jobs'], initializer=init_worker, initargs=(urls,))
+        else:
+            init_worker(urls)
+
+        count = 0
+        start_time = time.time()
+        try:
+            while True:
+                chunk = list(statuses.filter(pk__gt=last_pk)[:options['chunk_size']])
+                if not chunk:
+                    break
+
+                items = [(status.pk, status.content, status.get_repo_url()) for status in chunk]
+                if pool is not None:
+                    chunksize = max(1, len(items) // options['jobs'])
+                    results = pool.map(render_status, items, chunksize=chunksize)
+                else:
+                    results = [render_status(item) for item in items]
+
+                self.write_results(chunk, results)
+
+                last_pk = chunk[-1].pk
+                if checkpoint:
+                    with open(checkpoint, 'w') as fp:
+                        fp.write(str(last_pk))
+
+                count += len(chunk)
+                elapsed = time.time() - start_time
+                self.stdout.write('Rendered %d statuses (%.1f/s)' % (count, count / elapsed))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.time() - start_time
+        self.stdout.write('Done: %d statuses in %.1fs (%.1f/s)' % (
+            count, elapsed, count / elapsed if elapsed else 0
+        ))
+
+    def write_results(self, statuses, results):
+        """Writes rendered HTML and @mentions for a chunk of statuses a batch at a time
+
+        Each batch is written with a single UPDATE using CASE expressions.
+        Statuses that were edited, re-marked stale or deleted since they were
+        read are skipped: their HTML would be out of date and saving or
+        deleting them has already taken care of their mentions.
+
+        :arg statuses: list of the Status instances that were rendered
+        :arg results: list of (pk, html, mentions) tuples for them
+
+        """
+        read = {status.pk: status for status in statuses}
+        # Each row adds a pk and a value to each of the three CASEs and a pk to
+        # the IN, so it takes 7 query parameters.
+        batch_size = max(1, connection.ops.bulk_batch_size(['pk'] * 7, results))
+
+        for i in range(0, len(results), batch_size):
+            with transaction.atomic():
+                batch = results[i:i + batch_size]
+                # Lock the rows so nothing changes them between checking and
+                # writing.
+                current = Status.objects.select_for_update().filter(
+                    pk__in=[pk for pk, _, _ in batch]
+                ).values_list('pk', 'content', 'html_version')
+                unchanged = {
+                    pk for pk, content, html_version in current
+                    if (content, html_version) == (read[pk].content, read[pk].html_version)
+                }
+                batch = [row for row in batch if row[0] in unchanged]
+                if not batch:
+                    continue
+
+                Status.objects.filter(pk__in=[pk for pk, _, _ in batch]).update(
+                    content_html=Case(
+                        *[When(pk=pk, then=Value(html)) for pk, html, _ in batch],
+                        output_field=TextField()
+                    ),
+                    html_mentions=Case(
+                        *[When(pk=pk, then=Value(mentions)) for pk, _, mentions in batch],
+                        output_field=TextField()
+                    ),
+                    html_repo_url=Case(
+                        *[When(pk=pk, then=Value(read[pk].get_repo_url())) for pk, _, _ in batch],
+                        output_field=CharField()
+                    ),
+                    html_version=RENDERER_VERSION,
+                )
+                self.index_mentions(batch, read)
+
+    def index_mentions(self, results, read):
+        """Updates StatusMention rows for statuses whose @mentions changed
+
+        :arg results: list of (pk, html, mentions) tuples
+        :arg read: dict of pk -> Status instance as it was read
+
+        """
+        changed = {
+            pk: mentions for pk, html, mentions in results if mentions != read[pk].html_mentions
+        }
+        if not changed:
+            return
+        pks = list(changed)
+        slugs = {
+            pk: StatusMention.valid_slugs(mentions.split()) for pk, mentions in changed.items()
+        }
+        user_ids = StatusMention.get_user_ids(set().union(*slugs.values()))
+        StatusMention.objects.filter(status_id__in=pks).delete()
+        StatusMention.objects.bulk_create([
+            StatusMention(status_id=pk, slug=slug, user_id=user_ids.get(slug), created=read[pk].created)
+            for pk in pks
+            for slug in slugs[pk]
+        ])
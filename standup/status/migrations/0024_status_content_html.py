@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0023_auto_20180607_1738'),
+    ]
+
+    operations = [
+        # Stored HTML starts out at version 0 so existing statuses get rendered
+        # lazily the first time they're read.
+        migrations.AddField(
+            model_name='status',
+            name='content_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='html_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='html_repo_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='html_mentions',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Space-separated slugs @mentioned in the content'),
+        ),
+    ]
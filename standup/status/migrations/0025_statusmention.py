@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-18 04:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0024_status_content_html'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusMention',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.CharField(db_index=True, max_length=100)),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='status.Status')),
+            ],
+            options={
+                'db_table': 'status_mention',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='statusmention',
+            unique_together=set([('status', 'slug')]),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-18 04:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0025_statusmention'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='status',
+            options={'ordering': ('-created', '-id'), 'verbose_name_plural': 'statuses'},
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['-created', '-id'], name='status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['user', '-created', '-id'], name='status_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='status',
+            index=models.Index(fields=['project', '-created', '-id'], name='status_project_created_idx'),
+        ),
+        # The composite indexes start with user and project, so the FK indexes
+        # aren't needed.
+        migrations.AlterField(
+            model_name='status',
+            name='project',
+            field=models.ForeignKey(blank=True, db_index=False, default=None, null=True, on_delete=django.db.models.deletion.SET_DEFAULT, related_name='statuses', to='status.Project'),
+        ),
+        migrations.AlterField(
+            model_name='status',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='statuses', to='status.StandupUser'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-18 05:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0026_status_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='team_entries', to='status.Status')),
+                ('team', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to='status.Team')),
+            ],
+            options={
+                'db_table': 'team_status',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='teamstatus',
+            index=models.Index(fields=['team', '-created', '-status'], name='team_status_created_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='teamstatus',
+            unique_together=set([('team', 'status')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+def fwds(apps, schema_editor):
+    Team = apps.get_model('status', 'Team')
+    TeamStatus = apps.get_model('status', 'TeamStatus')
+    Status = apps.get_model('status', 'Status')
+
+    for team in Team.objects.all():
+        user_ids = list(team.users.values_list('id', flat=True))
+        statuses = Status.objects.filter(user_id__in=user_ids).values_list('id', 'created')
+        TeamStatus.objects.bulk_create([
+            TeamStatus(team_id=team.id, status_id=status_id, created=created)
+            for status_id, created in statuses.iterator()
+        ], batch_size=1000)
+
+
+def bkwds(apps, schema_editor):
+    TeamStatus = apps.get_model('status', 'TeamStatus')
+    TeamStatus.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0027_teamstatus'),
+    ]
+
+    operations = [
+        migrations.RunPython(fwds, bkwds)
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+import django.contrib.postgres.search
+
+
+# Postgres keeps search_vector up to date with a trigger and searches it with a
+# GIN index. Other databases just get the (unused) column.
+POSTGRES_FWDS = [
+    """
+    CREATE TRIGGER status_search_vector_update
+    BEFORE INSERT OR UPDATE OF content, search_vector ON status
+    FOR EACH ROW EXECUTE PROCEDURE
+    tsvector_update_trigger(search_vector, 'pg_catalog.english', content)
+    """,
+    "UPDATE status SET search_vector = to_tsvector('pg_catalog.english', content)",
+    "CREATE INDEX status_search_vector_idx ON status USING gin (search_vector)",
+]
+
+POSTGRES_BKWDS = [
+    "DROP INDEX IF EXISTS status_search_vector_idx",
+    "DROP TRIGGER IF EXISTS status_search_vector_update ON status",
+]
+
+
+def run_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0028_backfill_teamstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='status',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(run_postgres(POSTGRES_FWDS), run_postgres(POSTGRES_BKWDS)),
+    ]
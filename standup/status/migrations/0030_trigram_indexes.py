@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+# Trigram indexes for the trgm_icontains lookup (see standup/status/lookups.py).
+# They're Postgres-only; other databases don't get anything.
+POSTGRES_FWDS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX status_content_trgm_idx ON status USING gin (content gin_trgm_ops)',
+    'CREATE INDEX user_name_trgm_idx ON "user" USING gin (name gin_trgm_ops)',
+    'CREATE INDEX user_slug_trgm_idx ON "user" USING gin (slug gin_trgm_ops)',
+    'CREATE INDEX user_irc_nick_trgm_idx ON "user" USING gin (irc_nick gin_trgm_ops)',
+]
+
+POSTGRES_BKWDS = [
+    'DROP INDEX IF EXISTS user_irc_nick_trgm_idx',
+    'DROP INDEX IF EXISTS user_slug_trgm_idx',
+    'DROP INDEX IF EXISTS user_name_trgm_idx',
+    'DROP INDEX IF EXISTS status_content_trgm_idx',
+]
+
+
+def run_postgres(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0029_status_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgres(POSTGRES_FWDS), run_postgres(POSTGRES_BKWDS)),
+    ]
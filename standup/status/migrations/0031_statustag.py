@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-18 05:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0030_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('created', models.DateTimeField()),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='status.Status')),
+            ],
+            options={
+                'db_table': 'status_tag',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='statustag',
+            index=models.Index(fields=['name', '-created', '-status'], name='status_tag_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statustag',
+            index=models.Index(fields=['created', 'name'], name='status_tag_trending_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statustag',
+            unique_together=set([('status', 'name')]),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fwds(apps, schema_editor):
+    StatusMention = apps.get_model('status', 'StatusMention')
+    StandupUser = apps.get_model('status', 'StandupUser')
+    Status = apps.get_model('status', 'Status')
+
+    # One UPDATE for all the rows
+    StatusMention.objects.update(
+        user_id=Subquery(StandupUser.objects.filter(slug=OuterRef('slug')).values('id')[:1]),
+        created=Subquery(Status.objects.filter(pk=OuterRef('status_id')).values('created')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0031_statustag'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statusmention',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mentions', to='status.StandupUser'),
+        ),
+        migrations.AddField(
+            model_name='statusmention',
+            name='created',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fwds, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='statusmention',
+            name='created',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='statusmention',
+            index=models.Index(fields=['user', '-created', '-status'], name='status_mention_user_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.14 on 2026-10-18 06:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0032_statusmention_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('bug', 'Bug'), ('pull', 'Pull request'), ('issue', 'Issue')], max_length=5)),
+                ('number', models.PositiveIntegerField()),
+                ('created', models.DateTimeField()),
+                ('project', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='status.Project')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='status.Status')),
+            ],
+            options={
+                'db_table': 'status_reference',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='statusreference',
+            index=models.Index(fields=['kind', 'number', 'project', '-created', '-status'], name='status_reference_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statusreference',
+            unique_together=set([('status', 'kind', 'number')]),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Bugs have no project, and an index with project_id in the middle can't be
+# walked in created order for project_id IS NULL on Postgres. Bugs get their
+# own partial index instead. Django's Index can't be partial, so it's made
+# here; Postgres and SQLite both support it.
+FWDS = [
+    'CREATE INDEX status_reference_bug_idx ON status_reference '
+    '(kind, number, created DESC, status_id DESC) WHERE project_id IS NULL',
+]
+
+BKWDS = [
+    'DROP INDEX IF EXISTS status_reference_bug_idx',
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('status', '0033_statusreference'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='statusreference',
+            name='project',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='status.Project'),
+        ),
+        migrations.RunPython(run_sql(FWDS), run_sql(BKWDS)),
+    ]
@@ -1,39 +1,107 @@
-import re
 from collections import OrderedDict
 
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
 from django.core.urlresolvers import reverse, NoReverseMatch
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 
-from bleach.callbacks import nofollow
-from bleach.linkifier import Linker
-from bleach.sanitizer import Cleaner
 from jinja2 import Markup
-from markdown import Markdown
 
+from standup.status.renderer import (
+    BUG_URL,
+    RENDERER_VERSION,
+    cached_render,
+    find_mentions,
+    find_references,
+    find_tags,
+)
 from standup.status.utils import (
-    trim_urls,
     week_end as u_week_end,
     week_start as u_week_start,
 )
-from standup.mdext.nixheaders import NixHeaderExtension
 
 
-BUG_RE = re.compile(r'(bug #?(\d+))', flags=re.I)
-PULL_RE = re.compile(r'((?:pull|pr) #?(\d+))', flags=re.I)
-ISSUE_RE = re.compile(r'(issue #?(\d+))', flags=re.I)
-USER_RE = re.compile(r'(?<=^|(?<=[^\w\-.]))@([\w-]+)', flags=re.I)
-TAG_RE = re.compile(r'(?:^|[^\w\\/])#([a-z][a-z0-9_.-]*)(?:\b|$)', flags=re.I)
-MD = Markdown(output_format='html5', extensions=[
-    NixHeaderExtension(),
-    'nl2br',
-    'smart_strong'
-])
+STATUSES_CHANGED_KEY = 'statuses-changed'
+
+
+def get_mention_urls(slugs):
+    """Resolves @mention slugs to user urls with a single query
+
+    :arg slugs: iterable of slugs
+
+    :returns: dict of slug -> url or None if there's no user with that slug
+
+    """
+    mention_urls = dict.fromkeys(slugs)
+    if mention_urls:
+        users = StandupUser.objects.filter(slug__in=list(mention_urls))
+        for slug in users.values_list('slug', flat=True):
+            try:
+                mention_urls[slug] = reverse('status.user', kwargs={'slug': slug})
+            except NoReverseMatch:
+                pass
+    return mention_urls
+
+
+def get_stored_mention_urls(status_ids):
+    """Resolves the @mentions recorded for statuses with a single query
+
+    This uses the StatusMention rows, which already point at the users that
+    were mentioned, so nothing has to be scanned for mentions.
+
+    :arg status_ids: ids of statuses
 
+    :returns: dict of slug -> url or None if there's no user with that slug
 
-CLEANER = Cleaner(tags=[])
-LINKER = Linker(callbacks=[trim_urls, nofollow])
+    """
+    mention_urls = {}
+    status_ids = list(status_ids)
+    if not status_ids:
+        return mention_urls
+    rows = StatusMention.objects.filter(status_id__in=status_ids).values_list('slug', 'user__slug')
+    for slug, user_slug in rows:
+        if mention_urls.get(slug):
+            continue
+        mention_urls[slug] = None
+        if user_slug == slug:
+            try:
+                mention_urls[slug] = reverse('status.user', kwargs={'slug': slug})
+            except NoReverseMatch:
+                pass
+    return mention_urls
+
+
+def render_statuses(statuses):
+    """Makes sure the stored HTML for a page of statuses is up to date
+
+    This gathers the @mentions of all the statuses that need rendering and
+    resolves them in one query rather than one per mention per status.
+    Statuses that have been rendered before have their mentions recorded in
+    StatusMention, so only ones that haven't are scanned for them.
+
+    :arg statuses: iterable of Status instances
+
+    :returns: list of the statuses
+
+    """
+    statuses = list(statuses)
+    stale = [status for status in statuses if status.html_is_stale()]
+    if stale:
+        mention_urls = get_stored_mention_urls([status.pk for status in stale if status.content_html])
+        slugs = set()
+        for status in stale:
+            if status.content_html:
+                slugs.update(status.html_mentions.split())
+            else:
+                slugs.update(find_mentions(status.content))
+        slugs -= set(mention_urls)
+        if slugs:
+            mention_urls.update(get_mention_urls(slugs))
+        for status in stale:
+            status.update_html(mention_urls=mention_urls)
+    return statuses
 
 
 class StandupUser(models.Model):
@@ -67,6 +135,12 @@ class StandupUser(models.Model):
         except NoReverseMatch:
             return ''
 
+    def mentioned_statuses(self):
+        """Returns the statuses that @mention this user newest first"""
+        return Status.objects.filter(mentions__user=self).order_by(
+            '-mentions__created', '-mentions__status__id'
+        )
+
     @property
     def email(self):
         return self.user.email
@@ -110,8 +184,10 @@ class Team(models.Model):
             return ''
 
     def statuses(self):
-        user_ids = self.users.values_list('id', flat=True)
-        return Status.objects.filter(user__pk__in=user_ids)
+        """Returns the team members' statuses newest first"""
+        return Status.objects.filter(team_entries__team=self).order_by(
+            '-team_entries__created', '-team_entries__status__id'
+        )
 
     def dictify(self):
         data = OrderedDict()
@@ -164,17 +240,43 @@ class Status(models.Model):
     """A standup update for a user on a given project."""
 
     created = models.DateTimeField(default=timezone.now)
-    user = models.ForeignKey(StandupUser, on_delete=models.CASCADE, related_name='statuses')
+    # The user and project indexes are the composite ones in Meta.indexes.
+    user = models.ForeignKey(
+        StandupUser, on_delete=models.CASCADE, related_name='statuses', db_index=False
+    )
     project = models.ForeignKey(
         'Project', related_name='statuses', on_delete=models.SET_DEFAULT, default=None,
-        null=True, blank=True
+        null=True, blank=True, db_index=False
     )
     content = models.TextField()
 
+    # Rendered version of content along with the renderer version and the inputs
+    # it was rendered with. See htmlify().
+    content_html = models.TextField(blank=True, default='', editable=False)
+    html_version = models.PositiveIntegerField(default=0, editable=False)
+    html_repo_url = models.CharField(max_length=100, blank=True, default='', editable=False)
+    html_mentions = models.TextField(
+        blank=True, default='', editable=False,
+        help_text='Space-separated slugs @mentioned in the content'
+    )
+
+    # Full-text search vector of the content. On Postgres, a trigger keeps this
+    # up to date; elsewhere it's unused. See standup/status/search.py.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    HTML_FIELDS = ('content_html', 'html_version', 'html_repo_url', 'html_mentions')
+
     class Meta:
         db_table = 'status'
-        ordering = ('-created',)
+        ordering = ('-created', '-id')
         verbose_name_plural = 'statuses'
+        # Status listings are all newest first, either across everything or
+        # for a user or a project. See test_query_plans.py.
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='status_created_idx'),
+            models.Index(fields=['user', '-created', '-id'], name='status_user_created_idx'),
+            models.Index(fields=['project', '-created', '-id'], name='status_project_created_idx'),
+        ]
 
     def __str__(self):
         return 'Status from %s' % self.user.slug
@@ -200,57 +302,100 @@ class Status(models.Model):
             return u_week_end(self.created)
         return None
 
-    def htmlify(self):
-        # Remove icky stuff.
-        formatted = CLEANER.clean(self.content)
-
-        # Linkify "bug #n" and "bug n" text.
-        formatted = BUG_RE.sub(
-            r'<a href="http://bugzilla.mozilla.org/show_bug.cgi?id=\2">\1</a>',
-            formatted)
-
-        # Wrap tags in a span for formatting
-        checked = set()
-        for tag in TAG_RE.findall(formatted):
-            if tag in checked:
-                continue
-            hashtag = '#%s' % tag
-            formatted = formatted.replace(hashtag,
-                                          '<span class="tag tag-%s">%s</span>' %
-                                          (tag.lower(), hashtag))
-            checked.add(tag)
-
-        checked = set()
-        for slug in USER_RE.findall(formatted):
-            if slug in checked:
-                continue
-            slug = slug.lstrip('@')
-            user = StandupUser.objects.filter(slug=slug).first()
-            if user:
-                try:
-                    url = reverse('status.user', kwargs={'slug': slug})
-                except NoReverseMatch:
-                    continue
-                at_slug = '@%s' % slug
-                formatted = formatted.replace(at_slug,
-                                              '<a href="%s">%s</a>' %
-                                              (url, at_slug))
-            checked.add(slug)
-
-        # Linkify "pull #n" and "pull n" text.
+    def save(self, *args, **kwargs):
+        # Render eagerly so reads don't have to.
+        self.update_html(save=False)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | set(self.HTML_FIELDS)
+        # The mentions, tags, references and timeline entries are saved with the status so
+        # anything waiting on the commit sees all of them.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.index_mentions()
+            StatusTag.sync_status(self)
+            StatusReference.sync_status(self)
+            TeamStatus.sync_status(self)
+
+    def get_repo_url(self):
         if self.project and self.project.repo_url:
-            repo = self.project.repo_url.rstrip('/')
-            formatted = PULL_RE.sub(
-                r'<a href="%s/pull/\2">\1</a>' % repo, formatted)
-            formatted = ISSUE_RE.sub(
-                r'<a href="%s/issues/\2">\1</a>' % repo, formatted)
+            return self.project.repo_url
+        return ''
+
+    def html_is_stale(self):
+        """Returns whether content_html needs to be re-rendered"""
+        return (
+            self.html_version != RENDERER_VERSION or
+            self.html_repo_url != self.get_repo_url()
+        )
 
-        # markdownify
-        formatted = MD.reset().convert(formatted)
+    def update_html(self, save=True, mention_urls=None):
+        """Re-renders content_html
+
+        :arg save: whether to also write the rendered HTML to the database
+        :arg mention_urls: dict of slug -> url for resolved @mentions; see
+            ``render_html()``
+
+        """
+        html, mentions = self.render_html(mention_urls=mention_urls)
+        old_mentions = self.html_mentions
+        self.content_html = str(html)
+        self.html_version = RENDERER_VERSION
+        self.html_repo_url = self.get_repo_url()
+        self.html_mentions = ' '.join(sorted(mentions))
+        if save and self.pk:
+            # Use update() so we only write the html fields and don't kick off
+            # anything that hangs off of saving a status.
+            Status.objects.filter(pk=self.pk).update(
+                **{field: getattr(self, field) for field in self.HTML_FIELDS}
+            )
+            if self.html_mentions != old_mentions:
+                self.index_mentions()
+
+    def index_mentions(self):
+        """Updates the StatusMention rows for this status to match html_mentions"""
+        slugs = set(StatusMention.valid_slugs(self.html_mentions.split()))
+        existing = dict(self.mentions.values_list('slug', 'created'))
+        if set(existing) - slugs:
+            self.mentions.filter(slug__in=set(existing) - slugs).delete()
+        if any(created != self.created for created in existing.values()):
+            self.mentions.update(created=self.created)
+        if slugs - set(existing):
+            user_ids = StatusMention.get_user_ids(slugs - set(existing))
+            StatusMention.objects.bulk_create([
+                StatusMention(status=self, slug=slug, user_id=user_ids.get(slug), created=self.created)
+                for slug in sorted(slugs - set(existing))
+            ])
 
-        # Linkify bare urls
-        formatted = LINKER.linkify(formatted)
-        return Markup(formatted)
+    def htmlify(self):
+        """Returns the rendered HTML for this status
+
+        This uses the stored HTML, re-rendering it first if it's stale.
+
+        """
+        if self.html_is_stale():
+            self.update_html()
+        return Markup(self.content_html)
+
+    def render_html(self, mention_urls=None):
+        """Renders content to HTML
+
+        :arg mention_urls: dict of slug -> url (or None) for @mentions that
+            have already been resolved; any other @mentions are looked up
+
+        :returns: tuple of (html, set of slugs that were @mentioned)
+
+        """
+        if mention_urls is None and self.pk and self.html_mentions:
+            mention_urls = get_stored_mention_urls([self.pk])
+        mention_urls = dict(mention_urls or {})
+
+        def mention_url(slug):
+            if slug not in mention_urls:
+                mention_urls.update(get_mention_urls([slug]))
+            return mention_urls[slug]
+
+        return cached_render(self.content, self.get_repo_url(), mention_url)
 
     def dictify(self, include_user=True):
         """Returns an OrderedDict of model attributes"""
@@ -276,6 +421,318 @@ class Status(models.Model):
         return data
 
 
+class StatusMention(models.Model):
+    """An @mention in a status
+
+    This records every slug a status @mentions whether or not there's a user
+    with that slug, so when a user's slug changes (or a user shows up with a
+    slug that was already mentioned) we know which statuses to re-render.
+
+    Mentions of a user point at them so a user's mentions can be read newest
+    first from one index. The user is kept up to date as slugs change.
+
+    """
+    status = models.ForeignKey(Status, on_delete=models.CASCADE, related_name='mentions')
+    slug = models.CharField(max_length=100, db_index=True)
+    user = models.ForeignKey(
+        StandupUser, on_delete=models.SET_NULL, related_name='mentions', null=True, blank=True,
+        db_index=False
+    )
+    # Copy of status.created so a user's mentions can be ordered by it
+    created = models.DateTimeField()
+
+    class Meta:
+        db_table = 'status_mention'
+        unique_together = ('status', 'slug')
+        indexes = [
+            models.Index(fields=['user', '-created', '-status'], name='status_mention_user_idx'),
+        ]
+
+    def __str__(self):
+        return '@%s in status %s' % (self.slug, self.status_id)
+
+    @classmethod
+    def valid_slugs(cls, slugs):
+        """Filters out slugs that are too long to be a user's slug"""
+        max_length = cls._meta.get_field('slug').max_length
+        return [slug for slug in slugs if len(slug) <= max_length]
+
+    @classmethod
+    def get_user_ids(cls, slugs):
+        """Returns dict of slug -> id of the user with that slug for the slugs that have one"""
+        if not slugs:
+            return {}
+        return dict(StandupUser.objects.filter(slug__in=list(slugs)).values_list('slug', 'id'))
+
+
+class StatusTag(models.Model):
+    """A #hashtag in a status
+
+    These are extracted from the content when a status is saved so a tag's
+    statuses can be read newest first from one index rather than by searching
+    all statuses for the tag.
+
+    """
+    status = models.ForeignKey(Status, on_delete=models.CASCADE, related_name='tags')
+    # Lowercased and without the #
+    name = models.CharField(max_length=100)
+    # Copy of status.created so a tag's statuses can be ordered by it
+    created = models.DateTimeField()
+
+    class Meta:
+        db_table = 'status_tag'
+        unique_together = ('status', 'name')
+        indexes = [
+            models.Index(fields=['name', '-created', '-status'], name='status_tag_created_idx'),
+            # For counting the tags used in a window of time
+            models.Index(fields=['created', 'name'], name='status_tag_trending_idx'),
+        ]
+
+    def __str__(self):
+        return '#%s in status %s' % (self.name, self.status_id)
+
+    @classmethod
+    def valid_names(cls, names):
+        """Filters out names that are too long to store"""
+        max_length = cls._meta.get_field('name').max_length
+        return [name for name in names if len(name) <= max_length]
+
+    @classmethod
+    def sync_status(cls, status):
+        """Updates the tags for a status to match its content"""
+        names = set(cls.valid_names(find_tags(status.content)))
+        existing = dict(cls.objects.filter(status=status).values_list('name', 'created'))
+
+        if set(existing) - names:
+            cls.objects.filter(status=status, name__in=set(existing) - names).delete()
+        if any(created != status.created for created in existing.values()):
+            cls.objects.filter(status=status).update(created=status.created)
+        cls.objects.bulk_create([
+            cls(status=status, name=name, created=status.created)
+            for name in sorted(names - set(existing))
+        ])
+
+    @classmethod
+    def trending(cls, since, limit=20):
+        """Returns the most used tags since a time
+
+        :arg since: datetime to count tags from
+        :arg limit: the most tags to return
+
+        :returns: list of (name, number of statuses), most used first
+
+        """
+        counts = cls.objects.filter(created__gte=since).values_list('name').annotate(
+            count=models.Count('id')
+        ).order_by('-count', 'name')
+        return list(counts[:limit])
+
+
+class StatusReference(models.Model):
+    """A bug, pull request or issue reference in a status
+
+    These are extracted from the content when a status is saved so the
+    statuses referring to something can be read newest first from one index
+    rather than by searching all statuses.
+
+    Pull requests and issues belong to the status' project and are only
+    recorded for statuses with a project; they go when the project does. Bugs
+    are global, so they're recorded without one.
+
+    """
+    KIND_CHOICES = (
+        ('bug', 'Bug'),
+        ('pull', 'Pull request'),
+        ('issue', 'Issue'),
+    )
+    # Largest number that fits in the number column
+    MAX_NUMBER = 2147483647
+
+    status = models.ForeignKey(Status, on_delete=models.CASCADE, related_name='references')
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    number = models.PositiveIntegerField()
+    project = models.ForeignKey(
+        Project, on_delete=models.CASCADE, related_name='+', null=True, blank=True, db_index=False
+    )
+    # Copy of status.created so a reference's statuses can be ordered by it
+    created = models.DateTimeField()
+
+    class Meta:
+        db_table = 'status_reference'
+        unique_together = ('status', 'kind', 'number')
+        # Pull requests and issues are looked up on this; bugs (project_id IS
+        # NULL) on the partial status_reference_bug_idx made in migration 0034.
+        indexes = [
+            models.Index(
+                fields=['kind', 'number', 'project', '-created', '-status'], name='status_reference_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return '%s %s in status %s' % (self.kind, self.number, self.status_id)
+
+    @classmethod
+    def get_rows(cls, content, project_id):
+        """Returns dict of (kind, number) -> project id for the references to record for content"""
+        rows = {}
+        for kind, number in find_references(content):
+            if number > cls.MAX_NUMBER:
+                continue
+            if kind == 'bug':
+                rows[kind, number] = None
+            elif project_id is not None:
+                rows[kind, number] = project_id
+        return rows
+
+    @classmethod
+    def sync_status(cls, status):
+        """Updates the references for a status to match its content and project"""
+        rows = cls.get_rows(status.content, status.project_id)
+        existing = {
+            (kind, number): (project_id, created)
+            for kind, number, project_id, created in cls.objects.filter(status=status).values_list(
+                'kind', 'number', 'project_id', 'created'
+            )
+        }
+
+        stale = [
+            key for key, (project_id, created) in existing.items()
+            if key not in rows or rows[key] != project_id or created != status.created
+        ]
+        if stale:
+            q = models.Q()
+            for kind, number in stale:
+                q |= models.Q(kind=kind, number=number)
+            cls.objects.filter(q, status=status).delete()
+        cls.objects.bulk_create([
+            cls(status=status, kind=kind, number=number, project_id=project_id, created=status.created)
+            for (kind, number), project_id in sorted(rows.items())
+            if (kind, number) not in existing or (kind, number) in stale
+        ])
+
+    def get_entries(self):
+        """Returns the references to the same thing as this one in all statuses"""
+        project_id = self.project_id if self.kind != 'bug' else None
+        return StatusReference.objects.filter(kind=self.kind, number=self.number, project_id=project_id)
+
+    def statuses(self):
+        """Returns the statuses referring to the same thing as this newest first"""
+        project_id = self.project_id if self.kind != 'bug' else None
+        return Status.objects.filter(
+            references__kind=self.kind, references__number=self.number, references__project_id=project_id
+        ).order_by('-references__created', '-references__status__id')
+
+    def get_url(self):
+        """Returns the url of what's referred to or '' if there isn't one"""
+        if self.kind == 'bug':
+            return BUG_URL % self.number
+        repo_url = self.project.repo_url.rstrip('/') if self.project and self.project.repo_url else ''
+        if not repo_url:
+            return ''
+        return '%s/%s/%s' % (repo_url, 'pull' if self.kind == 'pull' else 'issues', self.number)
+
+
+class TeamStatus(models.Model):
+    """A status on a team's timeline
+
+    Every status by a member of a team gets one of these so a team's statuses
+    can be read newest first from one index rather than by filtering all
+    statuses on the team's members. They're kept up to date when statuses are
+    saved and when team members are added or removed.
+
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='timeline', db_index=False)
+    status = models.ForeignKey(Status, on_delete=models.CASCADE, related_name='team_entries')
+    # Copy of status.created so the timeline can be ordered by it
+    created = models.DateTimeField()
+
+    class Meta:
+        db_table = 'team_status'
+        unique_together = ('team', 'status')
+        indexes = [
+            models.Index(fields=['team', '-created', '-status'], name='team_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return 'Status %s on team %s' % (self.status_id, self.team_id)
+
+    @classmethod
+    def sync_status(cls, status):
+        """Puts a status on the timelines of its user's teams and no others"""
+        team_ids = set(Team.users.through.objects.filter(
+            standupuser_id=status.user_id
+        ).values_list('team_id', flat=True))
+        existing = dict(cls.objects.filter(status=status).values_list('team_id', 'created'))
+
+        if set(existing) - team_ids:
+            cls.objects.filter(status=status, team_id__in=set(existing) - team_ids).delete()
+        if any(created != status.created for created in existing.values()):
+            cls.objects.filter(status=status).update(created=status.created)
+        cls.objects.bulk_create([
+            cls(team_id=team_id, status=status, created=status.created)
+            for team_id in sorted(team_ids - set(existing))
+        ])
+
+    @classmethod
+    def add_members(cls, team_ids, user_ids):
+        """Adds all the statuses of users to the timelines of teams"""
+        for team_id in team_ids:
+            existing = cls.objects.filter(team_id=team_id, status__user_id__in=user_ids)
+            statuses = Status.objects.filter(user_id__in=user_ids).exclude(
+                pk__in=existing.values('status_id')
+            )
+            cls.objects.bulk_create([
+                cls(team_id=team_id, status_id=pk, created=created)
+                for pk, created in statuses.values_list('pk', 'created').iterator()
+            ], batch_size=1000)
+
+    @classmethod
+    def remove_members(cls, team_ids, user_ids):
+        """Removes all the statuses of users from the timelines of teams"""
+        cls.objects.filter(team_id__in=team_ids, status__user_id__in=user_ids).delete()
+
+
+def mark_statuses_stale(statuses):
+    """Marks statuses as needing their HTML re-rendered
+
+    They get re-rendered the next time they're read or by
+    ``./manage.py rerender_statuses --stale``.
+
+    :arg statuses: Status queryset
+
+    :returns: number of statuses marked
+
+    """
+    count = statuses.exclude(html_version=0).update(html_version=0)
+    if count:
+        statuses_changed()
+    return count
+
+
+def statuses_changed():
+    """Records that how statuses render changed site-wide
+
+    That's a project's repo_url or a user's slug changing, which can change
+    any feed. Statuses written in a feed's scope are recorded per scope; see
+    ``feeds.record_feed_changes()``. See ``get_statuses_changed()``.
+
+    """
+    cache.set(STATUSES_CHANGED_KEY, timezone.now(), None)
+
+
+def get_statuses_changed():
+    """Returns when how statuses render last changed site-wide
+
+    If that's fallen out of the cache, this starts over from now.
+
+    """
+    changed = cache.get(STATUSES_CHANGED_KEY)
+    if changed is None:
+        cache.add(STATUSES_CHANGED_KEY, timezone.now(), None)
+        changed = cache.get(STATUSES_CHANGED_KEY)
+    return changed
+
+
 class SiteMessage(models.Model):
     """Messages shown on all pages on the site"""
     message = models.TextField(
@@ -0,0 +1,245 @@
+"""Pagination for status listings
+
+Django's Paginator counts all the statuses and then fetches a page with an
+OFFSET, both of which get slower the further back you go. This pages on
+(created, id) instead: a page is "the next N statuses older (or newer) than
+this one", which costs the same no matter how far back it is.
+
+Cursors are opaque strings that encode the created and id of the status at the
+edge of a page.
+
+Old page number urls still use Django's Paginator, but with counts that are
+cheap: see ``count_statuses()``.
+
+"""
+import base64
+import hashlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from standup.status.utils import bump_cache_version, get_cache_version
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+COUNT_VERSION_KEY = 'status-count-version'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(status):
+    """Returns the cursor for a status"""
+    delta = status.created - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    data = '%d.%d' % (micros, status.pk)
+    return base64.urlsafe_b64encode(data.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (created, id) for a cursor
+
+    :raises InvalidCursor: if the cursor isn't one that ``encode_cursor()``
+        returned
+
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        micros, pk = data.split('.')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (ValueError, TypeError, OverflowError):
+        raise InvalidCursor(cursor)
+
+
+class CursorPage:
+    """A page of statuses
+
+    This has the bits of Django's Page that templates use plus the cursors for
+    the neighboring pages.
+
+    """
+    def __init__(self, object_list, has_newer, has_older):
+        self.object_list = object_list
+        self._has_newer = has_newer
+        self._has_older = has_older
+
+    def __repr__(self):
+        return '<CursorPage: %d statuses>' % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        """Whether there are older statuses"""
+        return self._has_older and bool(self.object_list)
+
+    def has_previous(self):
+        """Whether there are newer statuses"""
+        return self._has_newer and bool(self.object_list)
+
+    @property
+    def next_cursor(self):
+        """Cursor for the page of older statuses; use it as ``before``"""
+        return encode_cursor(self.object_list[-1]) if self.has_next() else None
+
+    @property
+    def previous_cursor(self):
+        """Cursor for the page of newer statuses; use it as ``after``"""
+        return encode_cursor(self.object_list[0]) if self.has_previous() else None
+
+
+class CursorPaginator:
+    """Pages through statuses newest first
+
+    :arg queryset: Status queryset; any ordering is replaced with
+        ``-created, -id``
+    :arg per_page: number of statuses per page
+    :arg keys: names of the created and id fields to page on; these can be
+        the fields of a table that has copies of them like TeamStatus
+    :arg to_status: callable that takes an object from the queryset and
+        returns its status, if the queryset isn't of statuses
+
+    """
+    def __init__(self, queryset, per_page, keys=('created', 'id'), to_status=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = keys
+        self.to_status = to_status
+
+    def page(self, before=None, after=None):
+        """Returns a CursorPage
+
+        :arg before: cursor; returns the statuses just older than it
+        :arg after: cursor; returns the statuses just newer than it
+
+        With neither, this returns the newest statuses.
+
+        :raises InvalidCursor: if a cursor is bad
+
+        """
+        created_key, id_key = self.keys
+
+        if after:
+            created, pk = decode_cursor(after)
+            qs = self.queryset.filter(
+                Q(**{created_key + '__gt': created}) |
+                Q(**{created_key: created, id_key + '__gt': pk})
+            ).order_by(created_key, id_key)
+            statuses = self.get_statuses(qs)
+            has_newer = len(statuses) > self.per_page
+            statuses = statuses[:self.per_page]
+            statuses.reverse()
+            return CursorPage(statuses, has_newer=has_newer, has_older=True)
+
+        qs = self.queryset
+        if before:
+            created, pk = decode_cursor(before)
+            qs = qs.filter(
+                Q(**{created_key + '__lt': created}) |
+                Q(**{created_key: created, id_key + '__lt': pk})
+            )
+        statuses = self.get_statuses(qs.order_by('-' + created_key, '-' + id_key))
+        has_older = len(statuses) > self.per_page
+        return CursorPage(statuses[:self.per_page], has_newer=bool(before), has_older=has_older)
+
+    def get_statuses(self, qs):
+        """Returns the statuses for a page plus one more if there is one"""
+        objs = list(qs[:self.per_page + 1])
+        if self.to_status is not None:
+            objs = [self.to_status(obj) for obj in objs]
+        return objs
+
+
+def invalidate_counts():
+    """Invalidates all cached status counts; call this when statuses change"""
+    bump_cache_version(COUNT_VERSION_KEY)
+
+
+def is_whole_table(queryset):
+    """Returns whether a queryset is every row of its model's table
+
+    Anything that could change which rows or how many there are (filters,
+    extra tables, distinct, grouping, slicing, unions) means it's not.
+
+    """
+    query = queryset.query
+    return not (
+        query.where or
+        query.extra_tables or
+        query.distinct or
+        query.group_by is not None or
+        query.low_mark or
+        query.high_mark is not None or
+        query.combinator
+    )
+
+
+def estimate_count(queryset):
+    """Returns the database's estimate of the number of rows in the table
+
+    This is only for querysets of the whole table (see ``is_whole_table()``):
+    the table's row estimate says nothing about how many rows a filter
+    matches. It only works for Postgres. Otherwise, or if the table hasn't
+    been analyzed, this returns None.
+
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or not is_whole_table(queryset):
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row and row[0] > 0:
+        return int(row[0])
+    return None
+
+
+def count_statuses(queryset):
+    """Counts statuses in a queryset as cheaply as possible
+
+    Small counts (up to ``STATUS_COUNT_EXACT_LIMIT``) are exact. Bigger counts
+    of the whole table are estimated on Postgres. Other big counts, including
+    all filtered ones, are done exactly and cached by query until statuses
+    change.
+
+    """
+    sql, params = queryset.query.sql_with_params()
+    signature = hashlib.sha1(repr((queryset.db, sql, params)).encode('utf-8')).hexdigest()
+    key = 'status-count:%s:%s' % (get_cache_version(COUNT_VERSION_KEY), signature)
+
+    count = cache.get(key)
+    if count is not None:
+        return count
+
+    # This stops counting after exact_limit + 1 statuses.
+    exact_limit = settings.STATUS_COUNT_EXACT_LIMIT
+    count = queryset[:exact_limit + 1].count()
+    if count > exact_limit:
+        estimate = estimate_count(queryset)
+        count = max(count, estimate) if estimate is not None else queryset.count()
+    cache.set(key, count, settings.STATUS_COUNT_TIMEOUT)
+    return count
+
+
+class CountingPaginator(Paginator):
+    """Paginator for statuses that counts with ``count_statuses()``"""
+    @cached_property
+    def count(self):
+        return count_statuses(self.object_list)
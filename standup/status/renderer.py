@@ -0,0 +1,374 @@
+"""Renders status content to HTML
+
+Status content is plain text with some Markdown. On top of the Markdown, we
+linkify bug, pull request and issue references, wrap hashtags in spans and
+link @mentions to user pages.
+
+The references, hashtags and mentions are all recognized in a single scan of
+the content. Each match is turned into HTML as it's found, so nothing looks at
+(or mangles) HTML generated for an earlier match.
+
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from html import escape
+
+from django.conf import settings
+from django.core.cache import cache
+
+from bleach.callbacks import nofollow
+from bleach.linkifier import Linker
+from bleach.sanitizer import Cleaner
+from jinja2 import Markup
+from markdown import Markdown
+
+from standup.mdext.nixheaders import NixHeaderExtension
+from standup.status.utils import trim_urls
+
+
+# Bump this whenever the output of render() changes. Statuses whose stored HTML
+# was rendered by a different version get re-rendered.
+RENDERER_VERSION = 2
+
+BUG_RE = re.compile(r'(bug #?(\d+))', flags=re.I)
+PULL_RE = re.compile(r'((?:pull|pr) #?(\d+))', flags=re.I)
+ISSUE_RE = re.compile(r'(issue #?(\d+))', flags=re.I)
+USER_RE = re.compile(r'(?<=^|(?<=[^\w\-.]))@([\w-]+)', flags=re.I)
+TAG_RE = re.compile(r'(?:^|[^\w\\/])#([a-z][a-z0-9_.-]*)(?:\b|$)', flags=re.I)
+
+BUG_URL = 'http://bugzilla.mozilla.org/show_bug.cgi?id=%s'
+
+
+class ThreadTools(threading.local):
+    """Markdown and bleach instances for the current thread
+
+    Markdown instances keep state between reset() and convert(), and bleach's
+    Cleaner and Linker keep state in their html parsers, so none of them can be
+    shared between threads. Each thread gets its own set the first time it uses
+    an attribute of ``TOOLS``.
+
+    """
+    def __init__(self):
+        self.markdown = Markdown(output_format='html5', extensions=[
+            NixHeaderExtension(),
+            'nl2br',
+            'smart_strong'
+        ])
+        self.cleaner = Cleaner(tags=[])
+        self.linker = Linker(callbacks=[trim_urls, nofollow])
+
+
+TOOLS = ThreadTools()
+
+# Content that's just words, spaces and a handful of punctuation renders to
+# itself wrapped in a <p>. This is deliberately conservative: anything that
+# might be Markdown, a url (so no "/" and no "." followed by anything other than
+# a space or another "."), a hashtag, a mention or need escaping doesn't match.
+PLAIN_TEXT_RE = re.compile(r"""
+    (?!\d+\.)                                    # "1. " starts an ordered list
+    [^\W_]
+    (?:[^\W_]|[ ,;:'"?!()%$=+~^|{}-]|\.(?=[ .]|$))*
+    (?<!\ )\Z
+""", flags=re.X)
+REFERENCE_RE = re.compile(r'(?:bug|pull|pr|issue) #?\d', flags=re.I)
+
+
+# Bug references take precedence over hashtags and mentions, so "#debug 5" is
+# "#de" followed by bug 5. This guards each hashtag/mention character.
+_NOT_BUG = r'(?!bug\ \#?\d)'
+
+_BUG = r'(?P<bug>bug\ \#?(?P<bug_id>\d+))'
+_TAG = (
+    r'{lookbehind}\#(?P<tag>' + _NOT_BUG + r'[a-z](?:' + _NOT_BUG + r'[a-z0-9_.-])*)'
+    # A hashtag followed by a bug reference ends where the bug link's HTML starts
+    r'(?:' + _NOT_BUG + r'(?:\b|$)|(?<=\w)(?=bug\ \#?\d))'
+)
+_MENTION = r'{lookbehind}@(?P<mention>(?:' + _NOT_BUG + r'[\w-])+)'
+_PULL = r'(?P<pull>(?:pull|pr)\ \#?(?P<pull_id>\d+))'
+_ISSUE = r'(?P<issue>issue\ \#?(?P<issue_id>\d+))'
+
+_TAG_LOOKBEHIND = r'(?<![\w\\/])'
+_MENTION_LOOKBEHIND = r'(?<![\w\-.])'
+
+
+def _compile(*patterns):
+    return re.compile('|'.join(patterns), flags=re.I | re.X)
+
+
+# Pull requests and issues are only recognized when there's a repository to
+# link them to.
+SCANNERS = {
+    False: _compile(
+        _BUG,
+        _TAG.format(lookbehind=_TAG_LOOKBEHIND),
+        _MENTION.format(lookbehind=_MENTION_LOOKBEHIND),
+    ),
+    True: _compile(
+        _BUG,
+        _TAG.format(lookbehind=_TAG_LOOKBEHIND),
+        _MENTION.format(lookbehind=_MENTION_LOOKBEHIND),
+        _PULL,
+        _ISSUE,
+    ),
+}
+
+# Hashtags and mentions directly after the HTML for a bug link (and mentions
+# directly after the HTML for a hashtag) follow a ">", so they're recognized
+# regardless of what character precedes them in the content.
+AFTER_MARKUP = {
+    'bug': _compile(_TAG.format(lookbehind=''), _MENTION.format(lookbehind='')),
+    'tag': _compile(_MENTION.format(lookbehind='')),
+}
+
+
+class LRUCache:
+    """Thread-safe dict-ish cache that holds on to the most recently used items"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Stats:
+    """Thread-safe counters"""
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def incr(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+# Rendered HTML is cached in this process (LOCAL_RENDER_CACHE) in front of the
+# Django cache which is shared between processes.
+LOCAL_RENDER_CACHE = LRUCache(settings.RENDER_CACHE_SIZE)
+RENDER_CACHE_STATS = Stats()
+
+
+def clean(content):
+    """Escapes all HTML in the content"""
+    return TOOLS.cleaner.clean(content)
+
+
+def find_mentions(content):
+    """Returns the set of slugs @mentioned in the content"""
+    return linkify_references(clean(content))[1]
+
+
+def find_tags(content):
+    """Returns the set of hashtags in the content, lowercased and without the #"""
+    if is_plain_text(content):
+        return set()
+    return linkify_references(clean(content))[2]
+
+
+def find_references(content):
+    """Returns the set of (kind, number) bug, pull request and issue references in the content
+
+    Kinds are "bug", "pull" and "issue". Pull requests and issues are found
+    whether or not there's a repository to link them to.
+
+    """
+    if is_plain_text(content):
+        return set()
+    return linkify_references(clean(content), all_references=True)[3]
+
+
+def linkify_references(text, repo_url='', mention_url=None, all_references=False):
+    """Linkifies references, hashtags and mentions in cleaned text
+
+    :arg text: the text to linkify; this must already be cleaned of HTML
+    :arg repo_url: the url of the repository pull requests and issues refer to
+    :arg mention_url: callable that takes a slug and returns the url for the
+        user or None if there's no such user
+    :arg all_references: whether to recognize pull requests and issues when
+        there's no ``repo_url`` and collect all the references; this is for
+        finding them, since pull request and issue links won't go anywhere
+
+    :returns: tuple of (linkified text, set of slugs that were @mentioned,
+        set of lowercased hashtags, set of (kind, number) references); the
+        references are only collected with ``all_references``
+
+    """
+    repo = repo_url.rstrip('/') if repo_url else ''
+    scanner = SCANNERS[bool(repo) or all_references]
+
+    parts = []
+    mentions = set()
+    tags = set()
+    references = set()
+    pos = 0
+    # The kind of the last match that generated HTML and where it ended
+    markup_kind, markup_end = None, -1
+
+    while True:
+        match = None
+        if markup_end == pos and markup_kind in AFTER_MARKUP:
+            match = AFTER_MARKUP[markup_kind].match(text, pos)
+        if match is None:
+            match = scanner.search(text, pos)
+        if match is None:
+            break
+
+        parts.append(text[pos:match.start()])
+        kind = match.lastgroup
+        if kind == 'bug':
+            if all_references:
+                references.add((kind, int(match.group('bug_id'))))
+            html = '<a href="%s">%s</a>' % (BUG_URL % match.group('bug_id'), match.group())
+        elif kind == 'tag':
+            tag = match.group('tag')
+            tags.add(tag.lower())
+            html = '<span class="tag tag-%s">#%s</span>' % (tag.lower(), tag)
+        elif kind == 'mention':
+            slug = match.group('mention')
+            mentions.add(slug)
+            url = mention_url(slug) if mention_url else None
+            if not url:
+                # Not a user, so it's just text. Step past the @ and keep
+                # scanning because there might be a reference in the slug.
+                parts.append('@')
+                pos = match.start() + 1
+                markup_kind = None
+                continue
+            html = '<a href="%s">@%s</a>' % (url, slug)
+        elif kind == 'pull':
+            if all_references:
+                references.add((kind, int(match.group('pull_id'))))
+            html = '<a href="%s/pull/%s">%s</a>' % (repo, match.group('pull_id'), match.group())
+        else:
+            if all_references:
+                references.add((kind, int(match.group('issue_id'))))
+            html = '<a href="%s/issues/%s">%s</a>' % (repo, match.group('issue_id'), match.group())
+
+        parts.append(html)
+        pos = match.end()
+        markup_kind, markup_end = kind, pos
+
+    parts.append(text[pos:])
+    return ''.join(parts), mentions, tags, references
+
+
+def is_plain_text(content):
+    """Returns whether the content renders to itself wrapped in a <p>"""
+    return bool(PLAIN_TEXT_RE.match(content)) and not REFERENCE_RE.search(content)
+
+
+def render(content, repo_url='', mention_url=None):
+    """Renders status content to HTML
+
+    Takes the same arguments and returns the same thing as ``render_full()``,
+    but skips the Markdown and linkifying for plain text.
+
+    """
+    if is_plain_text(content):
+        return Markup('<p>%s</p>' % escape(content, quote=False)), set()
+    return render_full(content, repo_url, mention_url)
+
+
+def render_full(content, repo_url='', mention_url=None):
+    """Renders status content to HTML
+
+    :arg content: the status content
+    :arg repo_url: the url of the repository pull requests and issues refer to
+    :arg mention_url: callable that takes a slug and returns the url for the
+        user or None if there's no such user
+
+    :returns: tuple of (html, set of slugs that were @mentioned)
+
+    """
+    # Remove icky stuff.
+    formatted = clean(content)
+
+    formatted, mentions = linkify_references(formatted, repo_url, mention_url)[:2]
+
+    # markdownify
+    formatted = TOOLS.markdown.reset().convert(formatted)
+
+    # Linkify bare urls
+    formatted = TOOLS.linker.linkify(formatted)
+    return Markup(formatted), mentions
+
+
+def render_cache_key(content, repo_url=''):
+    """Returns the cache key for rendered content"""
+    data = '\0'.join([str(RENDERER_VERSION), repo_url or '', content])
+    return 'status-html:%s' % hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def cached_render(content, repo_url='', mention_url=None):
+    """Renders status content to HTML using the render cache
+
+    This takes the same arguments and returns the same thing as ``render()``.
+
+    Cached HTML is keyed on the content, repo_url and renderer version. It's
+    also stored with the urls its @mentions were linked to and only used if
+    ``mention_url`` still links them the same way.
+
+    """
+    if not settings.RENDER_CACHE_ENABLED:
+        return render(content, repo_url, mention_url)
+
+    def is_current(value):
+        html, links = value
+        return all(
+            (mention_url(slug) if mention_url else None) == url
+            for slug, url in links.items()
+        )
+
+    key = render_cache_key(content, repo_url)
+    value = LOCAL_RENDER_CACHE.get(key)
+    if value is not None and is_current(value):
+        RENDER_CACHE_STATS.incr('local_hits')
+    else:
+        value = cache.get(key)
+        if value is not None and is_current(value):
+            RENDER_CACHE_STATS.incr('shared_hits')
+        else:
+            RENDER_CACHE_STATS.incr('misses')
+            links = {}
+
+            def recording_mention_url(slug):
+                links[slug] = mention_url(slug) if mention_url else None
+                return links[slug]
+
+            html, mentions = render(content, repo_url, recording_mention_url)
+            value = (str(html), links)
+            cache.set(key, value, settings.RENDER_CACHE_TIMEOUT)
+        LOCAL_RENDER_CACHE.set(key, value)
+
+    html, links = value
+    return Markup(html), set(links)
@@ -1,57 +1,110 @@
-from django.db.models import Q
+"""Status search
 
+Search text is parsed into AND/OR clauses of words and "quoted phrases" (see
+``generate_query()``) and compiled by a search backend:
 
-# FIXME(willkg): This ignores the variety of other whitespace characters in unicode.
-WHITESPACE = u' \t\r\n'
+``icontains``
+    Matches each word or phrase as a case-insensitive substring of the
+    content. This works everywhere, but has to look at every status.
 
+``trigram``
+    The same matches as ``icontains``, but Postgres can use the trigram index
+    on ``status.content`` to find them (see standup/status/lookups.py). On
+    other databases, this is ``icontains``.
 
-def to_tokens(text):
-    """Breaks the search text into tokens"""
-    in_quotes = False
-    escape = False
+``postgres``
+    Matches words and phrases with Postgres full-text search against
+    ``Status.search_vector``, which has a GIN index and is kept up to date by a
+    trigger (see migration 0029). This can also rank results by relevance.
 
-    tokens = []
-    token = []
+``index``
+    Matches words and phrases with the inverted index in
+    ``SEARCH_INDEX_DIR`` (see standup/status/index.py). This works everywhere
+    and doesn't touch the status table to search.
 
-    for c in text:
-        if c == u'\\':
-            escape = True
-            token.append(c)
-            continue
+The backend is picked with the ``SEARCH_BACKEND`` setting.
 
-        if in_quotes:
-            if not escape and c == u'"':
-                in_quotes = False
-            token.append(c)
+"""
+import re
+from collections import OrderedDict, defaultdict, namedtuple
+from functools import lru_cache
 
-        elif not escape and c == u'"':
-            in_quotes = True
-            token.append(c)
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, F, Q
 
-        elif c in WHITESPACE:
-            if token:
-                tokens.append(u''.join(token))
-                token = []
+from standup.status.models import Project, StandupUser, Status, Team
+from standup.status.utils import chunked
 
-        else:
-            token.append(c)
 
-        escape = False
+# A token is a run of quoted sections, escapes outside quotes (a backslash
+# doesn't escape whitespace) and other text. A run of backslashes escapes the
+# character after it, so the quote in \\" doesn't start a quoted section. A
+# quoted section that's missing its closing quote runs to the end of the text
+# and is the "open" group.
+_QUOTED = r'"[^"\\]*(?:\\+(?:[^\\]|\Z)[^"\\]*)*'
+TOKEN_RE = re.compile(
+    r'(?:%s"|(?P<open>%s\Z)|\\+(?:[^\s\\]|(?=\s)|\Z)|[^\s"\\]+)+' % (_QUOTED, _QUOTED),
+    flags=re.S
+)
 
-    if in_quotes:
-        # Finish off a missing quote
-        if token:
-            token.append(u'"')
-        else:
-            tokens[-1] = tokens[-1] + u'"'
+UNESCAPE_RE = re.compile(r'\\(.?)', flags=re.S)
+
+# Only this many tokens of the search text are used. This keeps the queries
+# (and the work done on them) small for absurdly long search text.
+MAX_TOKENS = 200
+
+WORD = 'WORD'
+PHRASE = 'PHRASE'
+AND = 'AND'
+OR = 'OR'
+
+Token = namedtuple('Token', ['kind', 'text', 'value'])
+Token.__doc__ = """A token of search text
+
+:arg kind: WORD, PHRASE, AND or OR
+:arg text: the text of the token with a missing closing quote added
+:arg value: the unescaped text to match for words and phrases
 
-    if token:
-        # Add last token
-        tokens.append(u''.join(token))
+"""
 
+
+def scan(text, limit=None):
+    """Breaks the search text into a list of Tokens
+
+    Words and phrases with nothing to match, like a lone backslash or a
+    missing closing quote after some whitespace, are left out since they'd
+    match everything.
+
+    :arg text: the search text
+    :arg limit: the most tokens to return; the text after them isn't scanned
+
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(text):
+        if len(tokens) == limit:
+            break
+        raw = match.group()
+        if raw == AND or raw == OR:
+            tokens.append(Token(raw, raw, None))
+            continue
+        if match.group('open') is not None:
+            # Finish off a missing quote
+            raw += '"'
+        if raw.startswith('"'):
+            token = Token(PHRASE, raw, unescape(raw[1:-1]))
+        else:
+            token = Token(WORD, raw, unescape(raw) if '\\' in raw else raw)
+        if token.value.strip():
+            tokens.append(token)
     return tokens
 
 
+def to_tokens(text):
+    """Breaks the search text into tokens"""
+    return [token.text for token in scan(text)]
+
+
 class ParseError(Exception):
     pass
 
@@ -67,27 +120,51 @@ def unescape(text):
     u'\\abc'
 
     """
-    # Note: We can ditch this and do it in tokenizing if tokenizing
-    # returned typed tokens rather than a list of strings.
-    new_text = []
-    escape = False
-    for c in text:
-        if not escape and c == u'\\':
-            escape = True
-            continue
+    # Splitting on escapes keeps the escaped characters; this is a lot faster
+    # than re.sub() for text with lots of escapes.
+    return ''.join(UNESCAPE_RE.split(text))
+
+
+# The text search configuration the search_vector trigger uses; queries have to
+# use the same one.
+SEARCH_CONFIG = 'english'
+
+
+class PhraseQuery(SearchQuery):
+    """SearchQuery for words that have to be next to each other"""
+    def as_sql(self, compiler, connection):
+        sql, params = super().as_sql(compiler, connection)
+        return sql.replace('plainto_tsquery', 'phraseto_tsquery', 1), params
+
+
+class IContainsCompiler:
+    """Compiles matches into ``icontains`` Qs on a field"""
+    lookup = 'icontains'
+
+    def __init__(self, field):
+        self.field = field
 
-        new_text.append(c)
-        escape = False
+    def match(self, text):
+        return Q(**{'%s__%s' % (self.field, self.lookup): text})
 
-    return u''.join(new_text)
+    match_phrase = match
 
 
-def build_match(field, token):
-    return Q(**{'%s__icontains' % field: unescape(token)})
+class TrigramCompiler(IContainsCompiler):
+    """Compiles matches into ``trgm_icontains`` Qs on a field"""
+    lookup = 'trgm_icontains'
 
 
-def build_match_phrase(field, token):
-    return Q(**{'%s__icontains' % field: unescape(token)})
+class TSQueryCompiler:
+    """Compiles matches into SearchQuerys for a search vector field"""
+    def __init__(self, field):
+        self.field = field
+
+    def match(self, text):
+        return SearchQuery(text, config=SEARCH_CONFIG)
+
+    def match_phrase(self, text):
+        return PhraseQuery(text, config=SEARCH_CONFIG)
 
 
 def build_or(clauses):
@@ -110,67 +187,92 @@ def build_and(clauses):
     return q
 
 
-def parse_match(field, tokens):
-    """Parses a match or match_phrase node
+def parse_matches(tokens):
+    """Parses a run of match and match_phrase tokens
 
-    :arg field: the field we're querying on
-    :arg tokens: list of tokens to consume
+    :arg tokens: list of tokens with no operators
 
-    :returns: list of match clauses
+    :returns: list of ('match', text) and ('phrase', text) nodes
     """
-    clauses = []
-
-    while tokens and tokens[-1] not in (u'OR', u'AND'):
-        token = tokens.pop()
-
-        if token.startswith(u'"'):
-            clauses.append(build_match_phrase(field, token[1:-1]))
-        else:
-            clauses.append(build_match(field, token))
+    return [
+        ('phrase' if token.kind == PHRASE else 'match', token.value)
+        for token in tokens
+    ]
 
-    return clauses
 
+def parse_tokens(tokens):
+    """Parses tokens into a list of nodes
 
-def parse_oper(field, lhs, tokens):
-    """Parses a single bool query
+    :arg tokens: list of Tokens
 
-    :arg field: the field we're querying on
-    :arg lhs: the clauses on the left hand side
-    :arg tokens: list of tokens to consume
-
-    :returns: bool query
+    :returns: list of nodes; see ``parse()``
     """
-    token = tokens.pop()
-    rhs = parse_query(field, tokens)
+    # Split the tokens into runs of matches and the operators between them.
+    runs = [[]]
+    opers = []
+    for token in tokens:
+        if token.kind in (AND, OR):
+            opers.append(token.kind)
+            runs.append([])
+        else:
+            runs[-1].append(token)
+
+    # Each operator joins the matches to its left with everything to its
+    # right, so build the nodes from the right.
+    nodes = parse_matches(runs.pop())
+    while opers:
+        oper = opers.pop().lower()
+        clauses = parse_matches(runs.pop())
+        for node in nodes:
+            # a AND (b AND c) is (a AND b AND c)
+            if node[0] == oper:
+                clauses.extend(node[1:])
+            else:
+                clauses.append(node)
+        if len(clauses) > 1:
+            nodes = [(oper,) + tuple(clauses)]
+        else:
+            nodes = clauses
+    return nodes
+
 
-    if token == u'OR':
-        lhs.extend(rhs)
-        return build_or(lhs)
-    elif token == u'AND':
-        lhs.extend(rhs)
-        return build_and(lhs)
+@lru_cache(maxsize=1000)
+def parse(text):
+    """Parses search text into a query tree
 
-    # Note: This probably will never get reached given the way
-    # parse_match slurps. If the code were changed, it's possible this
-    # might be triggerable.
-    raise ParseError('Not an oper token: {0}'.format(token))
+    :arg text: the search text with leading and trailing whitespace removed
 
+    :returns: tree of tuples: ``('match', text)``, ``('phrase', text)``,
+        ``('and', node, node, ...)`` or ``('or', node, node, ...)``
 
-def parse_query(field, tokens):
-    """Parses a match or query
+    :raises ParseError: if there's nothing to search for
 
-    :arg field: the field we're querying on
-    :arg tokens: list of tokens to consume
+    The trees are immutable, so parsed text is cached.
 
-    :returns: list of clauses
     """
-    match_clauses = parse_match(field, tokens)
-    if tokens:
-        return [parse_oper(field, match_clauses, tokens)]
-    return match_clauses
+    nodes = parse_tokens(scan(text, MAX_TOKENS))
+    if not nodes:
+        raise ParseError('Nothing to search for: {0}'.format(text))
+    if len(nodes) > 1:
+        return ('or',) + tuple(nodes)
+    return nodes[0]
+
+
+def compile_query(node, compiler):
+    """Compiles a query tree from ``parse()`` with a compiler"""
+    kind = node[0]
+    if kind == 'match':
+        return compiler.match(node[1])
+    if kind == 'phrase':
+        return compiler.match_phrase(node[1])
+
+    clauses = [compile_query(child, compiler) for child in node[1:]]
+    if kind == 'or':
+        return build_or(clauses)
+    return build_and(clauses)
 
 
-def generate_query(field, text):
+def generate_query(field, text, compiler_class=IContainsCompiler):
     """Parses the search text and returns a Q
 
     This tries to handle parse errors. If the text is unparseable, it
@@ -178,10 +280,12 @@ def generate_query(field, text):
 
     :arg field: the field to search
     :arg text:  the user's search text
+    :arg compiler_class: the class that compiles matches; with
+        TSQueryCompiler this returns a SearchQuery rather than a Q
 
     :return: Q
 
-    It uses a recursive descent parser with this grammar::
+    It parses with this grammar::
 
         query = match | match oper
         oper  = "AND" query |
@@ -189,20 +293,187 @@ def generate_query(field, text):
         match = token ... |
                 '"' token '"'
 
-    If it encounters a parse error, it attempts to recover, but if it
-    can't, then it just returns a single match query.
+    Matches next to each other are ORed. If it encounters a parse error, it
+    attempts to recover, but if it can't, then it just returns a single match
+    query.
 
-    """
-    # Build the Q tree data structure bottom up.
-    tokens = to_tokens(text)
-    tokens.reverse()
+    The parsed query is cached by ``parse()``, so paging through the results
+    of a search only parses it once.
 
+    """
+    compiler = compiler_class(field)
     try:
-        clauses = parse_query(field, tokens)
+        node = parse(text.strip())
     except ParseError:
-        return build_match(field, text)
+        return compiler.match(unescape(text))
 
-    if len(clauses) > 1:
-        return build_or(clauses)
+    return compile_query(node, compiler)
+
+
+def search_statuses(statuses, text, rank=False):
+    """Returns the statuses that match the search text
+
+    :arg statuses: Status queryset to search
+    :arg text: the user's search text
+    :arg rank: whether to order the statuses by relevance; only the postgres
+        backend can, other backends leave the order alone
+
+    """
+    if not text.strip():
+        return statuses
+
+    if settings.SEARCH_BACKEND == 'postgres':
+        query = generate_query('search_vector', text, TSQueryCompiler)
+        statuses = statuses.filter(search_vector=query)
+        if rank:
+            statuses = statuses.annotate(
+                rank=SearchRank(F('search_vector'), query)
+            ).order_by('-rank', '-created', '-id')
+        return statuses
 
-    return clauses[0]
+    if settings.SEARCH_BACKEND == 'trigram':
+        return statuses.filter(generate_query('content', text, TrigramCompiler))
+
+    # The index backend's matches can be any number of ids, which is too many
+    # to filter a queryset on, so SearchView pages through them itself (see
+    # ``facet_ids()``). Here it falls back to icontains.
+    return statuses.filter(generate_query('content', text))
+
+
+# Facets narrow search results: the query string parameter and the lookup the
+# slug in it filters statuses on.
+FACETS = OrderedDict([
+    ('project', 'project__slug'),
+    ('user', 'user__slug'),
+    ('team', 'team_entries__team__slug'),
+])
+
+# Most status ids to look up in one query; SQLite allows 999 parameters
+ID_CHUNK_SIZE = 500
+
+# Most index matches to count facets for when none are picked
+FACET_SAMPLE_SIZE = 1000
+
+
+def narrow_statuses(statuses, selected):
+    """Narrows statuses to the selected facets
+
+    :arg statuses: Status queryset
+    :arg selected: dict of facet name -> slug
+
+    """
+    for name, slug in selected.items():
+        statuses = statuses.filter(**{FACETS[name]: slug})
+    return statuses
+
+
+def facet_counts(statuses, limit=10):
+    """Counts statuses by project, user and team
+
+    The counts all come from one query that counts statuses by project and
+    user. User counts are added up into the counts for the users' teams since
+    a team's statuses are its users' statuses.
+
+    :arg statuses: Status queryset
+    :arg limit: the most objects to return counts for in each facet
+
+    :returns: dict of facet name -> list of (object, count), biggest counts first
+
+    """
+    project_counts = defaultdict(int)
+    user_counts = defaultdict(int)
+    rows = statuses.order_by().values_list('project_id', 'user_id').annotate(count=Count('id'))
+    for project_id, user_id, count in rows:
+        if project_id is not None:
+            project_counts[project_id] += count
+        user_counts[user_id] += count
+    return top_facets(project_counts, user_counts, limit)
+
+
+def top_facets(project_counts, user_counts, limit):
+    """Returns the biggest project, user and team counts; see ``facet_counts()``"""
+    team_counts = defaultdict(int)
+    for chunk in chunked(sorted(user_counts), ID_CHUNK_SIZE):
+        memberships = Team.users.through.objects.filter(standupuser_id__in=chunk)
+        for team_id, user_id in memberships.values_list('team_id', 'standupuser_id'):
+            team_counts[team_id] += user_counts[user_id]
+
+    def top(model, counts):
+        ids = sorted(counts, key=lambda id_: (-counts[id_], id_))[:limit]
+        objs = model.objects.in_bulk(ids)
+        return [(objs[id_], counts[id_]) for id_ in ids if id_ in objs]
+
+    return {
+        'project': top(Project, project_counts),
+        'user': top(StandupUser, user_counts),
+        'team': top(Team, team_counts),
+    }
+
+
+def scan_facets(ids, project_ids=None, user_ids=None):
+    """Reads the project and user of statuses ``ID_CHUNK_SIZE`` at a time
+
+    :arg ids: list of status ids
+    :arg project_ids: set of project ids to keep or None for any
+    :arg user_ids: set of user ids to keep or None for any
+
+    :returns: tuple of (set of ids kept, project id -> count, user id -> count)
+
+    """
+    narrowed = set()
+    project_counts = defaultdict(int)
+    user_counts = defaultdict(int)
+    for chunk in chunked(ids, ID_CHUNK_SIZE):
+        rows = Status.objects.filter(pk__in=chunk).values_list('pk', 'project_id', 'user_id')
+        for pk, project_id, user_id in rows:
+            if project_ids is not None and project_id not in project_ids:
+                continue
+            if user_ids is not None and user_id not in user_ids:
+                continue
+            narrowed.add(pk)
+            if project_id is not None:
+                project_counts[project_id] += 1
+            user_counts[user_id] += 1
+    return narrowed, project_counts, user_counts
+
+
+def facet_ids(ids, selected, limit=10):
+    """Narrows a list of status ids to the selected facets and counts them
+
+    This is ``narrow_statuses()`` and ``facet_counts()`` for the ids the
+    search index matched, which can be any number of them. Rather than
+    filtering on all of them at once, this reads the project and user of
+    ``ID_CHUNK_SIZE`` statuses at a time and narrows and counts them here.
+
+    With no facets picked there's nothing to narrow, so only the first
+    ``FACET_SAMPLE_SIZE`` ids are read and counted. Deleted statuses are left
+    in the ids for the caller to skip.
+
+    :arg ids: list of status ids
+    :arg selected: dict of facet name -> slug
+    :arg limit: the most objects to return counts for in each facet
+
+    :returns: tuple of (the ids of statuses that exist and are in the facets
+        in the same order or all the ids if none are picked, facet counts like
+        ``facet_counts()``, whether the counts only cover the first
+        ``FACET_SAMPLE_SIZE`` ids)
+
+    """
+    if not selected:
+        _, project_counts, user_counts = scan_facets(ids[:FACET_SAMPLE_SIZE])
+        return ids, top_facets(project_counts, user_counts, limit), len(ids) > FACET_SAMPLE_SIZE
+
+    project_ids = user_ids = None
+    if 'project' in selected:
+        project_ids = set(Project.objects.filter(slug=selected['project']).values_list('pk', flat=True))
+    if 'user' in selected:
+        user_ids = set(StandupUser.objects.filter(slug=selected['user']).values_list('pk', flat=True))
+    if 'team' in selected:
+        members = set(Team.users.through.objects.filter(
+            team__slug=selected['team']
+        ).values_list('standupuser_id', flat=True))
+        user_ids = members if user_ids is None else user_ids & members
+
+    narrowed, project_counts, user_counts = scan_facets(ids, project_ids, user_ids)
+    ids = [pk for pk in ids if pk in narrowed]
+    return ids, top_facets(project_counts, user_counts, limit), False
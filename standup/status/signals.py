@@ -0,0 +1,190 @@
+"""Keeps things derived from statuses up to date
+
+Rendered status HTML depends on the status' project's ``repo_url`` (pull
+request and issue links) and on which @mentioned slugs belong to users. When
+either changes, the affected statuses are marked stale so they get re-rendered
+the next time they're read or by ``./manage.py rerender_statuses --stale``.
+
+@mentions (StatusMention) of a slug point at the user with that slug as slugs
+change.
+
+Team timelines (TeamStatus) get a team member's statuses added when they join
+the team and removed when they leave. Cached status counts are invalidated when
+statuses are added or removed or a team's members change.
+
+Feed validators change when statuses are written in their scope: the scopes
+written in a transaction are recorded and, once it commits, bumped and their
+stored feed documents rebuilt.
+
+With the ``index`` search backend, saved and deleted statuses are journaled to
+the search index once the transaction commits.
+
+The cached teams, projects and site messages in the nav are invalidated when
+any of them change.
+
+"""
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from standup.status.context_processors import NAV_VERSION_KEY
+from standup.status.feeds import record_feed_changes, status_scopes
+from standup.status.index import get_search_index
+from standup.status.models import (
+    Project,
+    SiteMessage,
+    StandupUser,
+    Status,
+    StatusMention,
+    Team,
+    TeamStatus,
+    mark_statuses_stale,
+)
+from standup.status.pagination import invalidate_counts
+from standup.status.utils import bump_cache_version
+
+
+def get_old_value(instance, field):
+    """Returns the value of a field as it is in the database or None"""
+    if instance.pk is None:
+        return None
+    values = type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True)
+    return values.first()
+
+
+@receiver(pre_save, sender=Project)
+def project_pre_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._old_repo_url = get_old_value(instance, 'repo_url')
+
+
+@receiver(post_save, sender=Project)
+def project_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    if instance._old_repo_url != instance.repo_url:
+        mark_statuses_stale(Status.objects.filter(project=instance))
+
+
+@receiver(pre_save, sender=StandupUser)
+def standupuser_pre_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._old_slug = get_old_value(instance, 'slug')
+
+
+@receiver(post_save, sender=StandupUser)
+def standupuser_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw or instance._old_slug == instance.slug:
+        return
+    # Statuses mentioning the old slug no longer link to this user and ones
+    # mentioning the new slug now do.
+    if instance._old_slug:
+        StatusMention.objects.filter(slug=instance._old_slug, user=instance).update(user=None)
+    if instance.slug:
+        StatusMention.objects.filter(slug=instance.slug).update(user=instance)
+    slugs = {instance._old_slug, instance.slug} - {None, ''}
+    if slugs:
+        mark_statuses_stale(Status.objects.filter(mentions__slug__in=slugs))
+
+
+@receiver(pre_delete, sender=StandupUser)
+def standupuser_pre_delete(sender, instance, **kwargs):
+    # Team memberships go without m2m_changed, so their team feeds change here
+    record_feed_changes(('team', pk) for pk in instance.teams.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=StandupUser)
+def standupuser_post_delete(sender, instance, **kwargs):
+    if instance.slug:
+        mark_statuses_stale(Status.objects.filter(mentions__slug=instance.slug))
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def status_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_counts()
+
+
+@receiver(pre_save, sender=Status)
+def status_pre_save(sender, instance, raw=False, **kwargs):
+    instance._old_feed_scopes = set()
+    if raw or instance.pk is None:
+        return
+    old = Status.objects.filter(pk=instance.pk).only(
+        'user', 'project', 'content', 'html_mentions'
+    ).first()
+    if old is not None:
+        # The old tags and references are the same as the new ones unless the
+        # content (or for pull requests and issues, the project) changed
+        scan = old.content != instance.content or old.project_id != instance.project_id
+        instance._old_feed_scopes = status_scopes(old, scan=scan)
+
+
+@receiver(post_save, sender=Status)
+def status_post_save_scopes(sender, instance, raw=False, **kwargs):
+    if not raw:
+        scopes = status_scopes(instance, scan=False) | instance._old_feed_scopes
+        record_feed_changes(scopes, status_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Status)
+def status_post_delete_scopes(sender, instance, **kwargs):
+    record_feed_changes(status_scopes(instance))
+
+
+@receiver(post_save, sender=Status)
+def status_post_save_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if settings.SEARCH_BACKEND != 'index' or raw:
+        return
+    if update_fields is None or 'content' in update_fields:
+        transaction.on_commit(partial(get_search_index().journal, instance.pk, instance.content))
+
+
+@receiver(post_delete, sender=Status)
+def status_post_delete_index(sender, instance, **kwargs):
+    if settings.SEARCH_BACKEND == 'index':
+        transaction.on_commit(partial(get_search_index().journal, instance.pk))
+
+
+@receiver(m2m_changed, sender=Team.users.through)
+def team_users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Forward is team.users.add(user), reverse is user.teams.add(team)
+    if action == 'post_add':
+        if reverse:
+            TeamStatus.add_members(pk_set, [instance.pk])
+        else:
+            TeamStatus.add_members([instance.pk], pk_set)
+    elif action == 'post_remove':
+        if reverse:
+            TeamStatus.remove_members(pk_set, [instance.pk])
+        else:
+            TeamStatus.remove_members([instance.pk], pk_set)
+    elif action == 'pre_clear':
+        if reverse:
+            record_feed_changes(('team', pk) for pk in instance.teams.values_list('pk', flat=True))
+            TeamStatus.objects.filter(status__user=instance).delete()
+        else:
+            TeamStatus.objects.filter(team=instance).delete()
+
+    if action in ('post_add', 'post_remove'):
+        team_ids = pk_set if reverse else [instance.pk]
+        record_feed_changes(('team', pk) for pk in team_ids)
+    elif action == 'post_clear' and not reverse:
+        record_feed_changes([('team', instance.pk)])
+
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_counts()
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=SiteMessage)
+@receiver(post_delete, sender=SiteMessage)
+def nav_changed(sender, **kwargs):
+    bump_cache_version(NAV_VERSION_KEY)
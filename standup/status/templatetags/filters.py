@@ -5,10 +5,10 @@ from django_jinja import library
 
 @library.global_function
 def merge_query(request, **kwargs):
-    """merge query params into existing ones"""
+    """merge query params into existing ones; params set to None are removed"""
     params = request.GET.dict()
     params.update(kwargs)
-    return urlencode(params)
+    return urlencode({key: value for key, value in params.items() if value is not None})
 
 
 @library.filter
@@ -1,6 +1,10 @@
 from django.core.cache import cache
 
+from standup.status.renderer import LOCAL_RENDER_CACHE, RENDER_CACHE_STATS
+
 
 def pytest_runtest_setup(item):
-    # Clear the cache before every test
+    # Clear the caches before every test
     cache.clear()
+    LOCAL_RENDER_CACHE.clear()
+    RENDER_CACHE_STATS.clear()
@@ -1,8 +1,16 @@
+from datetime import datetime
+
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.six import StringIO
 
 import pytest
+import pytz
 
+from standup.status.management.commands import rerender_statuses
+from standup.status.models import Status, StatusMention, StatusReference, StatusTag
+from standup.status.renderer import RENDERER_VERSION
 from standup.status.tests.factories import (
     StandupUserFactory,
     StatusFactory,
@@ -138,3 +146,159 @@ class TestMergeUser:
         user_keep = django_user_model.objects.get(id=user_keep.id)
         teams = [team.name for team in user_keep.profile.teams.all()]
         assert sorted(teams) == sorted([team1.name, team2.name, team3.name])
+
+
+class TestRerenderStatuses:
+    def make_stale(self):
+        Status.objects.update(content_html='', html_version=0, html_mentions='')
+
+    @pytest.mark.parametrize('jobs', [1, 2])
+    def test_rerender(self, db, jobs):
+        StandupUserFactory.create(user__username='dude')
+        statuses = [
+            StatusFactory.create(content='bug %d with @dude' % i) for i in range(5)
+        ]
+        self.make_stale()
+
+        stdout = StringIO()
+        call_command('rerender_statuses', jobs=jobs, chunk_size=2, stdout=stdout)
+        assert stdout.getvalue().splitlines()[-1].startswith('Done: 5 statuses')
+
+        for status in statuses:
+            status = Status.objects.get(pk=status.pk)
+            assert not status.html_is_stale()
+            assert status.html_mentions == 'dude'
+            assert status.content_html == (
+                '<p><a href="http://bugzilla.mozilla.org/show_bug.cgi?id=%s" rel="nofollow">'
+                'bug %s</a> with <a href="/user/dude/" rel="nofollow">@dude</a></p>'
+            ) % (status.content[4], status.content[4])
+
+    def test_since(self, db):
+        old = StatusFactory.create(created=datetime(2018, 1, 1, tzinfo=pytz.utc))
+        new = StatusFactory.create(created=datetime(2018, 2, 1, tzinfo=pytz.utc))
+        self.make_stale()
+
+        call_command('rerender_statuses', jobs=1, since='2018-01-15', stdout=StringIO())
+        assert Status.objects.get(pk=old.pk).html_version == 0
+        assert Status.objects.get(pk=new.pk).html_version == RENDERER_VERSION
+
+    def test_stale(self, db):
+        stale = StatusFactory.create(content='@dude abides')
+        fresh = StatusFactory.create(content='@dude abides')
+        Status.objects.filter(pk=stale.pk).update(html_version=0)
+        Status.objects.filter(pk=fresh.pk).update(content_html='')
+
+        call_command('rerender_statuses', jobs=1, stale=True, stdout=StringIO())
+        assert Status.objects.get(pk=stale.pk).content_html == '<p>@dude abides</p>'
+        assert Status.objects.get(pk=fresh.pk).content_html == ''
+
+    def test_mentions_indexed(self, db):
+        status = StatusFactory.create(content='@dude and @walter')
+        self.make_stale()
+        StatusMention.objects.all().delete()
+
+        StandupUserFactory.create(user__username='walter')
+
+        call_command('rerender_statuses', jobs=1, stdout=StringIO())
+        assert sorted(status.mentions.values_list('slug', 'user__slug', 'created')) == [
+            ('dude', None, status.created), ('walter', 'walter', status.created)
+        ]
+
+    def test_checkpoint(self, db, tmpdir):
+        statuses = StatusFactory.create_batch(4)
+        self.make_stale()
+        checkpoint = tmpdir.join('checkpoint')
+        checkpoint.write(str(statuses[1].pk))
+
+        stdout = StringIO()
+        call_command('rerender_statuses', jobs=1, checkpoint=str(checkpoint), stdout=stdout)
+        assert 'Resuming after status %d.' % statuses[1].pk in stdout.getvalue()
+        assert (
+            [Status.objects.get(pk=status.pk).html_version for status in statuses] ==
+            [0, 0, RENDERER_VERSION, RENDERER_VERSION]
+        )
+        # Finishing removes the checkpoint
+        assert not checkpoint.exists()
+
+    def test_changed_while_rendering(self, db, monkeypatch):
+        edited = StatusFactory.create(content='@dude abides')
+        deleted = StatusFactory.create(content='@dude abides')
+        untouched = StatusFactory.create(content='@dude abides')
+        self.make_stale()
+
+        render_status = rerender_statuses.render_status
+
+        def edit_and_render(item):
+            if item[0] == edited.pk:
+                # Simulates the status being edited without re-rendering it
+                Status.objects.filter(pk=edited.pk).update(content='@walter abides')
+            elif item[0] == deleted.pk:
+                Status.objects.filter(pk=deleted.pk).delete()
+            return render_status(item)
+
+        monkeypatch.setattr(rerender_statuses, 'render_status', edit_and_render)
+        call_command('rerender_statuses', jobs=1, stdout=StringIO())
+
+        # The edit isn't overwritten with HTML rendered from the old content
+        edited = Status.objects.get(pk=edited.pk)
+        assert edited.html_version == 0
+        assert edited.content_html == ''
+        assert not Status.objects.filter(pk=deleted.pk).exists()
+        assert not StatusMention.objects.filter(status_id=deleted.pk).exists()
+        assert Status.objects.get(pk=untouched.pk).html_version == RENDERER_VERSION
+
+
+def test_build_search_index(db, tmpdir):
+    statuses = StatusFactory.create_batch(3, content='frob')
+    stdout = StringIO()
+    call_command('build_search_index', '--path', str(tmpdir), stdout=stdout)
+    assert stdout.getvalue().startswith('Indexed 3 statuses')
+
+    from standup.status.index import SearchIndex
+    assert SearchIndex(str(tmpdir)).search('frob') == [status.pk for status in reversed(statuses)]
+
+
+def test_index_tags(db):
+    statuses = StatusFactory.create_batch(3, content='#frob and #nitz')
+    StatusFactory.create(content='no tags')
+    StatusTag.objects.all().delete()
+    Status.objects.filter(pk=statuses[0].pk).update(content='just #frob')
+
+    stdout = StringIO()
+    call_command('index_tags', '--chunk-size', '2', stdout=stdout)
+    assert stdout.getvalue().startswith('Indexed 5 tags in 4 statuses')
+    assert sorted(StatusTag.objects.values_list('status_id', 'name')) == [
+        (statuses[0].pk, 'frob'),
+        (statuses[1].pk, 'frob'), (statuses[1].pk, 'nitz'),
+        (statuses[2].pk, 'frob'), (statuses[2].pk, 'nitz'),
+    ]
+
+
+def test_index_references(db):
+    statuses = StatusFactory.create_batch(3, content='bug 12 and pr 34')
+    StatusFactory.create(content='no references', project=None)
+    StatusReference.objects.all().delete()
+    Status.objects.filter(pk=statuses[0].pk).update(content='just bug 12', project=None)
+
+    stdout = StringIO()
+    call_command('index_references', '--chunk-size', '2', stdout=stdout)
+    assert stdout.getvalue().startswith('Indexed 5 references in 4 statuses')
+    assert sorted(StatusReference.objects.values_list('status_id', 'kind', 'number', 'project_id')) == [
+        (statuses[0].pk, 'bug', 12, None),
+        (statuses[1].pk, 'bug', 12, None), (statuses[1].pk, 'pull', 34, statuses[1].project_id),
+        (statuses[2].pk, 'bug', 12, None), (statuses[2].pk, 'pull', 34, statuses[2].project_id),
+    ]
+
+
+@pytest.mark.parametrize('command', ['index_tags', 'index_references'])
+def test_index_locks_chunks(db, command):
+    if not connection.features.has_select_for_update:
+        pytest.skip('%s does not lock rows' % connection.vendor)
+    StatusFactory.create(content='#frob bug 12')
+    with CaptureQueriesContext(connection) as ctx:
+        call_command(command, stdout=StringIO())
+    # The statuses are read in the transaction that rewrites their rows, so
+    # a status saved meanwhile waits for the chunk
+    reads = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('SELECT')]
+    status_reads = [sql for sql in reads if 'FROM "status"' in sql]
+    assert status_reads and all(sql.endswith('FOR UPDATE') for sql in status_reads)
@@ -0,0 +1,53 @@
+from django.test import RequestFactory
+
+from standup.status.context_processors import status
+from standup.status.models import SiteMessage
+from standup.status.tests.factories import ProjectFactory, TeamFactory
+
+
+def get_context():
+    return status(RequestFactory().get('/'))
+
+
+def test_lazy(db, django_assert_num_queries):
+    with django_assert_num_queries(0):
+        get_context()
+
+
+def test_cached(db, django_assert_num_queries):
+    team = TeamFactory.create()
+    project = ProjectFactory.create()
+    message = SiteMessage.objects.create(message='The Dude abides')
+    SiteMessage.objects.create(message='Disabled', enabled=False)
+
+    with django_assert_num_queries(3):
+        ctx = get_context()
+        assert list(ctx['teams']) == [team]
+        assert list(ctx['projects']) == [project]
+        assert list(ctx['messages']) == [message]
+
+    with django_assert_num_queries(0):
+        ctx = get_context()
+        assert list(ctx['teams']) == [team]
+        assert list(ctx['projects']) == [project]
+        assert list(ctx['messages']) == [message]
+
+
+def test_invalidated(db):
+    team = TeamFactory.create(name='Achievers')
+    project = ProjectFactory.create()
+    message = SiteMessage.objects.create(message='The Dude abides')
+    assert list(get_context()['teams']) == [team]
+
+    team.name = 'Little Lebowski Urban Achievers'
+    team.save()
+    assert [t.name for t in get_context()['teams']] == ['Little Lebowski Urban Achievers']
+
+    other = ProjectFactory.create()
+    assert set(get_context()['projects']) == {project, other}
+    project.delete()
+    assert list(get_context()['projects']) == [other]
+
+    message.enabled = False
+    message.save()
+    assert list(get_context()['messages']) == []
@@ -0,0 +1,187 @@
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+import pytest
+
+from standup.status.index import (
+    SearchIndex,
+    decode_postings,
+    encode_postings,
+    get_search_index,
+    intersect,
+    to_terms,
+    union,
+)
+from standup.status.models import Status
+from standup.status.search import FACET_SAMPLE_SIZE, ID_CHUNK_SIZE
+from standup.status.tests.factories import ProjectFactory, StandupUserFactory, StatusFactory
+from standup.status.views import SearchView
+
+
+def test_postings_roundtrip():
+    ids = [3, 4, 10, 1000, 4000000000]
+    assert decode_postings(encode_postings(ids).tobytes()) == ids
+
+
+def test_intersect_and_union():
+    assert intersect([1, 3, 5, 7], [2, 3, 4, 7, 9]) == [3, 7]
+    assert intersect([7], list(range(100))) == [7]
+    assert intersect([], [1, 2]) == []
+    assert union([1, 3, 5], [2, 3, 6]) == [1, 2, 3, 5, 6]
+
+
+def test_to_terms():
+    assert to_terms('Fixed bug-1234!') == {'fixed', 'bug', '1234', 'fixed bug', 'bug 1234'}
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = SearchIndex(str(tmpdir))
+    index.build([
+        (1, 'Fixed the frob widget'),
+        (2, 'Reviewed the widget code'),
+        (3, 'Wrote frob docs'),
+        (4, 'Widget frob fixes'),
+    ])
+    return index
+
+
+class TestSearchIndex:
+    @pytest.mark.parametrize('text, expected', [
+        ('frob', [4, 3, 1]),
+        ('FROB', [4, 3, 1]),
+        ('frob widget', [4, 3, 2, 1]),
+        ('frob AND widget', [4, 1]),
+        ('"frob widget"', [1]),
+        ('"widget frob"', [4]),
+        ('docs OR code AND widget', [3, 2]),
+        ('frobs', []),
+        ('   ', []),
+    ])
+    def test_search(self, index, text, expected):
+        assert index.search(text) == expected
+
+    def test_journal(self, index, tmpdir):
+        index.search('frob')
+        index.journal(5, 'More frob')
+        index.journal(1, 'Fixed the widget')
+        index.journal(3)
+        assert index.search('frob') == [5, 4]
+
+        # Other processes see the changes too
+        assert SearchIndex(str(tmpdir)).search('frob') == [5, 4]
+
+    def test_rebuild_keeps_newer_journal_lines(self, index, tmpdir):
+        index.journal(1)
+        assert index.search('frob') == [4, 3]
+
+        def statuses():
+            yield (1, 'Fixed the frob widget')
+            # Journaled while the index is being built
+            index.journal(2)
+            yield (2, 'Reviewed the frob code')
+
+        index.build(statuses())
+        assert index.search('frob') == [1]
+        assert SearchIndex(str(tmpdir)).search('frob') == [1]
+
+    def test_merge(self, index, tmpdir):
+        index.journal(5, 'More frob')
+        index.journal(1, 'Fixed the widget')
+        index.journal(3)
+        assert index.merge()
+        assert index.journal_size() == 0
+        assert index.search('frob') == [5, 4]
+        assert index.search('"fixed the"') == [1]
+        assert SearchIndex(str(tmpdir)).search('frob') == [5, 4]
+
+    def test_journal_limit(self, index, tmpdir):
+        index = SearchIndex(str(tmpdir), journal_limit=50)
+        index.journal(5, 'More frob')
+        assert index.journal_size() > 0
+        index.journal(1, 'Fixed the widget')
+        index._merge_thread.join()
+        assert index.journal_size() == 0
+        assert index.search('frob') == [5, 4, 3]
+
+    def test_merge_without_index(self, tmpdir):
+        index = SearchIndex(str(tmpdir))
+        index.journal(1, 'frob')
+        assert not index.merge()
+        assert not index.exists()
+
+    def test_unicode_terms(self, tmpdir):
+        index = SearchIndex(str(tmpdir))
+        index.build([(1, 'Café ☃ naïve'), (2, 'cafe'), (3, 'zebra')])
+        assert index.search('café') == [1]
+        assert index.search('"café naïve"') == [1]
+        assert index.search('naïve') == [1]
+        assert index.search('cafe') == [2]
+        assert index.search('zebra') == [3]
+
+
+def test_search_view(transactional_db, tmpdir):
+    with override_settings(SEARCH_BACKEND='index', SEARCH_INDEX_DIR=str(tmpdir)):
+        old = StatusFactory.create(content='frob the widget')
+        StatusFactory.create(content='lunch')
+        get_search_index().build([(old.pk, old.content)])
+
+        # Saved and deleted statuses are journaled
+        statuses = StatusFactory.create_batch(3, content='more frobbing, frob')
+        statuses[1].delete()
+
+        view = SearchView()
+        view.request = RequestFactory().get('/', {'query': 'frob', 'page': '1'})
+        page = view.paginate_statuses(per_page=2)
+        assert list(page) == [statuses[2], statuses[0]]
+        assert page.paginator.count == 3
+
+        view.request = RequestFactory().get('/', {'query': 'frob', 'page': '2'})
+        assert list(view.paginate_statuses(per_page=2)) == [old]
+
+        # Facets narrow the index's matches
+        view.request = RequestFactory().get('/', {'query': 'frob', 'user': old.user.slug})
+        ctx = view.get_context_data()
+        assert list(ctx['statuses']) == [old]
+        assert ctx['facets']['user'] == [(old.user, 1)]
+
+
+def test_search_view_many_matches(transactional_db, tmpdir):
+    user = StandupUserFactory.create()
+    project = ProjectFactory.create()
+    # More matches than SQLite allows parameters in one query
+    Status.objects.bulk_create(
+        Status(user=user, project=project if i % 2 else None, content='frob %d' % i) for i in range(1200)
+    )
+    with override_settings(SEARCH_BACKEND='index', SEARCH_INDEX_DIR=str(tmpdir)):
+        get_search_index().build(Status.objects.order_by('pk').values_list('pk', 'content'))
+
+        view = SearchView()
+        view.request = RequestFactory().get('/', {'query': 'frob', 'project': project.slug})
+        with CaptureQueriesContext(connection) as queries:
+            ctx = view.get_context_data()
+        # Newer SQLites allow more, but no query should need more than 999
+        assert max(query['sql'].count(',') for query in queries.captured_queries) < 999
+        assert ctx['statuses'].paginator.count == 600
+        assert ctx['facets']['project'] == [(project, 600)]
+        assert ctx['facets']['user'] == [(user, 600)]
+        assert not ctx['facets_sampled']
+
+
+def test_search_view_broad(transactional_db, tmpdir):
+    user = StandupUserFactory.create()
+    Status.objects.bulk_create(Status(user=user, content='frob %d' % i) for i in range(3000))
+    with override_settings(SEARCH_BACKEND='index', SEARCH_INDEX_DIR=str(tmpdir)):
+        get_search_index().build(Status.objects.order_by('pk').values_list('pk', 'content'))
+
+        view = SearchView()
+        view.request = RequestFactory().get('/', {'query': 'frob'})
+        with CaptureQueriesContext(connection) as queries:
+            ctx = view.get_context_data()
+        # With no facets picked, only the first FACET_SAMPLE_SIZE matches are
+        # read to count facets rather than all of them
+        status_queries = [q['sql'] for q in queries.captured_queries if 'FROM "status"' in q['sql']]
+        assert len(status_queries) == FACET_SAMPLE_SIZE // ID_CHUNK_SIZE + 1
+        assert ctx['statuses'].paginator.count == 3000
+        assert ctx['facets']['user'] == [(user, FACET_SAMPLE_SIZE)]
+        assert ctx['facets_sampled']
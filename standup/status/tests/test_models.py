@@ -1,6 +1,17 @@
+from unittest.mock import patch
+
 import pytest
 
-from standup.status.tests.factories import StatusFactory, StandupUserFactory
+from standup.status.models import (
+    RENDERER_VERSION,
+    Status,
+    StatusMention,
+    StatusReference,
+    StatusTag,
+    TeamStatus,
+    render_statuses,
+)
+from standup.status.tests.factories import ProjectFactory, StatusFactory, StandupUserFactory, TeamFactory
 
 
 @pytest.mark.django_db()
@@ -62,3 +73,349 @@ def test_status_htmlify():
     original = 'phone\'s ringing @bunny'
     expected = '<p>phone\'s ringing @bunny</p>'
     assert StatusFactory(content=original).htmlify() == expected
+
+
+class TestStoredHtml:
+    def test_rendered_on_save(self, db):
+        status = StatusFactory(content='bug 1234 for @dude')
+        status = Status.objects.get(pk=status.pk)
+        assert status.html_version == RENDERER_VERSION
+        assert status.html_repo_url == status.project.repo_url
+        assert status.html_mentions == 'dude'
+        assert 'show_bug.cgi?id=1234' in status.content_html
+
+    def test_stale_version_rerendered_on_read(self, db):
+        status = StatusFactory(content='**abc**')
+        Status.objects.filter(pk=status.pk).update(content_html='', html_version=0)
+
+        status = Status.objects.get(pk=status.pk)
+        assert status.htmlify() == '<p><strong>abc</strong></p>'
+
+        # The re-rendered html was written back
+        status = Status.objects.get(pk=status.pk)
+        assert status.html_version == RENDERER_VERSION
+        assert status.content_html == '<p><strong>abc</strong></p>'
+
+    def test_repo_url_change_rerendered_on_read(self, db):
+        status = StatusFactory(content='pr 12')
+        project = status.project
+        project.repo_url = 'https://github.com/walter/bowling/'
+        project.save()
+
+        status = Status.objects.get(pk=status.pk)
+        assert status.html_is_stale()
+        assert status.htmlify() == (
+            '<p><a href="https://github.com/walter/bowling/pull/12" rel="nofollow">pr 12</a></p>'
+        )
+        assert not Status.objects.get(pk=status.pk).html_is_stale()
+
+
+def test_render_statuses_resolves_mentions_in_one_query(db, django_assert_num_queries):
+    StandupUserFactory(user__username='dude')
+    StandupUserFactory(user__username='walter')
+    StatusFactory(content='@dude abides')
+    StatusFactory(content='@walter and @dude bowl')
+    StatusFactory(content='@donny is out of his element')
+    Status.objects.update(content_html='', html_version=0)
+
+    statuses = list(Status.objects.select_related('project').order_by('id'))
+    # One query to resolve mentions plus one update per re-rendered status
+    with django_assert_num_queries(4):
+        render_statuses(statuses)
+
+    assert [str(status.htmlify()) for status in statuses] == [
+        '<p><a href="/user/dude/" rel="nofollow">@dude</a> abides</p>',
+        '<p><a href="/user/walter/" rel="nofollow">@walter</a> and '
+        '<a href="/user/dude/" rel="nofollow">@dude</a> bowl</p>',
+        '<p>@donny is out of his element</p>',
+    ]
+
+    # Nothing is stale now, so there's nothing to do
+    with django_assert_num_queries(0):
+        render_statuses(statuses)
+
+
+class TestMentionDependencies:
+    def mentions(self, status):
+        return sorted(status.mentions.values_list('slug', flat=True))
+
+    def test_mentions_indexed_on_save(self, db):
+        status = StatusFactory(content='@dude and @walter')
+        assert self.mentions(status) == ['dude', 'walter']
+
+        status.content = '@walter and @donny'
+        status.save()
+        assert self.mentions(status) == ['donny', 'walter']
+
+        status.delete()
+        assert StatusMention.objects.count() == 0
+
+    def test_new_user_rerenders_mentioning_statuses(self, db):
+        status = StatusFactory(content='@dude abides')
+        other = StatusFactory(content='@walter bowls')
+        assert status.htmlify() == '<p>@dude abides</p>'
+
+        StandupUserFactory(user__username='dude')
+        assert Status.objects.get(pk=status.pk).html_version == 0
+        assert Status.objects.get(pk=other.pk).html_version == RENDERER_VERSION
+        assert Status.objects.get(pk=status.pk).htmlify() == (
+            '<p><a href="/user/dude/" rel="nofollow">@dude</a> abides</p>'
+        )
+
+    def test_slug_change_rerenders_mentioning_statuses(self, db):
+        user = StandupUserFactory(user__username='dude')
+        old = StatusFactory(content='@dude abides')
+        new = StatusFactory(content='@lebowski abides')
+        other = StatusFactory(content='@walter bowls')
+
+        user.slug = 'lebowski'
+        user.save()
+        assert Status.objects.get(pk=old.pk).html_version == 0
+        assert Status.objects.get(pk=new.pk).html_version == 0
+        assert Status.objects.get(pk=other.pk).html_version == RENDERER_VERSION
+
+        assert Status.objects.get(pk=old.pk).htmlify() == '<p>@dude abides</p>'
+        assert Status.objects.get(pk=new.pk).htmlify() == (
+            '<p><a href="/user/lebowski/" rel="nofollow">@lebowski</a> abides</p>'
+        )
+
+    def test_saving_user_without_slug_change_does_nothing(self, db):
+        user = StandupUserFactory(user__username='dude')
+        status = StatusFactory(content='@dude abides')
+
+        user.name = 'The Dude'
+        user.save()
+        assert Status.objects.get(pk=status.pk).html_version == RENDERER_VERSION
+
+    def test_deleted_user_rerenders_mentioning_statuses(self, db):
+        user = StandupUserFactory(user__username='dude')
+        status = StatusFactory(content='@dude abides')
+
+        user.delete()
+        assert Status.objects.get(pk=status.pk).htmlify() == '<p>@dude abides</p>'
+
+    def test_repo_url_change_marks_project_statuses(self, db):
+        status = StatusFactory(content='pr 12')
+        other = StatusFactory(content='pr 12')
+        project = status.project
+        project.repo_url = 'https://github.com/walter/bowling/'
+        project.save()
+        assert Status.objects.get(pk=status.pk).html_version == 0
+        assert Status.objects.get(pk=other.pk).html_version == RENDERER_VERSION
+
+        project.name = 'Bowling'
+        project.save()
+        assert Status.objects.get(pk=other.pk).html_version == RENDERER_VERSION
+
+
+class TestMentionIndex:
+    def mentions(self, status):
+        return sorted(status.mentions.values_list('slug', 'user__slug', 'created'))
+
+    def test_synced_on_save(self, db):
+        StandupUserFactory(user__username='dude')
+        status = StatusFactory(content='@dude and @walter')
+        assert self.mentions(status) == [('dude', 'dude', status.created), ('walter', None, status.created)]
+
+        status.content = '@dude and @donny'
+        status.created = status.created.replace(year=status.created.year - 1)
+        status.save()
+        assert self.mentions(status) == [('donny', None, status.created), ('dude', 'dude', status.created)]
+
+    def test_follows_slugs(self, db):
+        user = StandupUserFactory(user__username='dude')
+        old = StatusFactory(content='@dude abides')
+        new = StatusFactory(content='@lebowski abides')
+
+        user.slug = 'lebowski'
+        user.save()
+        assert self.mentions(old) == [('dude', None, old.created)]
+        assert self.mentions(new) == [('lebowski', 'lebowski', new.created)]
+
+        user.delete()
+        assert self.mentions(new) == [('lebowski', None, new.created)]
+
+    def test_mentioned_statuses(self, db):
+        dude = StandupUserFactory(user__username='dude')
+        old = StatusFactory(content='@dude abides')
+        new = StatusFactory(content='@Walter and @dude', created=old.created.replace(year=old.created.year + 1))
+        StatusFactory(content='@walter bowls')
+        assert list(dude.mentioned_statuses()) == [new, old]
+
+    def test_render_uses_index(self, db, django_assert_num_queries):
+        StandupUserFactory(user__username='dude')
+        StandupUserFactory(user__username='walter')
+        StatusFactory(content='@dude abides')
+        StatusFactory(content='@walter and @dude bowl')
+        Status.objects.update(html_version=0)
+
+        statuses = list(Status.objects.select_related('project').order_by('id'))
+        # Nothing is scanned for mentions: one query for the indexed mentions
+        # plus one update per re-rendered status
+        with patch('standup.status.models.find_mentions', side_effect=AssertionError):
+            with django_assert_num_queries(3):
+                render_statuses(statuses)
+        assert str(statuses[1].htmlify()) == (
+            '<p><a href="/user/walter/" rel="nofollow">@walter</a> and '
+            '<a href="/user/dude/" rel="nofollow">@dude</a> bowl</p>'
+        )
+
+        # A single status gets all its mentions in one query too
+        Status.objects.update(html_version=0)
+        status = Status.objects.select_related('project').get(pk=statuses[1].pk)
+        with django_assert_num_queries(2):
+            status.htmlify()
+
+
+class TestStatusTags:
+    def tags(self, status):
+        return set(status.tags.values_list('name', flat=True))
+
+    def test_synced_on_save(self, db):
+        status = StatusFactory(content='Shipped #Release and #l10n')
+        assert self.tags(status) == {'release', 'l10n'}
+        assert set(status.tags.values_list('created', flat=True)) == {status.created}
+
+        status.content = 'Shipped #release and #docs'
+        status.created = status.created.replace(year=status.created.year - 1)
+        status.save()
+        assert self.tags(status) == {'release', 'docs'}
+        assert set(status.tags.values_list('created', flat=True)) == {status.created}
+
+        status.delete()
+        assert StatusTag.objects.count() == 0
+
+    def test_long_tags_are_skipped(self, db):
+        status = StatusFactory(content='#%s #ok' % ('x' * 101))
+        assert self.tags(status) == {'ok'}
+
+    def test_trending(self, db):
+        old = StatusFactory(content='#old #release')
+        old.created = old.created.replace(year=2000)
+        old.save()
+        StatusFactory(content='#release #docs')
+        StatusFactory(content='#release')
+        StatusFactory(content='#zebra')
+
+        since = old.created.replace(year=2001)
+        assert StatusTag.trending(since) == [('release', 2), ('docs', 1), ('zebra', 1)]
+        assert StatusTag.trending(since, limit=1) == [('release', 2)]
+
+
+class TestStatusReferences:
+    def references(self, status):
+        return sorted(status.references.values_list('kind', 'number', 'project_id', 'created'))
+
+    def test_synced_on_save(self, db):
+        status = StatusFactory(content='Fixed bug 1234567 in pr 12, see issue 3')
+        project_id = status.project_id
+        assert self.references(status) == [
+            ('bug', 1234567, None, status.created),
+            ('issue', 3, project_id, status.created),
+            ('pull', 12, project_id, status.created),
+        ]
+
+        status.content = 'Fixed bug 1234567 in pr 13'
+        status.created = status.created.replace(year=status.created.year - 1)
+        status.save()
+        assert self.references(status) == [
+            ('bug', 1234567, None, status.created),
+            ('pull', 13, project_id, status.created),
+        ]
+
+        # Pull requests and issues need a project
+        status.project = None
+        status.save()
+        assert self.references(status) == [('bug', 1234567, None, status.created)]
+
+        status.delete()
+        assert StatusReference.objects.count() == 0
+
+    def test_project_deleted(self, db):
+        status = StatusFactory(content='Fixed bug 5 in pr 7')
+        status.project.delete()
+        assert self.references(status) == [('bug', 5, None, status.created)]
+
+    def test_huge_numbers_are_skipped(self, db):
+        status = StatusFactory(content='bug 99999999999 and bug 1')
+        assert [row[:2] for row in self.references(status)] == [('bug', 1)]
+
+    def test_statuses(self, db):
+        project, other = ProjectFactory.create_batch(2)
+        old = StatusFactory(content='bug 5 and pr 7', project=project)
+        new = StatusFactory(
+            content='Bug #5, PR #7', project=other, created=old.created.replace(year=old.created.year + 1)
+        )
+        StatusFactory(content='bug 55 and pr 8', project=project)
+
+        assert list(StatusReference(kind='bug', number=5).statuses()) == [new, old]
+        assert list(StatusReference(kind='pull', number=7, project=project).statuses()) == [old]
+        assert list(StatusReference(kind='pull', number=7, project=other).get_entries().values_list(
+            'status_id', flat=True
+        )) == [new.pk]
+
+    def test_get_url(self, db):
+        project = ProjectFactory(repo_url='https://github.com/dude/rug/')
+        assert StatusReference(kind='bug', number=5).get_url() == (
+            'http://bugzilla.mozilla.org/show_bug.cgi?id=5'
+        )
+        assert StatusReference(kind='pull', number=7, project=project).get_url() == (
+            'https://github.com/dude/rug/pull/7'
+        )
+        assert StatusReference(kind='issue', number=7, project=project).get_url() == (
+            'https://github.com/dude/rug/issues/7'
+        )
+        assert StatusReference(kind='issue', number=7, project=ProjectFactory(repo_url='')).get_url() == ''
+
+
+class TestTeamTimeline:
+    def timeline(self, team):
+        return list(team.statuses())
+
+    def test_statuses_added_and_removed(self, db):
+        team = TeamFactory()
+        member, other = StandupUserFactory.create_batch(2)
+        team.users.add(member)
+
+        old = StatusFactory(user=member)
+        new = StatusFactory(user=member, created=old.created.replace(year=old.created.year + 1))
+        StatusFactory(user=other)
+        assert self.timeline(team) == [new, old]
+
+        new.delete()
+        assert self.timeline(team) == [old]
+
+    def test_join_and_leave(self, db):
+        team = TeamFactory()
+        user = StandupUserFactory()
+        statuses = StatusFactory.create_batch(3, user=user)
+        newest_first = sorted(statuses, key=lambda status: status.created, reverse=True)
+        assert self.timeline(team) == []
+
+        team.users.add(user)
+        assert self.timeline(team) == newest_first
+        team.users.remove(user)
+        assert self.timeline(team) == []
+
+        user.teams.add(team)
+        assert self.timeline(team) == newest_first
+        user.teams.clear()
+        assert self.timeline(team) == []
+
+        team.users.add(user)
+        team.users.clear()
+        assert TeamStatus.objects.count() == 0
+
+    def test_status_moved_to_other_user(self, db):
+        team = TeamFactory()
+        member, other = StandupUserFactory.create_batch(2)
+        team.users.add(member)
+        status = StatusFactory(user=other)
+
+        status.user = member
+        status.save()
+        assert self.timeline(team) == [status]
+
+        status.user = other
+        status.save()
+        assert self.timeline(team) == []
@@ -0,0 +1,198 @@
+from datetime import datetime
+
+from django.core.paginator import Page
+from django.db import connection
+from django.test import RequestFactory, override_settings
+import pytest
+import pytz
+
+from standup.status.models import Status
+from standup.status.pagination import (
+    CursorPage,
+    CursorPaginator,
+    InvalidCursor,
+    count_statuses,
+    decode_cursor,
+    encode_cursor,
+    is_whole_table,
+)
+from standup.status.tests.factories import StandupUserFactory, StatusFactory, TeamFactory
+from standup.status.views import HomeView, TeamView
+
+
+def make_statuses():
+    # Pairs of statuses share a created so paging has to break ties on id
+    statuses = []
+    for day in range(1, 6):
+        created = datetime(2018, 1, day, 12, 0, 0, 123456, tzinfo=pytz.utc)
+        statuses.extend(StatusFactory.create_batch(2, created=created))
+    return sorted(statuses, key=lambda status: (status.created, status.pk), reverse=True)
+
+
+def test_cursor_roundtrip(db):
+    status = StatusFactory.create(created=datetime(2018, 1, 2, 3, 4, 5, 678, tzinfo=pytz.utc))
+    assert decode_cursor(encode_cursor(status)) == (status.created, status.pk)
+
+
+@pytest.mark.parametrize('cursor', ['', 'abc', '!!!', 'MTIzNA', 'YS5i', 'é'])
+def test_bad_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+class TestCursorPaginator:
+    def test_older(self, db):
+        statuses = make_statuses()
+        paginator = CursorPaginator(Status.objects.all(), 3)
+
+        seen = []
+        page = paginator.page()
+        assert not page.has_previous()
+        while True:
+            seen.extend(page)
+            if not page.has_next():
+                break
+            page = paginator.page(before=page.next_cursor)
+            assert page.has_previous()
+
+        assert seen == statuses
+
+    def test_newer(self, db):
+        statuses = make_statuses()
+        paginator = CursorPaginator(Status.objects.all(), 3)
+
+        page = paginator.page(before=encode_cursor(statuses[-4]))
+        seen = list(page)
+        assert seen == statuses[-3:]
+        while page.has_previous():
+            page = paginator.page(after=page.previous_cursor)
+            assert page.has_next()
+            seen = list(page) + seen
+
+        assert seen == statuses
+
+    def test_newer_than_first_page(self, db):
+        statuses = make_statuses()
+        paginator = CursorPaginator(Status.objects.all(), 3)
+
+        page = paginator.page(after=encode_cursor(statuses[3]))
+        assert list(page) == statuses[:3]
+        assert not page.has_previous()
+        assert page.has_next()
+
+    def test_empty(self, db):
+        page = CursorPaginator(Status.objects.all(), 3).page()
+        assert not page
+        assert not page.has_next()
+        assert not page.has_previous()
+
+    def test_one_query_per_page(self, db, django_assert_num_queries):
+        statuses = make_statuses()
+        paginator = CursorPaginator(Status.objects.all(), 3)
+        with django_assert_num_queries(1):
+            paginator.page(before=encode_cursor(statuses[5]))
+        with django_assert_num_queries(1):
+            paginator.page(after=encode_cursor(statuses[5]))
+
+
+class TestPaginateStatusesMixin:
+    def paginate(self, **params):
+        view = HomeView()
+        view.request = RequestFactory().get('/', params)
+        return view.paginate_statuses(per_page=3)
+
+    def test_cursor(self, db):
+        statuses = make_statuses()
+        page = self.paginate()
+        assert isinstance(page, CursorPage)
+        assert list(page) == statuses[:3]
+
+        page = self.paginate(before=page.next_cursor)
+        assert list(page) == statuses[3:6]
+
+        page = self.paginate(after=page.previous_cursor)
+        assert list(page) == statuses[:3]
+
+    def test_team(self, db):
+        statuses = make_statuses()
+        team = TeamFactory.create()
+        team.users.add(*{status.user for status in statuses[1:]})
+
+        view = TeamView()
+        view.object = team
+        view.request = RequestFactory().get('/')
+        page = view.paginate_statuses(per_page=3)
+        assert list(page) == statuses[1:4]
+
+        view.request = RequestFactory().get('/', {'before': page.next_cursor})
+        page = view.paginate_statuses(per_page=3)
+        assert list(page) == statuses[4:7]
+
+    def test_bad_cursor_is_first_page(self, db):
+        statuses = make_statuses()
+        assert list(self.paginate(before='garbage')) == statuses[:3]
+
+    def test_page_numbers_still_work(self, db):
+        statuses = make_statuses()
+        page = self.paginate(page='2')
+        assert isinstance(page, Page)
+        assert page.number == 2
+        assert len(page) == 3
+        assert set(page) <= set(statuses)
+
+
+class TestCountStatuses:
+    def test_small_counts_are_exact(self, db):
+        StatusFactory.create_batch(3)
+        assert count_statuses(Status.objects.all()) == 3
+
+    @override_settings(STATUS_COUNT_EXACT_LIMIT=2)
+    def test_big_counts_are_cached(self, db, django_assert_num_queries):
+        statuses = StatusFactory.create_batch(3)
+        # One query for the capped count, one for the full count and on
+        # Postgres one for the (missing, since it's not analyzed) estimate
+        with django_assert_num_queries(3 if connection.vendor == 'postgresql' else 2):
+            assert count_statuses(Status.objects.all()) == 3
+        with django_assert_num_queries(0):
+            assert count_statuses(Status.objects.all()) == 3
+
+        # Counts are cached per query
+        user = statuses[0].user
+        assert count_statuses(Status.objects.filter(user=user)) == 1
+
+        # Writing statuses invalidates counts
+        StatusFactory.create()
+        assert count_statuses(Status.objects.all()) == 4
+        statuses[1].delete()
+        assert count_statuses(Status.objects.all()) == 3
+
+    def test_is_whole_table(self):
+        statuses = Status.objects.select_related('user').order_by('created')
+        assert is_whole_table(statuses)
+        assert not is_whole_table(statuses.filter(project=None))
+        assert not is_whole_table(statuses.distinct())
+        assert not is_whole_table(statuses.extra(tables=['project']))
+        assert not is_whole_table(statuses[:10])
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='only Postgres estimates')
+    @override_settings(STATUS_COUNT_EXACT_LIMIT=2)
+    def test_only_whole_table_is_estimated(self, db):
+        user = StandupUserFactory.create()
+        StatusFactory.create_batch(3, user=user)
+        StatusFactory.create_batch(7)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE status')
+            # Make the table estimate stand out from the real count
+            cursor.execute("UPDATE pg_class SET reltuples = 1000 WHERE oid = 'status'::regclass")
+        assert count_statuses(Status.objects.all()) == 1000
+        assert count_statuses(Status.objects.filter(user=user)) == 3
+
+    @override_settings(STATUS_COUNT_EXACT_LIMIT=0)
+    def test_team_changes_invalidate(self, db):
+        team = TeamFactory.create()
+        user = StandupUserFactory.create()
+        StatusFactory.create(user=user)
+        assert count_statuses(team.statuses()) == 0
+
+        team.users.add(user)
+        assert count_statuses(team.statuses()) == 1
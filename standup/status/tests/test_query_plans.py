@@ -0,0 +1,205 @@
+"""Checks the query plans for status listings
+
+This runs the queries behind each status listing against a seeded database and
+fails if the database would scan the whole status table or sort statuses
+rather than walk an index. Walking an index from one end is fine for queries
+with a LIMIT since they stop early, but not for ones without.
+
+Adding a listing or changing how one queries should come with a case here.
+
+"""
+from datetime import datetime, timedelta
+import json
+
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+import pytest
+import pytz
+
+from standup.status.feeds import (
+    MainFeed,
+    ProjectFeed,
+    TagFeed,
+    TeamFeed,
+    UserFeed,
+    UserMentionsFeed,
+    get_validators,
+)
+from standup.status.models import Status
+from standup.status.pagination import encode_cursor
+from standup.status.tests.factories import (
+    ProjectFactory,
+    StandupUserFactory,
+    StatusFactory,
+    TeamFactory,
+)
+from standup.status.views import (
+    HomeView,
+    ProjectView,
+    ReferenceView,
+    TagView,
+    TeamView,
+    UserMentionsView,
+    UserView,
+    WeeklyView,
+)
+
+
+@pytest.fixture(scope='module')
+def seeded(django_db_setup, django_db_blocker):
+    """Seeds the database once for all the cases in this module
+
+    The rows are created in a transaction that's rolled back when the module
+    is done. Each case runs in a savepoint inside it.
+
+    """
+    with django_db_blocker.unblock(), transaction.atomic():
+        users = StandupUserFactory.create_batch(10)
+        projects = ProjectFactory.create_batch(3)
+        team = TeamFactory.create()
+        team.users.add(*users[:4])
+
+        start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        for i in range(500):
+            StatusFactory.create(
+                user=users[i % len(users)],
+                project=projects[i % len(projects)] if i % 4 else None,
+                created=start + timedelta(hours=i * 7),
+                **({'content': 'Shipped #release for @%s, bug 123 and pr 4' % users[1].slug} if i % 5 == 0 else {})
+            )
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        yield {'user': users[0], 'mentioned': users[1], 'project': projects[0], 'team': team}
+        transaction.set_rollback(True)
+
+
+def sqlite_problems(sql):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        details = [row[-1] for row in cursor.fetchall()]
+
+    problems = []
+    for detail in details:
+        words = detail.split()
+        if words[:2] == ['SCAN', 'status'] and ('INDEX' not in words or ' LIMIT ' not in sql):
+            problems.append(detail)
+        elif 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def postgresql_problems(sql):
+    def walk(node, limited=False):
+        node_type = node['Node Type']
+        if node.get('Relation Name') == 'status':
+            if node_type == 'Seq Scan':
+                yield 'Seq Scan on status'
+            elif 'Index Cond' not in node and not limited:
+                yield '%s on status without a limit' % node_type
+        elif node_type in ('Sort', 'Incremental Sort'):
+            yield '%s on %s' % (node_type, ', '.join(node.get('Sort Key', [])))
+        limited = limited or node_type == 'Limit'
+        for child in node.get('Plans', []):
+            yield from walk(child, limited)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The seeded tables are small enough that a scan and sort would be
+        # cheaper than using an index, so make the planner use one if it can.
+        cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('SET LOCAL enable_sort = off')
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+    return list(walk(plan[0]['Plan']))
+
+
+def plan_problems(func):
+    """Runs func and returns problems with the plans of its status queries"""
+    if connection.vendor == 'sqlite':
+        get_problems = sqlite_problems
+    elif connection.vendor == 'postgresql':
+        get_problems = postgresql_problems
+    else:
+        pytest.skip('no query plan checks for %s' % connection.vendor)
+
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+
+    problems = {}
+    for query in ctx.captured_queries:
+        sql = query['sql']
+        if sql.startswith('SELECT') and '"status"' in sql:
+            query_problems = get_problems(sql)
+            if query_problems:
+                problems[sql] = query_problems
+    assert ctx.captured_queries
+    return problems
+
+
+def paginate(view_class, obj=None, kwargs=None, **params):
+    view = view_class()
+    view.request = RequestFactory().get('/', params)
+    view.kwargs = kwargs or {}
+    if obj is not None:
+        view.object = obj
+    elif hasattr(view, 'get_object'):
+        view.object = view.get_object()
+    return lambda: view.paginate_statuses()
+
+
+def weekly(**params):
+    view = WeeklyView()
+    view.request = RequestFactory().get('/', params)
+    return lambda: view.get_context_data()
+
+
+def feed_validators(feed, obj):
+    return get_validators(feed.statuses(obj), feed.scope(obj))
+
+
+def cursor_for(index):
+    return encode_cursor(Status.objects.all()[index])
+
+
+@pytest.mark.parametrize('name, get_func', [
+    ('home', lambda objs: paginate(HomeView)),
+    ('home older', lambda objs: paginate(HomeView, before=cursor_for(200))),
+    ('home newer', lambda objs: paginate(HomeView, after=cursor_for(200))),
+    ('home day', lambda objs: paginate(HomeView, day='2018-02-01')),
+    ('home page number', lambda objs: paginate(HomeView, page='5')),
+    ('weekly', lambda objs: weekly()),
+    ('weekly week', lambda objs: weekly(week='2018-02-05')),
+    ('user', lambda objs: paginate(UserView, objs['user'])),
+    ('user older', lambda objs: paginate(UserView, objs['user'], before=cursor_for(200))),
+    ('project', lambda objs: paginate(ProjectView, objs['project'])),
+    ('project older', lambda objs: paginate(ProjectView, objs['project'], before=cursor_for(200))),
+    ('team', lambda objs: paginate(TeamView, objs['team'])),
+    ('tag', lambda objs: paginate(TagView, kwargs={'name': 'release'})),
+    ('tag older', lambda objs: paginate(TagView, kwargs={'name': 'release'}, before=cursor_for(200))),
+    ('mentions', lambda objs: paginate(UserMentionsView, objs['mentioned'])),
+    ('mentions older', lambda objs: paginate(UserMentionsView, objs['mentioned'], before=cursor_for(200))),
+    ('bug', lambda objs: paginate(ReferenceView, kwargs={'kind': 'bug', 'number': '123'})),
+    ('bug older', lambda objs: paginate(
+        ReferenceView, kwargs={'kind': 'bug', 'number': '123'}, before=cursor_for(200)
+    )),
+    ('pull', lambda objs: paginate(
+        ReferenceView, kwargs={'kind': 'pull', 'number': '4', 'slug': objs['project'].slug}
+    )),
+    ('main feed', lambda objs: lambda: MainFeed().items(None)),
+    ('user feed', lambda objs: lambda: UserFeed().items(objs['user'])),
+    ('project feed', lambda objs: lambda: ProjectFeed().items(objs['project'])),
+    ('team feed', lambda objs: lambda: TeamFeed().items(objs['team'])),
+    ('main feed validators', lambda objs: lambda: feed_validators(MainFeed(), None)),
+    ('user feed validators', lambda objs: lambda: feed_validators(UserFeed(), objs['user'])),
+    ('team feed validators', lambda objs: lambda: feed_validators(TeamFeed(), objs['team'])),
+    ('mentions feed', lambda objs: lambda: UserMentionsFeed().items(objs['mentioned'])),
+    ('mentions feed validators',
+     lambda objs: lambda: feed_validators(UserMentionsFeed(), objs['mentioned'])),
+    ('tag feed', lambda objs: lambda: TagFeed().items('release')),
+    ('tag feed validators', lambda objs: lambda: feed_validators(TagFeed(), 'release')),
+])
+def test_status_listing_plans(db, seeded, name, get_func):
+    assert plan_problems(get_func(seeded)) == {}
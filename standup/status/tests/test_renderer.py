@@ -0,0 +1,331 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import override_settings
+
+import pytest
+
+from standup.status.renderer import (
+    LOCAL_RENDER_CACHE,
+    RENDER_CACHE_STATS,
+    cached_render,
+    find_references,
+    find_tags,
+    is_plain_text,
+    render,
+    render_full,
+)
+
+
+REPO_URL = 'https://github.com/dude/whatnot/'
+USERS = ('dude', 'walter', 'pr')
+
+
+def mention_url(slug):
+    if slug in USERS:
+        return '/user/%s/' % slug
+    return None
+
+
+# Golden corpus: the expected output is what the chained regex/str.replace
+# renderer generated for these.
+GOLDEN = [
+    (
+        '#t', '',
+        '<p><span class="tag tag-t">#t</span></p>'
+    ),
+    (
+        '#tag', '',
+        '<p><span class="tag tag-tag">#tag</span></p>'
+    ),
+    (
+        '#TAG', '',
+        '<p><span class="tag tag-tag">#TAG</span></p>'
+    ),
+    (
+        '#tag123', '',
+        '<p><span class="tag tag-tag123">#tag123</span></p>'
+    ),
+    (
+        'tag #1', '',
+        '<p>tag #1</p>'
+    ),
+    (
+        'tag #.abc', '',
+        '<p>tag #.abc</p>'
+    ),
+    (
+        'tag #?abc', '',
+        '<p>tag #?abc</p>'
+    ),
+    (
+        '[The Dude](https://example.com/dude)', '',
+        '<p><a href="https://example.com/dude" rel="nofollow">The Dude</a></p>'
+    ),
+    (
+        'My site is https://example.com/the-dude-abides-man', '',
+        (
+            '<p>My site is <a href="https://example.com/the-dude-abides-man" rel="nofollow">'
+            'https://example.com/the-dude-a...</a></p>'
+        )
+    ),
+    (
+        '[#1234](https://example.com/dude)', '',
+        '<p><a href="https://example.com/dude" rel="nofollow">#1234</a></p>'
+    ),
+    (
+        'Bug 1234, bug #5678', '',
+        (
+            '<p><a href="http://bugzilla.mozilla.org/show_bug.cgi?id=1234" rel="nofollow">Bug 1234</a>'
+            ', <a href="http://bugzilla.mozilla.org/show_bug.cgi?id=5678" rel="nofollow">bug #5678</a>'
+            '</p>'
+        )
+    ),
+    (
+        'pr 1234, issue #5678', REPO_URL,
+        (
+            '<p><a href="https://github.com/dude/whatnot/pull/1234" rel="nofollow">pr 1234</a>'
+            ', <a href="https://github.com/dude/whatnot/issues/5678" rel="nofollow">issue #5678</a></p>'
+        )
+    ),
+    (
+        'pr 1234, issue #5678', '',
+        '<p>pr 1234, issue #5678</p>'
+    ),
+    (
+        'pull #12 and PR 13', REPO_URL,
+        (
+            '<p><a href="https://github.com/dude/whatnot/pull/12" rel="nofollow">pull #12</a>'
+            ' and <a href="https://github.com/dude/whatnot/pull/13" rel="nofollow">PR 13</a></p>'
+        )
+    ),
+    (
+        "phone's ringing @dude", '',
+        '<p>phone\'s ringing <a href="/user/dude/" rel="nofollow">@dude</a></p>'
+    ),
+    (
+        "phone's ringing @bunny", '',
+        "<p>phone's ringing @bunny</p>"
+    ),
+    (
+        'email dude@example.com', '',
+        '<p>email dude@example.com</p>'
+    ),
+    (
+        '@dude: #bowling with @walter and @donny', '',
+        (
+            '<p><a href="/user/dude/" rel="nofollow">@dude</a>: <span class="tag tag-bowling">'
+            '#bowling</span> with <a href="/user/walter/" rel="nofollow">@walter</a> and @donny</p>'
+        )
+    ),
+    (
+        '#bug 123', '',
+        (
+            '<p><a href="http://bugzilla.mozilla.org/show_bug.cgi?id=123" rel="nofollow">bug 123</a>'
+            '</p>'
+        )
+    ),
+    (
+        '#debug 123', '',
+        (
+            '<p><span class="tag tag-de">#de</span>'
+            '<a href="http://bugzilla.mozilla.org/show_bug.cgi?id=123" rel="nofollow">bug 123</a></p>'
+        )
+    ),
+    (
+        '@pr 12', REPO_URL,
+        '<p><a href="/user/pr/" rel="nofollow">@pr</a> 12</p>'
+    ),
+    (
+        '@fixpr 12', REPO_URL,
+        '<p>@fix<a href="https://github.com/dude/whatnot/pull/12" rel="nofollow">pr 12</a></p>'
+    ),
+    (
+        'bug 12#tag', '',
+        (
+            '<p><a href="http://bugzilla.mozilla.org/show_bug.cgi?id=12" rel="nofollow">bug 12</a>'
+            '<span class="tag tag-tag">#tag</span></p>'
+        )
+    ),
+    (
+        '#tag@dude', '',
+        '<p><span class="tag tag-tag">#tag</span><a href="/user/dude/" rel="nofollow">@dude</a></p>'
+    ),
+    (
+        'fixed bug 1234 for #release, see pr 99 and issue 100 (@dude)', REPO_URL,
+        (
+            '<p>fixed <a href="http://bugzilla.mozilla.org/show_bug.cgi?id=1234" rel="nofollow">'
+            'bug 1234</a> for <span class="tag tag-release">#release</span>'
+            ', see <a href="https://github.com/dude/whatnot/pull/99" rel="nofollow">pr 99</a>'
+            ' and <a href="https://github.com/dude/whatnot/issues/100" rel="nofollow">issue 100</a>'
+            ' (<a href="/user/dude/" rel="nofollow">@dude</a>)</p>'
+        )
+    ),
+    (
+        'http://example.com/#anchor', '',
+        '<p><a href="http://example.com/#anchor" rel="nofollow">http://example.com/#anchor</a></p>'
+    ),
+    (
+        '**done** with <script>alert(1)</script> #xss', '',
+        (
+            '<p><strong>done</strong>'
+            ' with &lt;script&gt;alert(1)&lt;/script&gt; <span class="tag tag-xss">#xss</span></p>'
+        )
+    ),
+    (
+        '# header\n\nline one\nline two #tag', '',
+        '<p>header</p>\n<p>line one<br>\nline two <span class="tag tag-tag">#tag</span></p>'
+    ),
+    (
+        '- item one bug 1\n- item @dude two', '',
+        (
+            '<ul>\n<li>item one <a href="http://bugzilla.mozilla.org/show_bug.cgi?id=1" rel="nofollow">'
+            'bug 1</a></li>\n<li>item <a href="/user/dude/" rel="nofollow">@dude</a> two</li>\n</ul>'
+        )
+    ),
+    (
+        '`code #notag`', '',
+        '<p><code>code &lt;span class="tag tag-notag"&gt;#notag&lt;/span&gt;</code></p>'
+    ),
+    (
+        'a & b < c > d', '',
+        '<p>a &amp; b &lt; c &gt; d</p>'
+    ),
+]
+
+
+@pytest.mark.parametrize('content, repo_url, expected', GOLDEN)
+def test_golden(content, repo_url, expected):
+    assert render(content, repo_url, mention_url)[0] == expected
+
+
+def test_mentions():
+    html, mentions = render('@dude and @bunny and @dude again', '', mention_url)
+    assert mentions == {'dude', 'bunny'}
+
+
+def test_find_tags():
+    assert find_tags('Shipped #Release and #l10n-fixes, not a#tag or #debug 5') == {'release', 'l10n-fixes', 'de'}
+    assert find_tags('Nothing to see here') == set()
+
+
+def test_find_references():
+    assert find_references('Fixed bug 1234567, bug #12 and pr 34; issue #5 and #debug 6') == {
+        ('bug', 1234567), ('bug', 12), ('pull', 34), ('issue', 5), ('bug', 6),
+    }
+    assert find_references('Nothing to see here') == set()
+
+
+def test_substitutions_are_not_substituted_again():
+    # Only the hashtags and mentions themselves get wrapped, not other text that
+    # happens to start the same way.
+    html, mentions = render('#tag #tagger @dude @dudette dude@dude.com', '', mention_url)
+    assert html == (
+        '<p><span class="tag tag-tag">#tag</span> <span class="tag tag-tagger">#tagger</span> '
+        '<a href="/user/dude/" rel="nofollow">@dude</a> @dudette dude@dude.com</p>'
+    )
+
+
+class TestCachedRender:
+    def test_hits_and_misses(self):
+        assert cached_render('#abc', '', mention_url)[0] == '<p><span class="tag tag-abc">#abc</span></p>'
+        assert RENDER_CACHE_STATS.as_dict() == {'misses': 1}
+
+        assert cached_render('#abc', '', mention_url)[0] == '<p><span class="tag tag-abc">#abc</span></p>'
+        assert RENDER_CACHE_STATS.as_dict() == {'misses': 1, 'local_hits': 1}
+
+        # Another process would find it in the shared cache
+        LOCAL_RENDER_CACHE.clear()
+        assert cached_render('#abc', '', mention_url)[0] == '<p><span class="tag tag-abc">#abc</span></p>'
+        assert RENDER_CACHE_STATS.as_dict() == {'misses': 1, 'local_hits': 1, 'shared_hits': 1}
+
+    def test_keyed_on_repo_url(self):
+        cached_render('pr 5', REPO_URL, mention_url)
+        assert cached_render('pr 5', '', mention_url)[0] == '<p>pr 5</p>'
+        assert RENDER_CACHE_STATS.as_dict() == {'misses': 2}
+
+    def test_mention_changes(self):
+        html, mentions = cached_render('@dude @bunny', '', mention_url)
+        assert html == '<p><a href="/user/dude/" rel="nofollow">@dude</a> @bunny</p>'
+        assert mentions == {'dude', 'bunny'}
+
+        # If @bunny becomes a user, the cached html is no good
+        def bunny_mention_url(slug):
+            return '/user/%s/' % slug
+        html, mentions = cached_render('@dude @bunny', '', bunny_mention_url)
+        assert html == (
+            '<p><a href="/user/dude/" rel="nofollow">@dude</a> '
+            '<a href="/user/bunny/" rel="nofollow">@bunny</a></p>'
+        )
+        assert RENDER_CACHE_STATS.as_dict() == {'misses': 2}
+
+    @override_settings(RENDER_CACHE_ENABLED=False)
+    def test_disabled(self):
+        cached_render('#abc', '', mention_url)
+        cached_render('#abc', '', mention_url)
+        assert RENDER_CACHE_STATS.as_dict() == {}
+
+
+class TestPlainText:
+    @pytest.mark.parametrize('content', [
+        'Worked on the thing.',
+        'Fixed the build, then lunch (finally)!',
+        'Café, naïve, 日本語',
+        'Still 50% done... maybe',
+    ])
+    def test_plain(self, content):
+        assert is_plain_text(content)
+
+    @pytest.mark.parametrize('content', [
+        '',
+        ' leading space',
+        'trailing space ',
+        'two\nlines',
+        '1. ordered list',
+        '- list',
+        'see example.com',
+        'https://example.com',
+        '**bold**',
+        'snake_case',
+        'fixed bug 123',
+        'pr 5',
+        '#tag',
+        '@dude',
+        'a < b',
+        'a & b',
+    ])
+    def test_not_plain(self, content):
+        assert not is_plain_text(content)
+
+    def test_equivalence(self):
+        """Plain text renders the same through the fast path as the full one"""
+        atoms = (
+            list('abcXYZ019 ,;:\'"?!()%$=+~^|{}-.') +
+            ['é', 'ß', '中', '²', '\xa0', '\t', '\n', '_', '*', '/', '#', '@', '&', '<',
+             'bug 1', 'pr 2', 'issue 3', 'foo', 'Bar', '  ', '...', '1.', 'www', 'com',
+             'http', 'x.com ']
+        )
+        rng = random.Random(1234)
+        plain = 0
+        for i in range(5000):
+            content = ''.join(rng.choice(atoms) for _ in range(rng.randint(1, 12)))
+            if is_plain_text(content):
+                plain += 1
+                assert render(content)[0] == render_full(content)[0], content
+
+        # Make sure this actually tested something
+        assert plain > 250
+
+
+def test_threads():
+    """Rendering from many threads at once gives the same results as from one"""
+    contents = [
+        '# Header %d\n\n**bold** bug %d, #tag%d and https://example.com/%d\n- one\n- two' % (i, i, i, i)
+        for i in range(200)
+    ]
+    expected = [render_full(content, REPO_URL, mention_url)[0] for content in contents]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        for _ in range(5):
+            results = executor.map(lambda content: render_full(content, REPO_URL, mention_url)[0], contents)
+            assert list(results) == expected
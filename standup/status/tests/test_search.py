@@ -1,12 +1,30 @@
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection
 from django.db.models import Q
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 
 import pytest
 
+from standup.status.models import StandupUser, Status
 from standup.status.search import (
+    MAX_TOKENS,
+    PhraseQuery,
+    Token,
+    TrigramCompiler,
+    TSQueryCompiler,
+    facet_counts,
+    facet_ids,
     generate_query,
+    narrow_statuses,
+    parse,
+    scan,
+    search_statuses,
     to_tokens,
     unescape,
 )
+from standup.status.tests.factories import ProjectFactory, StandupUserFactory, StatusFactory, TeamFactory
+from standup.status.views import SearchView
 
 
 class TestToTokens:
@@ -23,6 +41,11 @@ class TestToTokens:
     @pytest.mark.parametrize('text, expected', [
         (u'\\"AND', [u'\\"AND']),
         (u'\\"AND\\"', [u'\\"AND\\"']),
+        # A run of backslashes escapes the character after it
+        (u'\\\\"', [u'\\\\"']),
+        (u'a\\\\"b c', [u'a\\\\"b', u'c']),
+        (u'"a\\\\" b"', [u'"a\\\\" b"']),
+        (u'a\\ b', [u'a\\', u'b']),
     ])
     def test_escaping(self, text, expected):
         """Escaped things stay escaped"""
@@ -30,6 +53,51 @@ class TestToTokens:
 
     def test_edge_cases(self):
         assert to_tokens(u'AND "def ghi') == [u'AND', u'"def ghi"']
+        assert to_tokens(u'"def\\"') == [u'"def\\""']
+
+    def test_nothing_to_match(self):
+        """Words and phrases that would match everything are dropped"""
+        assert to_tokens(u'\tabx y\t"  ') == [u'abx', u'y']
+        assert to_tokens(u'a "" \\ " " OR b') == [u'a', u'OR', u'b']
+
+    def test_unicode_whitespace(self):
+        assert to_tokens(u'abc\u3000def\xa0ghi') == [u'abc', u'def', u'ghi']
+
+
+def test_scan():
+    assert scan(u'a\\"b OR "c \\" d" AND "e') == [
+        Token('WORD', u'a\\"b', u'a"b'),
+        Token('OR', u'OR', None),
+        Token('PHRASE', u'"c \\" d"', u'c " d'),
+        Token('AND', u'AND', None),
+        Token('PHRASE', u'"e"', u'e'),
+    ]
+
+
+class TestParse:
+    def test_tree(self):
+        assert parse(u'a AND b AND "c d" OR e f') == (
+            'and', ('match', u'a'), ('match', u'b'),
+            ('or', ('phrase', u'c d'), ('match', u'e'), ('match', u'f'))
+        )
+
+    def test_cached(self):
+        parse.cache_clear()
+        generate_query('foo', u'abc AND def')
+        generate_query('foo', u'  abc AND def ')
+        info = parse.cache_info()
+        assert (info.hits, info.misses) == (1, 1)
+
+    def test_pathological(self):
+        text = u' AND '.join(u'a%d OR b%d' % (i, i) for i in range(5000)) + u' "unbalanced'
+        node = parse(text)
+        depth = 0
+        while node[0] in ('and', 'or'):
+            node = node[-1]
+            depth += 1
+        assert depth < MAX_TOKENS
+        # Compiling it doesn't blow the stack
+        generate_query('foo', text)
 
 
 @pytest.mark.parametrize('text, expected', [
@@ -100,8 +168,166 @@ class TestGenerateQuery:
             'foo', u'foo\\\\bar',
             Q(foo__icontains=u'foo\\bar')
         ),
+        (
+            'foo', u'\tabx y\t"  ',
+            Q(foo__icontains=u'abx') | Q(foo__icontains=u'y')
+        ),
     ])
     def test_edge_cases(self, field, text, expected):
         # NOTE(willkg): We repr the Q objects because otherwise they don't compare. I think this is
         # ok since I think it's order-dependent.
         assert repr(generate_query(field, text)) == repr(expected)
+
+
+class TestTSQueryCompiler:
+    def test_grammar(self):
+        query = generate_query('search_vector', u'abc OR "def ghi" AND j\\kl', TSQueryCompiler)
+        assert query.connector == '||'
+        assert type(query.lhs) is SearchQuery
+        assert query.lhs.value == u'abc'
+        rhs = query.rhs
+        assert rhs.connector == '&&'
+        assert type(rhs.lhs) is PhraseQuery
+        assert rhs.lhs.value == u'def ghi'
+        assert rhs.rhs.value == u'jkl'
+
+    def test_single(self):
+        query = generate_query('search_vector', u'abc', TSQueryCompiler)
+        assert type(query) is SearchQuery
+        assert query.config == 'english'
+
+
+class TestTrigramIContains:
+    def test_compiler(self):
+        query = generate_query('foo', u'abc AND "def"', TrigramCompiler)
+        assert repr(query) == repr(Q(foo__trgm_icontains=u'abc') & Q(foo__trgm_icontains=u'def'))
+
+    @pytest.mark.parametrize('text', ['frob', 'ROBB', 'bug 12345', '12345', 'example.com/pull/', '50%', 'a_b'])
+    def test_same_matches_as_icontains(self, db, text):
+        StatusFactory.create(content='Fixed the Frobber for bug 1234567')
+        StatusFactory.create(content='See https://example.com/pull/7 about 50% of a_b')
+        StatusFactory.create(content='50 percent of ab')
+
+        expected = list(Status.objects.filter(content__icontains=text))
+        assert expected
+        assert list(Status.objects.filter(content__trgm_icontains=text)) == expected
+
+    def test_users(self, db):
+        user = StandupUserFactory.create(name='Jim Bob', slug='jimbob', irc_nick='jb')
+        StandupUserFactory.create(name='Someone', slug='someone', irc_nick='else')
+        assert list(StandupUser.objects.filter(name__trgm_icontains='M BO')) == [user]
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='only differs on Postgres')
+    def test_postgres_uses_ilike(self, db):
+        sql, params = Status.objects.filter(content__trgm_icontains='frob').query.sql_with_params()
+        assert 'ILIKE' in sql
+        assert 'UPPER' not in sql
+
+
+class TestSearchStatuses:
+    @override_settings(SEARCH_BACKEND='icontains')
+    def test_icontains(self, db):
+        match = StatusFactory.create(content='Fixed the Frobber')
+        StatusFactory.create(content='Broke the frob')
+        assert list(search_statuses(Status.objects.all(), 'frobber')) == [match]
+        # Ranking needs the postgres backend, so it's ignored
+        assert list(search_statuses(Status.objects.all(), 'frobber', rank=True)) == [match]
+
+    @override_settings(SEARCH_BACKEND='trigram')
+    def test_trigram(self, db):
+        match = StatusFactory.create(content='Fixed bug 1234567')
+        StatusFactory.create(content='Fixed bug 7654321')
+        assert list(search_statuses(Status.objects.all(), '12345')) == [match]
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='needs Postgres full-text search')
+    @override_settings(SEARCH_BACKEND='postgres')
+    def test_postgres(self, db):
+        one = StatusFactory.create(content='Fixed the frobbers in the frobbing code')
+        two = StatusFactory.create(content='Wrote code for the frobber')
+        StatusFactory.create(content='Went to lunch')
+
+        statuses = Status.objects.all()
+        assert set(search_statuses(statuses, 'frobber')) == {one, two}
+        assert list(search_statuses(statuses, '"frobbing code"')) == [one]
+        assert list(search_statuses(statuses, 'lunch AND code')) == []
+
+        many = StatusFactory.create(content='frobber frobber frobber', created=two.created.replace(year=2000))
+        assert list(search_statuses(statuses, 'frobber', rank=True))[0] == many
+
+
+class TestFacets:
+    @pytest.fixture
+    def data(self, db):
+        team = TeamFactory.create(slug='ateam')
+        ann = StandupUserFactory.create(slug='ann')
+        team.users.add(ann)
+        bob = StandupUserFactory.create(slug='bob')
+        frob = ProjectFactory.create(slug='frob')
+        statuses = [
+            StatusFactory.create(user=ann, project=frob, content='frob one'),
+            StatusFactory.create(user=ann, project=None, content='frob two'),
+            StatusFactory.create(user=bob, project=frob, content='frob three'),
+            StatusFactory.create(user=bob, project=frob, content='lunch'),
+        ]
+        return {'team': team, 'ann': ann, 'bob': bob, 'frob': frob, 'statuses': statuses}
+
+    def test_facet_counts(self, data):
+        facets = facet_counts(Status.objects.filter(content__icontains='frob'))
+        assert facets == {
+            'project': [(data['frob'], 2)],
+            'user': [(data['ann'], 2), (data['bob'], 1)],
+            'team': [(data['team'], 2)],
+        }
+
+    def test_one_status_query(self, data):
+        with CaptureQueriesContext(connection) as ctx:
+            facet_counts(Status.objects.filter(content__icontains='frob'))
+        status_queries = [q['sql'] for q in ctx.captured_queries if '"status"' in q['sql']]
+        assert len(status_queries) == 1
+
+    def test_limit(self, data):
+        assert facet_counts(Status.objects.all(), limit=1)['user'] == [(data['ann'], 2)]
+
+    def test_narrow_statuses(self, data):
+        statuses = Status.objects.all()
+        one, two, three, lunch = data['statuses']
+        assert set(narrow_statuses(statuses, {'project': 'frob'})) == {one, three, lunch}
+        assert set(narrow_statuses(statuses, {'team': 'ateam'})) == {one, two}
+        assert set(narrow_statuses(statuses, {'team': 'ateam', 'project': 'frob'})) == {one}
+        assert set(narrow_statuses(statuses, {'user': 'nobody'})) == set()
+
+    @pytest.mark.parametrize('selected', [
+        {},
+        {'project': 'frob'},
+        {'team': 'ateam'},
+        {'team': 'ateam', 'user': 'bob'},
+        {'user': 'nobody'},
+    ])
+    def test_facet_ids(self, data, selected):
+        statuses = Status.objects.all()
+        ids = [status.pk for status in reversed(data['statuses'])] + [12345]
+        narrowed, facets, sampled = facet_ids(ids, selected)
+        expected = narrow_statuses(statuses, selected)
+        if selected:
+            assert narrowed == [pk for pk in ids if pk in set(expected.values_list('pk', flat=True))]
+        else:
+            # Nothing to narrow, so deleted statuses are left for the page to skip
+            assert narrowed == ids
+        assert facets == facet_counts(expected)
+        assert not sampled
+
+    @override_settings(SEARCH_BACKEND='icontains')
+    def test_search_view(self, data):
+        one, two, three, lunch = data['statuses']
+        view = SearchView()
+        view.request = RequestFactory().get('/', {'query': 'frob', 'user': 'bob'})
+        ctx = view.get_context_data()
+        assert list(ctx['statuses']) == [three]
+        assert ctx['selected_facets'] == {'user': 'bob'}
+        # Facets count the narrowed results
+        assert ctx['facets']['project'] == [(data['frob'], 1)]
+        assert ctx['facets']['team'] == []
+
+        view.request = RequestFactory().get('/')
+        ctx = view.get_context_data()
+        assert ctx['facets'] == {}
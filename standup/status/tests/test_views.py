@@ -1,7 +1,25 @@
+from datetime import date, datetime, timedelta
+import json
+from unittest.mock import patch
+
 from django.core.urlresolvers import reverse
-from django.test import override_settings, TestCase
+from django.core.cache import cache
+from django.db import transaction
+from django.http import Http404
+from django.test import override_settings, RequestFactory, TestCase, TransactionTestCase
+import pytest
+import pytz
 
-from standup.status.tests.factories import StatusFactory
+from standup.status.feeds import MainFeed, feed_cache_key
+from standup.status.tests.factories import ProjectFactory, StatusFactory, StandupUserFactory, TeamFactory
+from standup.status.views import (
+    ReferenceView,
+    TagView,
+    TrendingTagsView,
+    UserFeedJSON,
+    UserMentionsView,
+    WeeklyView,
+)
 
 
 class HomeViewTestCase(TestCase):
@@ -20,6 +38,261 @@ class HomeViewTestCase(TestCase):
         self.assertNotContains(resp, 'No status updates available')
 
 
+class WeeklyViewTestCase(TestCase):
+    def get_context(self, **params):
+        view = WeeklyView()
+        view.request = RequestFactory().get('/weekly/', params)
+        return view.get_context_data()
+
+    def test_grouped_by_week_and_user(self):
+        dude, walter = StandupUserFactory.create_batch(2)
+
+        def status(user, *args):
+            return StatusFactory.create(user=user, created=datetime(*args, tzinfo=pytz.utc))
+
+        # Monday 2018-01-08 through Sunday 2018-01-14
+        first = status(dude, 2018, 1, 8, 0, 0, 0)
+        second = status(walter, 2018, 1, 10, 12, 0, 0)
+        third = status(dude, 2018, 1, 14, 23, 59, 59)
+        status(dude, 2018, 1, 15)
+        status(dude, 2018, 1, 7, 23, 59, 59)
+
+        ctx = self.get_context(week='2018-01-10')
+        assert ctx['week_groups'] == [{
+            'start_date': date(2018, 1, 8),
+            'end_date': date(2018, 1, 14),
+            'users': [
+                {'user': dude, 'statuses': [third, first]},
+                {'user': walter, 'statuses': [second]},
+            ],
+        }]
+        assert ctx['newer_url'] == '?week=2018-01-15'
+        assert ctx['older_url'] == '?week=2018-01-01'
+
+    def test_default_window(self):
+        StatusFactory.create(created=datetime(2018, 1, 8, tzinfo=pytz.utc))
+        ctx = self.get_context()
+        assert ctx['week_groups'] == []
+        assert ctx['newer_url'] is None
+        assert ctx['older_url'] is not None
+
+    def test_pages_within_week(self):
+        start = datetime(2018, 1, 8, tzinfo=pytz.utc)
+        statuses = [StatusFactory.create(created=start + timedelta(hours=i)) for i in range(5)]
+        StatusFactory.create(created=start - timedelta(days=1))
+        statuses.reverse()
+
+        seen = []
+        params = {'week': '2018-01-08'}
+        with patch.object(WeeklyView, 'per_page', 2):
+            while True:
+                ctx = self.get_context(**params)
+                seen.extend(
+                    status for group in ctx['week_groups'][0]['users'] for status in group['statuses']
+                )
+                if not ctx['older_url'].startswith('?week=2018-01-08&before='):
+                    break
+                params = dict(pair.split('=') for pair in ctx['older_url'][1:].split('&'))
+
+            assert sorted(seen, key=lambda status: status.created, reverse=True) == statuses
+            # The last page goes on to the previous week
+            assert ctx['older_url'] == '?week=2018-01-01'
+            assert ctx['newer_url'].startswith('?week=2018-01-08&after=')
+
+    def test_day(self):
+        StatusFactory.create(created=datetime(2018, 1, 9, 23, 59, tzinfo=pytz.utc))
+        status = StatusFactory.create(created=datetime(2018, 1, 10, 12, tzinfo=pytz.utc))
+        StatusFactory.create(created=datetime(2018, 1, 11, tzinfo=pytz.utc))
+
+        ctx = self.get_context(day='2018-01-10')
+        assert [group['statuses'] for group in ctx['week_groups'][0]['users']] == [[status]]
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_time_zone(self):
+        # Sunday evening in New York, but Monday in UTC
+        sunday = StatusFactory.create(created=datetime(2018, 1, 15, 3, tzinfo=pytz.utc))
+        monday = StatusFactory.create(created=datetime(2018, 1, 15, 6, tzinfo=pytz.utc))
+
+        ctx = self.get_context(week='2018-01-15')
+        assert [week['start_date'] for week in ctx['week_groups']] == [date(2018, 1, 15)]
+        assert ctx['week_groups'][0]['users'][0]['statuses'] == [monday]
+
+        ctx = self.get_context(week='2018-01-08')
+        assert ctx['week_groups'][0]['start_date'] == date(2018, 1, 8)
+        assert ctx['week_groups'][0]['users'][0]['statuses'] == [sunday]
+
+        ctx = self.get_context(day='2018-01-14')
+        assert ctx['week_groups'][0]['users'][0]['statuses'] == [sunday]
+
+    def test_dates(self):
+        today = StatusFactory.create(created=datetime.now(pytz.utc))
+        last_week = StatusFactory.create(created=datetime.now(pytz.utc) - timedelta(days=3))
+        StatusFactory.create(created=datetime.now(pytz.utc) - timedelta(days=30))
+
+        def shown(**params):
+            ctx = self.get_context(**params)
+            return {
+                status for week in ctx['week_groups'] for group in week['users'] for status in group['statuses']
+            }
+
+        assert shown(dates='today') == {today}
+        assert shown(dates='7d') == {today, last_week}
+
+
+class UserFeedJSONTestCase(TestCase):
+    def setUp(self):
+        self.user = StandupUserFactory.create()
+        start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        self.statuses = [
+            StatusFactory.create(user=self.user, created=start + timedelta(days=i))
+            for i in range(25)
+        ]
+        self.statuses.reverse()
+        self.url = '/user/%s.json' % self.user.slug
+
+    def get(self, url, **params):
+        resp = self.client.get(url, params)
+        assert resp.status_code == 200
+        assert resp.streaming
+        return resp, json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+
+    def test_default_limit(self):
+        resp, data = self.get(self.url)
+        assert [item['id'] for item in data] == [s.id for s in self.statuses[:20]]
+        assert data[0] == json.loads(json.dumps(self.statuses[0].dictify(False)))
+
+    def test_limit_and_before(self):
+        ids = []
+        url = self.url + '?limit=10'
+        while url:
+            resp, data = self.get(url)
+            ids.extend(item['id'] for item in data)
+            url = resp.get('Link', '').partition('>')[0][1:]
+        assert ids == [s.id for s in self.statuses]
+
+    def test_all(self):
+        # Stream a few chunks
+        with patch.object(UserFeedJSON, 'chunk_size', 7):
+            resp, data = self.get(self.url, all='1')
+        assert [item['id'] for item in data] == [s.id for s in self.statuses]
+        assert 'Link' not in resp
+
+    def test_bad_params(self):
+        for params in ({'limit': 'x'}, {'limit': '0'}, {'limit': '1000'}, {'before': 'x'}):
+            assert self.client.get(self.url, params).status_code == 400
+
+
+class UserMentionsTestCase(TestCase):
+    def setUp(self):
+        self.user = StandupUserFactory.create(user__username='dude')
+        start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        self.statuses = [
+            StatusFactory.create(content='@dude %d' % i, created=start + timedelta(days=i))
+            for i in range(5)
+        ]
+        self.statuses.reverse()
+        StatusFactory.create(content='@walter')
+
+    def test_page(self):
+        view = UserMentionsView()
+        view.request = RequestFactory().get('/')
+        view.kwargs = {'slug': 'dude'}
+        view.object = self.user
+        page = view.paginate_statuses(per_page=3)
+        assert list(page) == self.statuses[:3]
+
+        view.request = RequestFactory().get('/', {'before': page.next_cursor})
+        assert list(view.paginate_statuses(per_page=3)) == self.statuses[3:]
+
+    def test_json(self):
+        ids = []
+        url = '/user/dude/mentions.json?limit=2'
+        while url:
+            resp = self.client.get(url)
+            data = json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+            ids.extend(item['id'] for item in data)
+            url = resp.get('Link', '').partition('>')[0][1:]
+        assert ids == [status.id for status in self.statuses]
+        # Mentions are by other people
+        assert data[0]['user']['slug'] == self.statuses[-1].user.slug
+
+        resp = self.client.get('/user/dude/mentions.json', {'all': '1'})
+        data = json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+        assert [item['id'] for item in data] == [status.id for status in self.statuses]
+
+
+class ReferenceTestCase(TestCase):
+    def setUp(self):
+        self.project = ProjectFactory.create(slug='rug')
+        start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+        self.statuses = [
+            StatusFactory.create(
+                content='bug 1234567 and pr 12', project=self.project, created=start + timedelta(days=i)
+            )
+            for i in range(3)
+        ]
+        self.statuses.reverse()
+        StatusFactory.create(content='bug 1234567')
+        StatusFactory.create(content='pr 12')
+
+    def paginate(self, **kwargs):
+        view = ReferenceView()
+        view.request = RequestFactory().get('/')
+        view.kwargs = kwargs
+        view.object = view.get_object()
+        return list(view.paginate_statuses())
+
+    def test_page(self):
+        assert len(self.paginate(kind='bug', number='1234567')) == 4
+        assert self.paginate(kind='pull', slug='rug', number='12') == self.statuses
+        assert self.paginate(kind='issue', slug='rug', number='12') == []
+
+    def test_json(self):
+        resp = self.client.get('/project/rug/pull/12.json', {'limit': '2'})
+        data = json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+        assert [item['id'] for item in data] == [status.id for status in self.statuses[:2]]
+        assert 'rel="next"' in resp['Link']
+
+        resp = self.client.get('/bug/1234567.json')
+        data = json.loads(b''.join(resp.streaming_content).decode('utf-8'))
+        assert len(data) == 4
+
+    def test_not_found(self):
+        view = ReferenceView()
+        for kwargs in ({'kind': 'pull', 'slug': 'nope', 'number': '12'}, {'kind': 'bug', 'number': '9999999999'}):
+            view.kwargs = kwargs
+            with pytest.raises(Http404):
+                view.get_object()
+
+
+class TagViewTestCase(TestCase):
+    def get_context_data(self, view_class, path='/', **kwargs):
+        view = view_class()
+        view.request = RequestFactory().get(path)
+        view.kwargs = kwargs
+        return view.get_context_data(**kwargs)
+
+    def test_tag(self):
+        old = StatusFactory.create(content='#Release one')
+        new = StatusFactory.create(content='#release two', created=old.created + timedelta(hours=1))
+        StatusFactory.create(content='#other')
+        ctx = self.get_context_data(TagView, name='RELEASE')
+        assert ctx['tag'] == 'release'
+        assert list(ctx['statuses']) == [new, old]
+
+        ctx = self.get_context_data(TagView, '/?page=1', name='release')
+        assert list(ctx['statuses']) == [new, old]
+
+    def test_trending(self):
+        today = datetime.now(pytz.utc)
+        StatusFactory.create(content='#release', created=today)
+        StatusFactory.create(content='#release #docs', created=today)
+        StatusFactory.create(content='#docs', created=today - timedelta(days=100))
+        ctx = self.get_context_data(TrendingTagsView, '/?days=1000')
+        assert ctx['days'] == 90
+        assert ctx['trending'] == [('release', 2), ('docs', 1)]
+
+
 class StatusViewTestCase(TestCase):
     def test_status_404(self):
         resp = self.client.get(reverse('status.status', kwargs={'pk': 1234}))
@@ -42,3 +315,193 @@ class RobotsViewTestCase(TestCase):
         assert resp.status_code == 200
         assert resp['content-type'] == 'text/plain'
         assert resp.content == b'User-agent: *\nDisallow: /'
+
+
+class ConditionalFeedTestCase(TransactionTestCase):
+    # Validators change when the write commits, so this needs real transactions
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_conditional(self, url, make_change):
+        resp = self.client.get(url)
+        assert resp.status_code == 200
+        etag = resp['ETag']
+        last_modified = resp['Last-Modified']
+
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 304
+        assert not resp.content
+        resp = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        assert resp.status_code == 304
+
+        make_change()
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert resp.status_code == 200
+        assert resp['ETag'] != etag
+
+    def test_main_feed(self):
+        StatusFactory.create()
+        self.assert_conditional(reverse('status.index_feed'), lambda: StatusFactory.create())
+
+    def test_user_feed(self):
+        status = StatusFactory.create()
+        self.assert_conditional('/user/%s.xml' % status.user.slug, status.delete)
+
+    def test_team_feed(self):
+        team = TeamFactory.create()
+        user = StandupUserFactory.create()
+        StatusFactory.create(user=user)
+        url = reverse('status.team_feed', kwargs={'slug': team.slug})
+        self.assert_conditional(url, lambda: team.users.add(user))
+
+    def test_tag_feed(self):
+        StatusFactory.create(content='#release')
+        url = reverse('status.tag_feed', kwargs={'name': 'release'})
+        self.assert_conditional(url, lambda: StatusFactory.create(content='#Release again'))
+
+    def test_user_mentions_feed(self):
+        StandupUserFactory.create(user__username='dude')
+        url = reverse('status.user_mentions_feed', kwargs={'slug': 'dude'})
+        self.assert_conditional(url, lambda: StatusFactory.create(content='@dude'))
+
+    def test_user_json(self):
+        status = StatusFactory.create(content='hi')
+        url = '/user/%s.json' % status.user.slug
+
+        def edit():
+            status.content = 'bye'
+            status.save()
+
+        self.assert_conditional(url, edit)
+
+    def test_tag_removed(self):
+        status = StatusFactory.create(content='#release')
+        StatusFactory.create(content='#release')
+        url = reverse('status.tag_feed', kwargs={'name': 'release'})
+
+        def edit():
+            status.content = 'no tag'
+            status.save()
+
+        self.assert_conditional(url, edit)
+
+    def test_bug_json_reference_removed(self):
+        status = StatusFactory.create(content='fixed bug 5')
+        StatusFactory.create(content='bug 5 again')
+
+        def edit():
+            status.content = 'fixed it'
+            status.save()
+
+        self.assert_conditional(reverse('status.bug_json', kwargs={'number': '5'}), edit)
+
+    def test_pull_json_reference_edited(self):
+        project = ProjectFactory.create()
+        status = StatusFactory.create(project=project, content='reviewed pr 7')
+        StatusFactory.create(project=project, content='merged pr 7')
+        url = reverse('status.project_reference_json', kwargs={'slug': project.slug, 'kind': 'pull', 'number': '7'})
+
+        def edit():
+            status.content = 'reviewed pr 7 twice'
+            status.save()
+
+        self.assert_conditional(url, edit)
+
+    def test_writes_elsewhere(self):
+        status = StatusFactory.create()
+        url = '/user/%s.xml' % status.user.slug
+        etag = self.client.get(url)['ETag']
+
+        other = StatusFactory.create(content='#release for @dude')
+        other.content = 'edited'
+        other.save()
+        other.delete()
+        assert self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+
+class StoredFeedTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def stored(self, path):
+        return cache.get(feed_cache_key(path))
+
+    def test_stored_doc_is_served(self):
+        StatusFactory.create(content='hi')
+        url = reverse('status.index_feed')
+        assert self.stored(url) is None
+        resp = self.client.get(url)
+        assert resp.status_code == 200
+        doc = self.stored(url)
+        assert doc['content'] == resp.content
+        assert doc['etag'] == resp['ETag']
+
+        doc['content'] = b'stored'
+        cache.set(feed_cache_key(url), doc)
+        resp = self.client.get(url)
+        assert resp.content == b'stored'
+        assert resp['Content-Type'] == doc['content_type']
+
+        # Not for other schemes (or hosts)
+        resp = self.client.get(url, secure=True)
+        assert resp.content != b'stored'
+
+    def test_rebuilt_on_create_and_delete(self):
+        user = StandupUserFactory.create()
+        StandupUserFactory.create(user__username='dude')
+        project = ProjectFactory.create()
+        team = TeamFactory.create()
+        team.users.add(user)
+        urls = [
+            reverse('status.index_feed'),
+            reverse('status.user_feed', kwargs={'slug': user.slug}),
+            reverse('status.project_feed', kwargs={'slug': project.slug}),
+            reverse('status.team_feed', kwargs={'slug': team.slug}),
+            reverse('status.tag_feed', kwargs={'name': 'release'}),
+            reverse('status.user_mentions_feed', kwargs={'slug': 'dude'}),
+        ]
+        for url in urls:
+            self.client.get(url)
+
+        status = StatusFactory.create(user=user, project=project, content='materialized #release for @dude')
+        for url in urls:
+            doc = self.stored(url)
+            assert b'materialized' in doc['content']
+            # Readers get the rebuilt document without building it
+            assert self.client.get(url, HTTP_IF_NONE_MATCH=doc['etag']).status_code == 304
+
+        status.delete()
+        for url in urls:
+            assert b'materialized' not in self.stored(url)['content']
+
+    def test_rebuilt_once_per_transaction(self):
+        user = StandupUserFactory.create()
+        url = reverse('status.user_feed', kwargs={'slug': user.slug})
+        self.client.get(url)
+
+        with patch('standup.status.feeds.rebuild_feeds') as rebuild_feeds:
+            with transaction.atomic():
+                for i in range(3):
+                    StatusFactory.create(user=user, project=None, content='#release %d' % i)
+                StatusFactory.create(user=user, project=None).delete()
+        rebuild_feeds.assert_called_once_with([
+            reverse('status.index_feed'),
+            reverse('status.tag_feed', kwargs={'name': 'release'}),
+            url,
+        ])
+
+    def test_rebuild_errors_are_logged(self):
+        url = reverse('status.index_feed')
+        self.client.get(url)
+
+        with patch.object(MainFeed, 'items', side_effect=ValueError('boom')):
+            # The write still goes through
+            StatusFactory.create(content='materialized')
+        assert self.stored(url) is None
+        assert b'materialized' in self.client.get(url).content
+
+    def test_feeds_not_read_are_not_built(self):
+        status = StatusFactory.create()
+        assert self.stored(reverse('status.index_feed')) is None
+        assert self.stored('/user/%s.xml' % status.user.slug) is None
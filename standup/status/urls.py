@@ -1,16 +1,24 @@
 from django.conf.urls import url
 
-from . import views
+from . import feeds, views
 
 
 SLUG_RE = r'(?P<slug>[-a-zA-Z0-9_@]+)'
+TAG_RE = r'(?P<name>[a-zA-Z][a-zA-Z0-9_.-]*)'
+NUMBER_RE = r'(?P<number>\d{1,10})'
+PROJECT_REFERENCE_RE = r'project/%s/(?P<kind>pull|issue)/%s' % (SLUG_RE, NUMBER_RE)
 
 
 urlpatterns = [
     url('^$', views.HomeView.as_view(), name='status.index'),
     url('^team/%s/$' % SLUG_RE, views.TeamView.as_view(), name='status.team'),
     url('^project/%s/$' % SLUG_RE, views.ProjectView.as_view(), name='status.project'),
+    url('^%s/$' % PROJECT_REFERENCE_RE, views.ReferenceView.as_view(), name='status.project_reference'),
+    url('^bug/%s/$' % NUMBER_RE, views.ReferenceView.as_view(), {'kind': 'bug'}, name='status.bug'),
+    url('^tag/%s/$' % TAG_RE, views.TagView.as_view(), name='status.tag'),
+    url('^tags/$', views.TrendingTagsView.as_view(), name='status.tags'),
     url('^user/%s/$' % SLUG_RE, views.UserView.as_view(), name='status.user'),
+    url('^user/%s/mentions/$' % SLUG_RE, views.UserMentionsView.as_view(), name='status.user_mentions'),
     url('^status/(?P<pk>\d{1,8})/$', views.StatusView.as_view(), name='status.status'),
     url('^weekly/$', views.WeeklyView.as_view(), name='status.weekly'),
     url('^statusize/$', views.statusize, name='status.statusize'),
@@ -21,11 +29,24 @@ urlpatterns = [
     url('^accounts/login/$', views.LoginView.as_view(), name='users.loginform'),
 
     # feeds
-    url('^statuses.xml$', views.MainFeed(), name='status.index_feed'),
-    url('^user/%s.xml$' % SLUG_RE, views.UserFeed(), name='status.user_feed'),
-    url('^user/%s.json$' % SLUG_RE, views.UserFeedJSON.as_view(), name='status.user_feed'),
-    url('^team/%s.xml$' % SLUG_RE, views.TeamFeed(), name='status.team_feed'),
-    url('^project/%s.xml$' % SLUG_RE, views.ProjectFeed(), name='status.project_feed'),
+    url('^statuses.xml$', feeds.MainFeed(), name='status.index_feed'),
+    url('^user/%s.xml$' % SLUG_RE, feeds.UserFeed(), name='status.user_feed'),
+    url('^user/%s.json$' % SLUG_RE, views.UserFeedJSON.as_view(), name='status.user_feed_json'),
+    url('^user/%s/mentions\\.xml$' % SLUG_RE, feeds.UserMentionsFeed(), name='status.user_mentions_feed'),
+    url(
+        '^user/%s/mentions\\.json$' % SLUG_RE, views.UserMentionsJSON.as_view(),
+        name='status.user_mentions_json'
+    ),
+    url('^team/%s.xml$' % SLUG_RE, feeds.TeamFeed(), name='status.team_feed'),
+    url('^project/%s.xml$' % SLUG_RE, feeds.ProjectFeed(), name='status.project_feed'),
+    url('^tag/%s\\.xml$' % TAG_RE, feeds.TagFeed(), name='status.tag_feed'),
+
+    # reference lookups
+    url('^bug/%s\\.json$' % NUMBER_RE, views.ReferenceJSON.as_view(), {'kind': 'bug'}, name='status.bug_json'),
+    url(
+        '^%s\\.json$' % PROJECT_REFERENCE_RE, views.ReferenceJSON.as_view(),
+        name='status.project_reference_json'
+    ),
 
     # csp
     url('^csp-violation-capture$', views.csp_violation_capture),
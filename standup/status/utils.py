@@ -1,7 +1,11 @@
 import re
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from itertools import islice
 
-from django.utils.timezone import now, make_aware
+from django.core.cache import cache
+from django.utils.timezone import localtime, now, make_aware
 
 
 def trim_urls(attrs, new=False):
@@ -63,6 +67,11 @@ def get_day(day):
     return make_aware(datetime.strptime(day, '%Y-%m-%d'))
 
 
+def day_start(day):
+    """Returns when a date starts in the current time zone"""
+    return make_aware(datetime(day.year, day.month, day.day))
+
+
 def get_weeks(num_weeks=10):
     weeks = []
     current = now()
@@ -84,3 +93,68 @@ def week_end(d):
     """Weeks start on the Sunday on or after the given date"""
     d = d + timedelta(7 - d.isoweekday())
     return make_aware(datetime(d.year, d.month, d.day, 23, 59, 59))
+
+
+def group_by_week(statuses):
+    """Groups statuses by week and then by user
+
+    Weeks start on Mondays in the current time zone (``TIME_ZONE``).
+
+    :arg statuses: iterable of statuses, newest first
+
+    :returns: list of dicts of "start_date", "end_date" and "users", newest
+        week first; "users" is a list of dicts of "user" and "statuses" with
+        the most recently active user first
+
+    """
+    weeks = []
+    users = None
+    for status in statuses:
+        day = localtime(status.created).date()
+        start_date = day - timedelta(days=day.weekday())
+        if not weeks or weeks[-1]['start_date'] != start_date:
+            users = OrderedDict()
+            weeks.append({
+                'start_date': start_date,
+                'end_date': start_date + timedelta(days=6),
+                'users': users,
+            })
+        group = users.setdefault(status.user_id, {'user': status.user, 'statuses': []})
+        group['statuses'].append(status)
+
+    for week in weeks:
+        week['users'] = list(week['users'].values())
+    return weeks
+
+
+def get_cache_version(key):
+    """Returns the current version of a group of cached things
+
+    Put the version in the cache keys for the group and call
+    ``bump_cache_version()`` to invalidate them all at once.
+
+    """
+    version = cache.get(key)
+    if version is None:
+        # Start from the time so a version that fell out of the cache doesn't
+        # bring back things cached under it.
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """Invalidates a group of cached things; see ``get_cache_version()``"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_cache_version(key)
+
+
+def chunked(items, size):
+    """Yields lists of up to size items at a time"""
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
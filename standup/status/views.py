@@ -1,15 +1,18 @@
 import json
 import logging
+from datetime import timedelta
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.syndication.views import Feed
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.core.urlresolvers import reverse
 from django.http import Http404
+from django.shortcuts import get_object_or_404
 from django.http import (HttpResponse, HttpResponseBadRequest,
-                         HttpResponseForbidden, HttpResponseRedirect)
-from django.utils.feedgenerator import Atom1Feed
+                         HttpResponseForbidden, HttpResponseRedirect,
+                         StreamingHttpResponse)
+from django.utils.timezone import localdate, now
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.views.generic import DetailView, TemplateView, UpdateView
@@ -17,10 +20,28 @@ from django.views.generic.detail import BaseDetailView
 
 from raven.contrib.django.models import client
 
+from standup.status.feeds import conditional_response, reference_scope
 from standup.status.forms import StatusizeForm, ProfileForm
-from standup.status.models import Status, Team, Project, StandupUser
-from standup.status.search import generate_query
-from standup.status.utils import enddate, startdate
+from standup.status.index import get_search_index
+from standup.status.models import (
+    Project,
+    StandupUser,
+    Status,
+    StatusReference,
+    StatusTag,
+    Team,
+    render_statuses,
+)
+from standup.status.pagination import CountingPaginator, CursorPaginator, InvalidCursor
+from standup.status.search import FACETS, facet_counts, facet_ids, narrow_statuses, search_statuses
+from standup.status.utils import (
+    day_start,
+    enddate,
+    get_day,
+    group_by_week,
+    isday,
+    startdate,
+)
 
 
 class PaginateStatusesMixin(object):
@@ -28,15 +49,36 @@ class PaginateStatusesMixin(object):
         qs = self.get_status_queryset()
         qs = qs.all()
         page = self.request.GET.get('page')
-        paginator = Paginator(qs, per_page)
+        if page is not None or not self.is_newest_first():
+            statuses = self.paginate_statuses_by_number(qs, page or 1, per_page)
+        else:
+            paginator = self.get_cursor_paginator(qs, per_page)
+            try:
+                statuses = paginator.page(
+                    before=self.request.GET.get('before'),
+                    after=self.request.GET.get('after'),
+                )
+            except InvalidCursor:
+                statuses = paginator.page()
+
+        statuses.object_list = render_statuses(statuses.object_list)
+        return statuses
+
+    def is_newest_first(self):
+        """Whether the statuses are newest first and so can be paged with cursors"""
+        return True
+
+    def get_cursor_paginator(self, qs, per_page):
+        return CursorPaginator(qs, per_page)
+
+    def paginate_statuses_by_number(self, qs, page, per_page):
+        paginator = CountingPaginator(qs, per_page)
         try:
-            statuses = paginator.page(page)
+            return paginator.page(page)
         except PageNotAnInteger:
-            statuses = paginator.page(1)
+            return paginator.page(1)
         except EmptyPage:
-            statuses = paginator.page(paginator.num_pages)
-
-        return statuses
+            return paginator.page(paginator.num_pages)
 
     def get_status_queryset(self):
         qs = Status.objects.select_related('project', 'user')
@@ -60,12 +102,80 @@ class HomeView(PaginateStatusesMixin, TemplateView):
     template_name = 'status/index.html'
 
 
-class WeeklyView(PaginateStatusesMixin, TemplateView):
+class WeeklyView(TemplateView):
     template_name = 'status/weekly.html'
+    # Number of weeks to show when no week is picked
+    default_weeks = 2
+    # Most statuses on a page; busy windows take several pages
+    per_page = 100
+
+    def get_window(self):
+        """Returns the (start, end) datetimes of the statuses to show
+
+        That's the week picked with ``week``, the day picked with ``day``, today
+        or the last 7 days with ``dates=today`` or ``dates=7d`` or else the
+        last ``default_weeks`` weeks. Days and weeks (which start on Mondays)
+        are in the current time zone (``TIME_ZONE``).
+
+        """
+        params = self.request.GET
+        today = localdate()
+        week = params.get('week')
+        day = params.get('day')
+        dates = params.get('dates')
+        if isday(week):
+            first = get_day(week).date()
+            first -= timedelta(days=first.weekday())
+            last = first + timedelta(days=7)
+        elif isday(day):
+            first = get_day(day).date()
+            last = first + timedelta(days=1)
+        elif dates == 'today':
+            first, last = today, today + timedelta(days=1)
+        elif dates == '7d':
+            first, last = today - timedelta(days=7), today + timedelta(days=1)
+        else:
+            last = today - timedelta(days=today.weekday()) + timedelta(days=7)
+            first = last - timedelta(days=7 * self.default_weeks)
+        return day_start(first), day_start(last)
+
+    def get_page_url(self, **cursor):
+        """Returns the query string for another page of the same window"""
+        params = self.request.GET.copy()
+        params.pop('before', None)
+        params.pop('after', None)
+        params.update(cursor)
+        return '?' + params.urlencode()
 
-    def get_status_queryset(self):
-        qs = super().get_status_queryset()
-        return qs.order_by('user_id', '-created')
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        start, end = self.get_window()
+        statuses = Status.objects.select_related('project', 'user').filter(
+            created__gte=start, created__lt=end
+        )
+        paginator = CursorPaginator(statuses, self.per_page)
+        try:
+            page = paginator.page(
+                before=self.request.GET.get('before'),
+                after=self.request.GET.get('after'),
+            )
+        except InvalidCursor:
+            page = paginator.page()
+        ctx['week_groups'] = group_by_week(render_statuses(page.object_list))
+
+        # Newer and Older go through the pages of the window and then on to
+        # the next week.
+        ctx['newer_url'] = None
+        if page.has_previous():
+            ctx['newer_url'] = self.get_page_url(after=page.previous_cursor)
+        elif self.request.GET.get('week') and end <= now():
+            ctx['newer_url'] = '?' + urlencode({'week': end.date()})
+        ctx['older_url'] = None
+        if page.has_next():
+            ctx['older_url'] = self.get_page_url(before=page.next_cursor)
+        elif Status.objects.filter(created__lt=start).exists():
+            ctx['older_url'] = '?' + urlencode({'week': (start - timedelta(days=7)).date()})
+        return ctx
 
 
 class TeamView(PaginateStatusesMixin, DetailView):
@@ -74,7 +184,16 @@ class TeamView(PaginateStatusesMixin, DetailView):
     context_object_name = 'team'
 
     def get_status_queryset(self):
-        return self.object.statuses()
+        return self.object.statuses().select_related('project', 'user')
+
+    def get_cursor_paginator(self, qs, per_page):
+        # Page through the team's timeline rather than statuses so each page is
+        # one range of the timeline's index.
+        timeline = self.object.timeline.select_related('status__project', 'status__user')
+        return CursorPaginator(
+            timeline, per_page, keys=('created', 'status_id'),
+            to_status=lambda entry: entry.status
+        )
 
 
 class ProjectView(PaginateStatusesMixin, DetailView):
@@ -83,7 +202,108 @@ class ProjectView(PaginateStatusesMixin, DetailView):
     context_object_name = 'project'
 
     def get_status_queryset(self):
-        return self.object.statuses
+        return self.object.statuses.select_related('project', 'user')
+
+
+class UserMentionsView(PaginateStatusesMixin, DetailView):
+    template_name = 'status/mentions.html'
+    model = StandupUser
+    context_object_name = 'suser'
+
+    def get_status_queryset(self):
+        return self.object.mentioned_statuses().select_related('project', 'user')
+
+    def get_cursor_paginator(self, qs, per_page):
+        # Page through the user's mentions rather than statuses so each page
+        # is one range of the mention index.
+        mentions = self.object.mentions.select_related('status__project', 'status__user')
+        return CursorPaginator(
+            mentions, per_page, keys=('created', 'status_id'),
+            to_status=lambda mention: mention.status
+        )
+
+
+class ReferenceMixin(object):
+    """Gets the bug, pull request or issue from the url
+
+    The object is an unsaved StatusReference for it.
+
+    """
+    def get_object(self, queryset=None):
+        kind = self.kwargs['kind']
+        number = int(self.kwargs['number'])
+        if number > StatusReference.MAX_NUMBER:
+            raise Http404()
+        project = None
+        if kind != 'bug':
+            project = get_object_or_404(Project, slug=self.kwargs['slug'])
+        return StatusReference(kind=kind, number=number, project=project)
+
+    def get_entries_paginator(self, reference, per_page):
+        # Page through the reference's entries rather than statuses so each
+        # page is one range of the reference index.
+        entries = reference.get_entries().select_related('status__project', 'status__user')
+        return CursorPaginator(
+            entries, per_page, keys=('created', 'status_id'),
+            to_status=lambda entry: entry.status
+        )
+
+
+class ReferenceView(ReferenceMixin, PaginateStatusesMixin, DetailView):
+    template_name = 'status/reference.html'
+    context_object_name = 'reference'
+
+    def get_status_queryset(self):
+        return self.object.statuses().select_related('project', 'user')
+
+    def get_cursor_paginator(self, qs, per_page):
+        return self.get_entries_paginator(self.object, per_page)
+
+
+class TagView(PaginateStatusesMixin, TemplateView):
+    template_name = 'status/tag.html'
+
+    def get_tag(self):
+        return self.kwargs['name'].lower()
+
+    def get_status_queryset(self):
+        return Status.objects.filter(tags__name=self.get_tag()).select_related('project', 'user').order_by(
+            '-tags__created', '-tags__status__id'
+        )
+
+    def get_cursor_paginator(self, qs, per_page):
+        # Page through the tag's entries rather than statuses so each page is
+        # one range of the tag index.
+        entries = StatusTag.objects.filter(name=self.get_tag()).select_related('status__project', 'status__user')
+        return CursorPaginator(
+            entries, per_page, keys=('created', 'status_id'),
+            to_status=lambda entry: entry.status
+        )
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['tag'] = self.get_tag()
+        return ctx
+
+
+class TrendingTagsView(TemplateView):
+    """The most used tags in the last ``days`` days (default 7, at most 90)"""
+    template_name = 'status/tags.html'
+    default_days = 7
+    max_days = 90
+
+    def get_days(self):
+        try:
+            days = int(self.request.GET.get('days', self.default_days))
+        except ValueError:
+            return self.default_days
+        return min(max(days, 1), self.max_days)
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['days'] = self.get_days()
+        ctx['trending'] = StatusTag.trending(now() - timedelta(days=ctx['days']))
+        return ctx
 
 
 class StatusView(PaginateStatusesMixin, TemplateView):
@@ -125,17 +345,73 @@ def statusize(request):
 
 class SearchView(PaginateStatusesMixin, TemplateView):
     template_name = 'status/search.html'
+    # Facet counts worked out while paging through the search index's matches
+    # and whether they only cover some of them
+    index_facets = None
+    index_facets_sampled = False
+
+    def is_ranked(self):
+        """Whether the results are sorted by relevance"""
+        return (
+            settings.SEARCH_BACKEND == 'postgres' and
+            self.request.GET.get('sort') == 'rank' and
+            bool(self.request.GET.get('query'))
+        )
+
+    def is_newest_first(self):
+        return not self.is_ranked()
+
+    def get_facets(self):
+        """Returns dict of facet name -> slug for the facets picked"""
+        return {name: self.request.GET[name] for name in FACETS if self.request.GET.get(name)}
+
+    def paginate_statuses(self, per_page=20):
+        query = self.request.GET.get('query')
+        if query and settings.SEARCH_BACKEND == 'index' and get_search_index().exists():
+            return self.paginate_index_results(query, per_page)
+        return super().paginate_statuses(per_page)
+
+    def paginate_index_results(self, query, per_page):
+        """Pages through the ids the search index matched and fetches just that page"""
+        ids, self.index_facets, self.index_facets_sampled = facet_ids(get_search_index().search(query), self.get_facets())
+
+        paginator = Paginator(ids, per_page)
+        try:
+            page = paginator.page(self.request.GET.get('page') or 1)
+        except PageNotAnInteger:
+            page = paginator.page(1)
+        except EmptyPage:
+            page = paginator.page(paginator.num_pages)
+
+        statuses = Status.objects.select_related('project', 'user').in_bulk(page.object_list)
+        # Statuses deleted since facet_ids() looked are skipped.
+        page.object_list = render_statuses([statuses[pk] for pk in page.object_list if pk in statuses])
+        return page
 
     def get_status_queryset(self):
-        obs = Status.objects.all()
+        obs = Status.objects.select_related('project', 'user')
         query = self.request.GET.get('query')
         if query:
-            obs = obs.filter(generate_query('content', query))
-        return obs
+            obs = search_statuses(obs, query, rank=self.is_ranked())
+        facets = self.get_facets()
+        self.matched = narrow_statuses(search_statuses(Status.objects.all(), query or ''), facets)
+        return narrow_statuses(obs, facets)
 
     def get_context_data(self, **kwargs):
         ctx = super().get_context_data(**kwargs)
         ctx['query'] = self.request.GET.get('query', '')
+        ctx['can_rank'] = settings.SEARCH_BACKEND == 'postgres'
+        ctx['sort'] = 'rank' if self.is_ranked() else ''
+        ctx['selected_facets'] = self.get_facets()
+        ctx['facets_sampled'] = self.index_facets_sampled
+        # Counting everything isn't much of a refinement, so facets are only
+        # shown for searches.
+        if not ctx['query']:
+            ctx['facets'] = {}
+        elif self.index_facets is not None:
+            ctx['facets'] = self.index_facets
+        else:
+            ctx['facets'] = facet_counts(self.matched)
         return ctx
 
 
@@ -184,84 +460,145 @@ class LoginView(TemplateView):
 # FEEDS
 
 
-class StatusesFeed(Feed):
-    feed_type = Atom1Feed
-    feed_limit = 50
-    obj_model = None
+def iter_status_chunks(paginator):
+    """Yields lists of statuses newest first a page at a time
 
-    def get_object(self, request, slug=None):
-        if self.obj_model is None:
-            return None
+    :arg paginator: CursorPaginator
 
-        return self.obj_model.objects.get(slug=slug)
+    """
+    page = paginator.page()
+    while page:
+        yield page.object_list
+        if not page.has_next():
+            break
+        page = paginator.page(before=page.next_cursor)
 
-    def link(self, obj):
-        if obj is None:
-            return '/'
 
-        return obj.get_absolute_url()
+def iter_statuses_json(chunks, include_user=False):
+    """Yields a JSON array of statuses a piece at a time
 
-    def item_title(self, item):
-        return 'From {} at {}'.format(item.user.slug,
-                                      item.created.strftime('%I:%M%p %Z'))
+    :arg chunks: iterable of lists of statuses
+    :arg include_user: whether to include each status' user
 
-    def item_pubdate(self, item):
-        return item.created
+    """
+    yield '['
+    separator = ''
+    for chunk in chunks:
+        for status in render_statuses(chunk):
+            yield separator + json.dumps(status.dictify(include_user))
+            separator = ', '
+    yield ']'
 
-    def item_description(self, item):
-        content = str(item.htmlify())
-        if item.project:
-            content = '<h3>%s</h3>%s' % (item.project.name, content)
 
-        return content
+class UserFeedJSON(BaseDetailView):
+    """A user's statuses as a JSON array, newest first
 
+    This returns ``limit`` statuses (default 20, at most 200) older than the
+    ``before`` cursor (or the newest ones). If there are more, the Link header
+    has the url of the next page. ``all=1`` returns all the user's statuses.
 
-class MainFeed(StatusesFeed):
-    title = 'All status updates'
+    """
+    content_type = 'application/json'
+    model = StandupUser
+    default_limit = 20
+    max_limit = 200
+    # Number of statuses to read and render at a time for all=1
+    chunk_size = 100
+    # Whether each status includes its user
+    include_user = False
 
-    def items(self):
-        return Status.objects.select_related('project', 'user')[:self.feed_limit]
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
 
+        def get_response(etag):
+            return self.render_to_response(self.get_context_data(object=self.object))
 
-class UserFeed(StatusesFeed):
-    obj_model = StandupUser
+        return conditional_response(
+            request, self.get_statuses(self.object), self.get_scope(self.object), get_response
+        )
 
-    def title(self, obj):
-        return 'Updates by {}'.format(obj.slug)
+    def get_statuses(self, user):
+        """Returns the queryset of statuses in the feed, newest first"""
+        return user.statuses.all()
 
-    def items(self, obj):
-        return obj.statuses.select_related('project', 'user')[:self.feed_limit]
+    def get_scope(self, user):
+        """Returns the scope of the feed; see ``feeds.status_scopes()``"""
+        return ('user', user.pk)
 
+    def get_paginator(self, user, per_page):
+        return CursorPaginator(self.get_statuses(user).select_related('project'), per_page)
 
-class ProjectFeed(StatusesFeed):
-    obj_model = Project
+    def render_to_response(self, context):
+        user = context['object']
+        if self.request.GET.get('all') == '1':
+            chunks = iter_status_chunks(self.get_paginator(user, self.chunk_size))
+            return StreamingHttpResponse(
+                iter_statuses_json(chunks, self.include_user), content_type=self.content_type
+            )
 
-    def title(self, obj):
-        return 'Updates for {}'.format(obj.name)
+        try:
+            limit = int(self.request.GET.get('limit', self.default_limit))
+        except ValueError:
+            return HttpResponseBadRequest('limit must be an integer')
+        if not 1 <= limit <= self.max_limit:
+            return HttpResponseBadRequest('limit must be between 1 and %d' % self.max_limit)
 
-    def items(self, obj):
-        return obj.statuses.select_related('project', 'user')[:self.feed_limit]
+        try:
+            page = self.get_paginator(user, limit).page(before=self.request.GET.get('before'))
+        except InvalidCursor:
+            return HttpResponseBadRequest('invalid before cursor')
 
+        response = StreamingHttpResponse(
+            iter_statuses_json([page.object_list], self.include_user), content_type=self.content_type
+        )
+        if page.has_next():
+            next_url = '%s?%s' % (self.request.path, urlencode({
+                'limit': limit,
+                'before': page.next_cursor,
+            }))
+            response['Link'] = '<%s>; rel="next"' % self.request.build_absolute_uri(next_url)
+        return response
 
-class TeamFeed(StatusesFeed):
-    obj_model = Team
 
-    def title(self, obj):
-        return 'Updates from {}'.format(obj.name)
+class UserMentionsJSON(UserFeedJSON):
+    """The statuses that @mention a user as a JSON array, newest first
 
-    def items(self, obj):
-        return obj.statuses().select_related('project', 'user')[:self.feed_limit]
+    This takes the same parameters as UserFeedJSON and pages through the
+    user's mentions rather than statuses.
 
+    """
+    include_user = True
 
-class UserFeedJSON(BaseDetailView):
-    content_type = 'application/json'
-    model = StandupUser
+    def get_statuses(self, user):
+        return user.mentioned_statuses()
 
-    def render_to_response(self, context):
-        user = context['object']
-        statuses = user.statuses.select_related('project').all()
-        statuses = json.dumps([s.dictify(False) for s in statuses])
-        return HttpResponse(statuses, content_type=self.content_type)
+    def get_scope(self, user):
+        return ('mentions', user.slug)
+
+    def get_paginator(self, user, per_page):
+        mentions = user.mentions.select_related('status__project', 'status__user')
+        return CursorPaginator(
+            mentions, per_page, keys=('created', 'status_id'),
+            to_status=lambda mention: mention.status
+        )
+
+
+class ReferenceJSON(ReferenceMixin, UserFeedJSON):
+    """The statuses referring to a bug, pull request or issue as a JSON array, newest first
+
+    This takes the same parameters as UserFeedJSON.
+
+    """
+    include_user = True
+
+    def get_statuses(self, reference):
+        return reference.statuses()
+
+    def get_scope(self, reference):
+        return reference_scope(reference.kind, reference.number, reference.project_id)
+
+    def get_paginator(self, reference, per_page):
+        return self.get_entries_paginator(reference, per_page)
 
 
 # RANDOM STUFF
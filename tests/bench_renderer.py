@@ -0,0 +1,105 @@
+"""
+Benchmarks the status renderer against the chained regex/str.replace renderer
+it replaced.
+
+To use, do::
+
+  $ python tests/bench_renderer.py
+
+This doesn't touch the database--mentions are resolved from a fixed set of
+slugs--so it only needs enough configuration for Django to start up.
+
+"""
+
+import os
+import sys
+import timeit
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'standup.settings')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_ID', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_SECRET', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa
+django.setup()
+
+from standup.status.renderer import (  # noqa
+    BUG_RE,
+    ISSUE_RE,
+    PULL_RE,
+    TAG_RE,
+    USER_RE,
+    clean,
+    linkify_references,
+)
+
+
+REPO_URL = 'https://github.com/mozilla/standup/'
+USERS = {'willkg', 'pmac', 'groovecoder'}
+
+LINE = (
+    'Landed pr 123 and fixed bug 1234567 for #release with @willkg and @pmac; '
+    'still looking at issue #456 with @someone for #perf. '
+)
+
+
+def mention_url(slug):
+    if slug in USERS:
+        return '/user/%s/' % slug
+    return None
+
+
+def legacy_linkify(text, repo_url):
+    """The chained regex/str.replace pipeline from before the renderer module"""
+    formatted = BUG_RE.sub(
+        r'<a href="http://bugzilla.mozilla.org/show_bug.cgi?id=\2">\1</a>',
+        text)
+
+    checked = set()
+    for tag in TAG_RE.findall(formatted):
+        if tag in checked:
+            continue
+        hashtag = '#%s' % tag
+        formatted = formatted.replace(hashtag,
+                                      '<span class="tag tag-%s">%s</span>' %
+                                      (tag.lower(), hashtag))
+        checked.add(tag)
+
+    checked = set()
+    for slug in USER_RE.findall(formatted):
+        if slug in checked:
+            continue
+        url = mention_url(slug)
+        if url:
+            at_slug = '@%s' % slug
+            formatted = formatted.replace(at_slug, '<a href="%s">%s</a>' % (url, at_slug))
+        checked.add(slug)
+
+    repo = repo_url.rstrip('/')
+    formatted = PULL_RE.sub(r'<a href="%s/pull/\2">\1</a>' % repo, formatted)
+    formatted = ISSUE_RE.sub(r'<a href="%s/issues/\2">\1</a>' % repo, formatted)
+    return formatted
+
+
+def main():
+    print('%8s  %12s  %12s  %8s' % ('lines', 'legacy (ms)', 'single (ms)', 'speedup'))
+    for lines in (1, 10, 100, 1000):
+        # Give every line its own hashtags so the legacy renderer has to do a
+        # str.replace over the whole text for each one.
+        text = clean(''.join(
+            LINE.replace('#perf', '#perf%d' % i) for i in range(lines)
+        ))
+        number = max(1, 2000 // lines)
+
+        legacy = timeit.timeit(lambda: legacy_linkify(text, REPO_URL), number=number)
+        single = timeit.timeit(lambda: linkify_references(text, REPO_URL, mention_url), number=number)
+        print('%8d  %12.3f  %12.3f  %7.1fx' % (
+            lines, legacy * 1000 / number, single * 1000 / number, legacy / single
+        ))
+
+
+if __name__ == '__main__':
+    main()
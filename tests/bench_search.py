@@ -0,0 +1,103 @@
+"""
+Benchmarks substring search of statuses with and without the trigram index.
+
+This needs a Postgres database that has been migrated and that you don't mind
+filling with junk. To use, do::
+
+  $ DATABASE_URL=postgres://localhost/standup_bench ./manage.py migrate
+  $ DATABASE_URL=postgres://localhost/standup_bench python tests/bench_search.py
+
+It seeds the status table with ``--rows`` statuses (a million by default) if it
+has fewer, then times the query behind the first page of search results and
+all the matches for some searches. "icontains" is Django's icontains,
+which can't use an index; "trigram" is trgm_icontains, which can.
+
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'standup.settings')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_ID', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_SECRET', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa
+django.setup()
+
+from django.contrib.auth.models import User  # noqa
+from django.db import connection  # noqa
+
+from standup.status.models import StandupUser, Status  # noqa
+
+
+SEARCHES = [
+    # Partial word, bug number, url fragment, something that isn't there
+    'deploy',
+    '12345',
+    'github.com/mozilla/standup/pull/4',
+    'zzyzx',
+]
+
+SEED_SQL = """
+INSERT INTO status (created, user_id, project_id, content, content_html,
+                    html_version, html_repo_url, html_mentions)
+SELECT now() - i * interval '1 minute', %s, NULL,
+       (ARRAY['Deployed', 'Reviewed', 'Fixed', 'Wrote tests for', 'Debugged'])[1 + i %% 5]
+       || ' bug ' || (i * 7919) %% 2000000
+       || ' and https://github.com/mozilla/standup/pull/' || i %% 1000
+       || ' ' || md5(i::text),
+       '', 0, '', ''
+FROM generate_series(1, %s) AS i
+"""
+
+
+def seed(rows):
+    have = Status.objects.count()
+    if have >= rows:
+        return
+    user = User.objects.create(username='bench%d' % have)
+    profile = StandupUser.objects.create(user=user, slug='bench%d' % have)
+    print('Seeding %d statuses...' % (rows - have))
+    with connection.cursor() as cursor:
+        cursor.execute(SEED_SQL, [profile.id, rows - have])
+        cursor.execute('ANALYZE status')
+
+
+def time_query(qs, number):
+    # .all() so each run queries rather than using the queryset's cache
+    return timeit.timeit(lambda: list(qs.all()), number=number) * 1000 / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--number', type=int, default=5, help='times to run each query')
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        sys.exit('This needs DATABASE_URL to point at a Postgres database.')
+
+    seed(args.rows)
+
+    print('%-36s  %-10s  %14s  %14s' % ('search', 'query', 'icontains (ms)', 'trigram (ms)'))
+    for text in SEARCHES:
+        before = Status.objects.filter(content__icontains=text)
+        after = Status.objects.filter(content__trgm_icontains=text)
+        for name, get_qs in [
+            ('page', lambda qs: qs.values_list('id')[:20]),
+            ('all', lambda qs: qs.values_list('id')),
+        ]:
+            print('%-36s  %-10s  %14.1f  %14.1f' % (
+                text, name,
+                time_query(get_qs(before), args.number),
+                time_query(get_qs(after), args.number),
+            ))
+
+
+if __name__ == '__main__':
+    main()
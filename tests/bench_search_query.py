@@ -0,0 +1,114 @@
+"""
+Benchmarks parsing search text, including pathological search text.
+
+To use, do::
+
+  $ python tests/bench_search_query.py
+
+For each kind of search text, this times the character-at-a-time tokenizer the
+scanner replaced, the scanner, and generate_query() with the parse cache cold
+and warm (as when paging through results).
+
+This doesn't touch the database, so it only needs enough configuration for
+Django to start up.
+
+"""
+
+import os
+import sys
+import timeit
+
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'standup.settings')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+os.environ.setdefault('SECRET_KEY', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_ID', 'bench')
+os.environ.setdefault('OIDC_RP_CLIENT_SECRET', 'bench')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa
+django.setup()
+
+from standup.status.search import generate_query, parse, scan  # noqa
+
+
+TEXTS = [
+    ('typical', 'deploy OR "bug 12345" AND standup'),
+    ('5000 words', ' '.join('word%d' % i for i in range(5000))),
+    ('5000 alternating', ' AND '.join('a%d OR b%d' % (i, i) for i in range(2500))),
+    ('unbalanced quote', '"' + ' '.join('word%d' % i for i in range(5000))),
+    ('many quotes', ' '.join('"a%d' % i for i in range(5000))),
+    ('escapes', '\\"\\\\' * 5000),
+]
+
+
+def legacy_to_tokens(text):
+    """The character-at-a-time tokenizer from before the scanner"""
+    in_quotes = False
+    escape = False
+
+    tokens = []
+    token = []
+
+    for c in text:
+        if c == u'\\':
+            escape = True
+            token.append(c)
+            continue
+
+        if in_quotes:
+            if not escape and c == u'"':
+                in_quotes = False
+            token.append(c)
+
+        elif not escape and c == u'"':
+            in_quotes = True
+            token.append(c)
+
+        elif c in u' \t\r\n':
+            if token:
+                tokens.append(u''.join(token))
+                token = []
+
+        else:
+            token.append(c)
+
+        escape = False
+
+    if in_quotes:
+        if token:
+            token.append(u'"')
+        else:
+            tokens[-1] = tokens[-1] + u'"'
+
+    if token:
+        tokens.append(u''.join(token))
+
+    return tokens
+
+
+def time_ms(func, number):
+    return timeit.timeit(func, number=number) * 1000 / number
+
+
+def cold(text):
+    parse.cache_clear()
+    generate_query('content', text)
+
+
+def main():
+    print('%-18s  %10s  %10s  %10s  %10s' % ('text', 'legacy tok', 'scan', 'cold', 'warm'))
+    for name, text in TEXTS:
+        number = 1000 if len(text) < 100 else 20
+        print('%-18s  %10.3f  %10.3f  %10.3f  %10.3f' % (
+            name,
+            time_ms(lambda: legacy_to_tokens(text), number),
+            time_ms(lambda: scan(text), number),
+            time_ms(lambda: cold(text), number),
+            time_ms(lambda: generate_query('content', text), number),
+        ))
+    print('(times in ms)')
+
+
+if __name__ == '__main__':
+    main()